@@ -0,0 +1,175 @@
+"""
+Stress bake's state files with many bake processes running at once.
+
+Each round starts baking, deleting and config-writing processes together in a throwaway home folder, then checks
+that config.json and registry.json still parse and hold every change, and that every wrapper is complete and runs.
+It runs offline. From the repository's root:
+
+    python -m benchmarks.stress --processes 32 --rounds 3
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from benchmarks.suite import REPO_PATH, make_home
+from commands.wrapper import WrapperMode, parse_wrapper
+from utils.console import MessageType, format_msg
+
+DEFAULT_PROCESSES = 32
+DEFAULT_ROUNDS = 3
+STRESS_MODES = (WrapperMode.EXEC, WrapperMode.DIRECT, WrapperMode.DISPATCH)
+OUTPUT_MARKER = "stress-ok"
+# Adds one key to the config in its own transaction, as bake's own config writes do
+CONFIG_WRITER = ("import sys; from config import Config\n"
+                 "with Config(sys.argv[1]).transaction() as data:\n"
+                 "    data.setdefault('stress', {})[sys.argv[2]] = True\n")
+
+
+def run_process(env: dict[str, str], command: list[str]) -> tuple[list[str], int, str]:
+    """
+    Run one process to completion.
+
+    :param env: Environment from make_home.
+    :param command: The command line.
+    :return: The command line, its exit code and its stderr.
+    """
+    result = subprocess.run(command, cwd=REPO_PATH, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    return command, result.returncode, result.stderr
+
+
+def stress_round(env: dict[str, str], round_index: int, processes: int) -> tuple[set[str], set[str], list[str]]:
+    """
+    Start a round of processes at once. A third bake new commands, a third delete the commands the previous round
+    baked, and the rest write to the config.
+
+    :param env: Environment from make_home.
+    :param round_index: The round's number.
+    :param processes: Number of processes.
+    :return: The commands baked and deleted, and the failed processes.
+    """
+    bake = [sys.executable, os.path.join(REPO_PATH, "main.py")]
+    config_path = os.path.join(env["HOME"], ".bake", "config.json")
+    source = os.path.join(env["HOME"], "src", "stress.py")
+
+    commands, baked, deleted = [], set(), set()
+    for index in range(processes):
+        if index % 3 == 0:
+            name = f"stress-{round_index}-{index}"
+            mode = STRESS_MODES[(index // 3) % len(STRESS_MODES)]
+            commands.append(bake + [name, source, "-w", mode.value])
+            baked.add(name)
+        elif index % 3 == 1 and round_index:
+            name = f"stress-{round_index - 1}-{index - 1}"
+            commands.append(bake + ["-d", name])
+            deleted.add(name)
+        else:
+            commands.append([sys.executable, "-c", CONFIG_WRITER, config_path, f"{round_index}-{index}"])
+
+    with ThreadPoolExecutor(processes) as executor:
+        results = list(executor.map(lambda command: run_process(env, command), commands))
+    failures = [f"{' '.join(command[1:])} exited with {code}: {stderr.strip()}"
+                for command, code, stderr in results if code]
+    return baked, deleted, failures
+
+
+def check_state(env: dict[str, str], expected: set[str], removed: set[str], config_keys: set[str]) -> list[str]:
+    """
+    Check that bake's state survived the concurrent writes.
+
+    :param env: Environment from make_home.
+    :param expected: Commands that should exist.
+    :param removed: Commands that should be gone.
+    :param config_keys: Keys the config writers added.
+    :return: The problems found.
+    """
+    bake_folder = os.path.join(env["HOME"], ".bake")
+    commands_path = os.path.join(env["HOME"], "commands")
+    problems = []
+
+    def load(name: str) -> dict[str, Any]:
+        try:
+            with open(os.path.join(bake_folder, name), "r") as file:
+                return json.loads(file.read())
+        except (OSError, ValueError) as error:
+            problems.append(f"{name} is unreadable: {error}")
+            return {}
+
+    config = load("config.json")
+    if config and config.get("main_path") != commands_path:
+        problems.append("config.json lost its main_path")
+    missing_keys = config_keys - set(config.get("stress", {}))
+    if config and missing_keys:
+        problems.append(f"config.json lost {len(missing_keys)} concurrent write(s)")
+
+    registry = load("registry.json").get("commands", {})
+    for name in sorted(expected - set(registry)):
+        problems.append(f"'{name}' is missing from registry.json")
+    for name in sorted(removed & set(registry)):
+        problems.append(f"'{name}' was deleted but is still in registry.json")
+
+    for name in sorted(removed):
+        if os.path.lexists(os.path.join(commands_path, name)):
+            problems.append(f"'{name}' was deleted but its wrapper is still there")
+    for name in sorted(expected):
+        path = os.path.join(commands_path, name)
+        if not os.path.islink(path):
+            try:
+                with open(path, "r") as file:
+                    if not parse_wrapper(file.read()):
+                        problems.append(f"'{name}' has an incomplete wrapper")
+                        continue
+            except OSError as error:
+                problems.append(f"'{name}' can't be read: {error}")
+                continue
+        result = subprocess.run([path], env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        if result.returncode or result.stdout.strip() != OUTPUT_MARKER:
+            problems.append(f"'{name}' doesn't run: exit code {result.returncode}, {result.stderr.strip()}")
+    return problems
+
+
+def main() -> None:
+    """Run the stress rounds and report any corruption."""
+    parser = argparse.ArgumentParser(description="Run many bake processes at once and check bake's state.")
+    parser.add_argument("--processes", help=f"Processes started at once per round (default: {DEFAULT_PROCESSES})",
+                        type=int, default=DEFAULT_PROCESSES)
+    parser.add_argument("--rounds", help=f"Number of rounds (default: {DEFAULT_ROUNDS})", type=int,
+                        default=DEFAULT_ROUNDS)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bake-stress-")
+    try:
+        env = make_home(root, 0)
+        with open(os.path.join(env["HOME"], "src", "stress.py"), "w") as file:
+            file.write(f"print({OUTPUT_MARKER!r})\n")
+
+        expected, removed, config_keys, problems = set(), set(), set(), []
+        for round_index in range(args.rounds):
+            baked, deleted, failures = stress_round(env, round_index, args.processes)
+            expected = (expected | baked) - deleted
+            removed |= deleted
+            config_keys |= {f"{round_index}-{index}" for index in range(args.processes)
+                            if index % 3 == 2 or (index % 3 == 1 and not round_index)}
+            round_problems = failures + check_state(env, expected, removed, config_keys)
+            print(f"{format_msg(MessageType.ERROR if round_problems else MessageType.NOTICE)} Round "
+                  f"{round_index + 1}: {len(baked)} baked, {len(deleted)} deleted, {len(round_problems)} problem(s)")
+            problems += round_problems
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    for problem in problems:
+        print(format_msg(MessageType.ERROR), problem)
+    if problems:
+        sys.exit(1)
+    print(format_msg(MessageType.NOTICE), f"Bake's state survived {args.rounds} round(s) of {args.processes} "
+                                          f"concurrent processes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Benchmark bake's CLI operations and the startup cost of baked wrappers.
+
+Every run happens in a throwaway home folder holding a synthetic commands directory, with a fresh cached
+version check so no network request is made. Run it from the repository's root:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --output new.json --compare results.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Optional
+
+from commands.dispatch import CommandTable
+from commands.wrapper import WrapperMode, render_wrapper
+from utils.console import MessageType, format_msg
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_VERSION = 1
+DEFAULT_SIZES = (10, 1000, 10000)
+DEFAULT_REPEATS = 5
+DEFAULT_THRESHOLD = 0.2
+# Differences below this many seconds are noise, however large they are relatively
+REGRESSION_FLOOR = 0.002
+WRAPPER_MODES = (WrapperMode.SHELL, WrapperMode.EXEC, WrapperMode.DIRECT)
+
+
+def read_version() -> Optional[float]:
+    """
+    Read the version of bake being benchmarked.
+
+    :return: The version, or None if version.txt can't be read.
+    """
+    try:
+        with open(os.path.join(REPO_PATH, "version.txt"), "r") as version_file:
+            return float(version_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def get_environment(sizes: list[int], repeats: int) -> dict[str, Any]:
+    """
+    Describe the machine and the code being benchmarked, so results are only compared like for like.
+
+    :param sizes: The command directory sizes.
+    :param repeats: Timed runs per metric.
+    :return: Environment metadata.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_PATH, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.time(),
+        "bake_version": read_version(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "executable": sys.executable,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "sizes": sizes,
+        "repeats": repeats
+    }
+
+
+def make_home(root: str, size: int) -> dict[str, str]:
+    """
+    Create a home folder with bake configured and a synthetic commands directory.
+
+    :param root: Folder to create the home folder in.
+    :param size: Number of commands.
+    :return: The environment to run bake with, pointing HOME at the new home folder.
+    """
+    home = os.path.join(root, f"home-{size}")
+    bake_folder = os.path.join(home, ".bake")
+    commands_path = os.path.join(home, "commands")
+    bin_path = os.path.join(home, ".local", "bin")
+    for folder in (bake_folder, commands_path, bin_path, os.path.join(home, "src")):
+        os.makedirs(folder)
+
+    version = read_version()
+    config = {"main_path": commands_path, "is_baked": True, "version": version, "rc_path": commands_path,
+              "migrations": ["remove_old_folder"], "prefetch_updates": False,
+              # Never reached while the cached version below is fresh, but a stale cache must not go online
+              "version_url": "http://127.0.0.1:9/version.txt"}
+    with open(os.path.join(bake_folder, "config.json"), "w") as file:
+        file.write(json.dumps(config))
+    with open(os.path.join(bake_folder, "version_cache.json"), "w") as file:
+        file.write(json.dumps({"version": version, "checked": time.time()}))
+    with open(os.path.join(bin_path, "bake"), "w") as file:
+        file.write(render_wrapper(os.path.join(REPO_PATH, "main.py"), interpreter=sys.executable,
+                                  mode=WrapperMode.EXEC))
+    os.chmod(os.path.join(bin_path, "bake"), 0o755)
+
+    source = os.path.join(home, "src", "script.py")
+    with open(source, "w") as file:
+        file.write("pass\n")
+    for index in range(size):
+        with open(os.path.join(commands_path, f"command-{index:05d}"), "w") as file:
+            file.write(render_wrapper(source, interpreter=sys.executable, mode=WrapperMode.EXEC,
+                                      description=f"Synthetic command {index}"))
+
+    return dict(os.environ, HOME=home, SHELL="/bin/sh")
+
+
+def summarize(times: list[float]) -> dict[str, Any]:
+    """
+    Summarize the timed runs of a metric.
+
+    :param times: Seconds each run took.
+    :return: Median, minimum and mean seconds, and the number of runs.
+    """
+    return {"median": statistics.median(times), "min": min(times), "mean": statistics.fmean(times),
+            "runs": len(times)}
+
+
+def measure(function: Callable[[], Any], repeats: int) -> dict[str, Any]:
+    """
+    Time a function after one untimed warm-up call.
+
+    :param function: The function.
+    :param repeats: Timed calls.
+    :return: The summarized timings.
+    """
+    function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def run_bake(env: dict[str, str], *args: str) -> None:
+    """
+    Run bake end to end.
+
+    :param env: Environment from make_home.
+    :param args: Arguments to bake.
+    :raises subprocess.CalledProcessError: If bake fails.
+    """
+    subprocess.run([sys.executable, os.path.join(REPO_PATH, "main.py"), *args], env=env, check=True,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+
+def bench_size(root: str, size: int, repeats: int) -> dict[str, dict[str, Any]]:
+    """
+    Benchmark the CLI against a commands directory of one size.
+
+    :param root: Folder to create the home folder in.
+    :param size: Number of commands.
+    :param repeats: Timed runs per metric.
+    :return: Metrics keyed by 'operation/size'.
+    """
+    env = make_home(root, size)
+    home = env["HOME"]
+    commands_path = os.path.join(home, "commands")
+    source = os.path.join(home, "src", "script.py")
+    existing = f"command-{size // 2:05d}"
+
+    registry_path = os.path.join(home, ".bake", "registry.json")
+    exists_check = ("import sys; from commands.handler import CommandHandler; "
+                    "sys.exit(not CommandHandler(sys.argv[1], registry_path=sys.argv[2]).command_exists(sys.argv[3]))")
+
+    def command_exists() -> None:
+        # A fresh process, so the registry index is loaded from disk as it is by every bake invocation
+        subprocess.run([sys.executable, "-c", exists_check, commands_path, registry_path, existing],
+                       cwd=REPO_PATH, env=env, check=True)
+
+    metrics = {
+        "reindex": measure(lambda: run_bake(env, "--reindex"), repeats),
+        "list": measure(lambda: run_bake(env, "-l"), repeats),
+        "view": measure(lambda: run_bake(env, "-vc", existing), repeats),
+        "command_exists": measure(command_exists, repeats)
+    }
+
+    # A command can only be created once it's deleted, so both are timed from the same pairs of runs
+    for suffix, wrapper_args in (("", ()), ("_dispatch", ("-w", WrapperMode.DISPATCH.value))):
+        create_times, delete_times = [], []
+        for repeat in range(repeats + 1):
+            start = time.perf_counter()
+            run_bake(env, "bench-new", source, *wrapper_args)
+            created = time.perf_counter()
+            run_bake(env, "-d", "bench-new")
+            if repeat:  # The first pair warms up
+                create_times.append(created - start)
+                delete_times.append(time.perf_counter() - created)
+        metrics["create" + suffix], metrics["delete" + suffix] = summarize(create_times), summarize(delete_times)
+
+    shutil.rmtree(home, ignore_errors=True)
+    return {f"{name}/{size}": value for name, value in metrics.items()}
+
+
+def bench_wrappers(root: str, repeats: int, table_size: int) -> dict[str, dict[str, Any]]:
+    """
+    Benchmark the cold start of each wrapper format against running the interpreter on the script directly.
+
+    :param root: Folder to write the wrappers in.
+    :param repeats: Timed runs per metric.
+    :param table_size: Number of commands in the dispatcher's command table.
+    :return: Metrics keyed by 'wrapper/format', plus 'wrapper/python' for the direct run and
+             'wrapper/dispatch-exec' for a dispatched command run by another interpreter.
+    """
+    source = os.path.join(root, "noop.py")
+    with open(source, "w") as file:
+        file.write("pass\n")
+
+    def run(command: list[str]) -> Callable[[], None]:
+        return lambda: subprocess.run(command, check=True, stdin=subprocess.DEVNULL)
+
+    metrics = {"wrapper/python": measure(run([sys.executable, source]), repeats)}
+    for mode in WRAPPER_MODES:
+        wrapper_path = os.path.join(root, f"noop-{mode.value}")
+        with open(wrapper_path, "w") as file:
+            file.write(render_wrapper(source, "#!/bin/sh" if mode is WrapperMode.SHELL else None, sys.executable,
+                                      mode))
+        os.chmod(wrapper_path, 0o755)
+        metrics[f"wrapper/{mode.value}"] = measure(run([wrapper_path]), repeats)
+
+    # Dispatched commands look themselves up in a table as large as the largest commands directory. A second path
+    # to the same interpreter makes the dispatcher exec it instead of running the script in-process
+    table = CommandTable(os.path.join(root, "commands.table"), os.path.join(root, "bake-run"))
+    table.install_dispatcher(sys.executable)
+    links_path = os.path.join(root, "dispatch")
+    os.makedirs(links_path)
+    alias = os.path.join(root, "python-alias")
+    os.symlink(sys.executable, alias)
+    with table.batch():
+        for index in range(max(table_size, 2)):
+            table.link(os.path.join(links_path, f"command-{index:05d}"),
+                       render_wrapper(source, interpreter=alias if index == 1 else sys.executable,
+                                      mode=WrapperMode.DISPATCH))
+    metrics["wrapper/dispatch"] = measure(run([os.path.join(links_path, "command-00000")]), repeats)
+    metrics["wrapper/dispatch-exec"] = measure(run([os.path.join(links_path, "command-00001")]), repeats)
+    return metrics
+
+
+def compare_results(baseline: dict[str, Any], latest: dict[str, Any],
+                    threshold: float = DEFAULT_THRESHOLD) -> list[dict[str, Any]]:
+    """
+    Compare the median of every metric two result files share.
+
+    :param baseline: The earlier results.
+    :param latest: The later results.
+    :param threshold: Fraction a metric may grow by before it counts as a regression.
+    :return: One row per shared metric, with both medians, the relative change and whether it regressed.
+    """
+    rows = []
+    for name, before in baseline["metrics"].items():
+        after = latest["metrics"].get(name)
+        if not after:
+            continue
+        old, new = before["median"], after["median"]
+        change = (new - old) / old if old else 0.0
+        rows.append({"metric": name, "before": old, "after": new, "change": change,
+                     "regressed": new - old > REGRESSION_FLOOR and change > threshold})
+    return rows
+
+
+def main() -> None:
+    """Run the suite, write the results and optionally compare them with a baseline."""
+    parser = argparse.ArgumentParser(description="Benchmark bake's CLI and wrapper startup.")
+    parser.add_argument("--sizes", help="Numbers of synthetic commands (default: 10 1000 10000)", type=int,
+                        nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--repeats", help=f"Timed runs per metric (default: {DEFAULT_REPEATS})", type=int,
+                        default=DEFAULT_REPEATS)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--results", help="Compare these existing results instead of running the suite")
+    parser.add_argument("--compare", help="Fail if any metric regressed against these baseline results")
+    parser.add_argument("--threshold", help=f"With --compare, the fraction a metric may grow by (default: "
+                                            f"{DEFAULT_THRESHOLD})", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results, "r") as file:
+            results = json.loads(file.read())
+    else:
+        results = {"version": RESULTS_VERSION, "environment": get_environment(args.sizes, args.repeats),
+                   "metrics": {}}
+        root = tempfile.mkdtemp(prefix="bake-bench-")
+        try:
+            for size in args.sizes:
+                results["metrics"].update(bench_size(root, size, args.repeats))
+            results["metrics"].update(bench_wrappers(root, args.repeats, max(args.sizes)))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        for name, metric in results["metrics"].items():
+            print(f"{format_msg(MessageType.NOTICE)} {name:<22} {metric['median'] * 1000:9.2f} ms "
+                  f"(min {metric['min'] * 1000:.2f} ms)")
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(json.dumps(results, indent=4))
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.loads(file.read())
+        rows = compare_results(baseline, results, args.threshold)
+        for row in rows:
+            message_type = MessageType.ERROR if row["regressed"] else MessageType.NOTICE
+            print(f"{format_msg(message_type)} {row['metric']:<22} {row['before'] * 1000:9.2f} ms -> "
+                  f"{row['after'] * 1000:9.2f} ms ({row['change']:+.0%})")
+        regressions = [row for row in rows if row["regressed"]]
+        if regressions:
+            print(format_msg(MessageType.ERROR), f"{len(regressions)} metric(s) regressed by more than "
+                                                 f"{args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
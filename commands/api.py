@@ -0,0 +1,204 @@
+import fnmatch
+import itertools
+import os
+import subprocess
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from commands.cache import get_cache_settings
+from commands.handler import CommandHandler
+from commands.limits import get_limit_settings
+from commands.wrapper import DEFAULT_WRAPPER_MODE, WrapperMode
+from config import Config
+from constants import CONFIG_LOCATION, REGISTRY_LOCATION
+
+
+class BakeError(Exception):
+    """A request bake can't carry out, such as baking a command that already exists."""
+
+
+class BakeAPI:
+    def __init__(self, config_path: str = CONFIG_LOCATION, registry_path: str = REGISTRY_LOCATION) -> None:
+        """
+        Initializes the BakeAPI instance, bake's operations as a library. Results are returned as plain data and
+        failures raised as BakeError instead of printed, and nothing the CLI does at startup (setup, migrations,
+        update checks) runs. One instance can serve any number of calls, and picks up changes other bake
+        processes make to the registry.
+
+        :param config_path: Path of bake's config, which names the commands directory.
+        :param registry_path: Path of the registry index.
+        """
+        self.config = Config(config_path)
+        try:
+            config_data = self.config.load_config()
+        except (OSError, ValueError) as error:
+            raise BakeError(f"Bake isn't set up, run 'bake' once first: {error}")
+        self.handler = CommandHandler(config_data["main_path"], registry_path=registry_path)
+        self.registry_mtime: Optional[int] = None
+
+    def get_registry_mtime(self) -> Optional[int]:
+        """
+        Get the registry file's modification time.
+
+        :return: The modification time in nanoseconds, or None if there is no registry file.
+        """
+        try:
+            return os.stat(self.handler.registry.config.path).st_mtime_ns
+        except OSError:
+            return None
+
+    @contextmanager
+    def synced(self, writes: bool = False) -> Iterator[CommandHandler]:
+        """
+        Reload the registry if another process changed it since this instance last used it.
+
+        :param writes: The block changes the registry, so its own write shouldn't trigger a reload.
+        :return: The command handler.
+        """
+        registry = self.handler.registry
+        if not registry.batch_depth:
+            mtime = self.get_registry_mtime()
+            if mtime != self.registry_mtime:
+                registry.commands = None
+                self.handler.table.entries = None
+                self.registry_mtime = mtime
+        yield self.handler
+        if writes and not registry.batch_depth:
+            self.registry_mtime = self.get_registry_mtime()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Group calls so the registry is written once when the block finishes.
+        """
+        with self.synced(writes=True) as handler:
+            with handler.batch():
+                yield
+
+    def get_command(self, name: str) -> dict[str, Any]:
+        """
+        Describe a baked command.
+
+        :param name: The name of the command.
+        :return: The command's name, wrapper path, mode, shebang, interpreter and source, plus its target,
+                 description and telemetry setting where set.
+        :raises BakeError: If the command doesn't exist or wasn't baked by bake.
+        """
+        with self.synced() as handler:
+            if not handler.command_exists(name):
+                raise BakeError(f"Command '{name}' does not exist")
+            wrapper = handler.parse_command(name)
+            if not wrapper:
+                raise BakeError(f"Command '{name}' is not a baked command")
+            return {"name": name, "path": handler.get_command_path(name), **wrapper}
+
+    def command_exists(self, name: str) -> bool:
+        """
+        Check whether a command exists.
+
+        :param name: The name of the command.
+        :return: True if it exists.
+        """
+        with self.synced() as handler:
+            return handler.command_exists(name)
+
+    def list_commands(self, pattern: Optional[str] = None, interpreter: Optional[str] = None, offset: int = 0,
+                      limit: Optional[int] = None) -> list[dict[str, Any]]:
+        """
+        List baked commands from the registry, sorted by name.
+
+        :param pattern: Only list commands whose names match this glob.
+        :param interpreter: Only list commands using this interpreter (a path or a name like 'python3').
+        :param offset: Skip this many commands.
+        :param limit: List at most this many commands.
+        :return: Each command's name, wrapper path, mode, interpreter, source and description.
+        """
+        with self.synced() as handler:
+            registry = handler.get_registry()
+            rows = []
+            for name in sorted(registry.names()):
+                if pattern and not fnmatch.fnmatchcase(name, pattern):
+                    continue
+                wrapper = registry.get(name).get("wrapper") or {}
+                if interpreter and interpreter not in (wrapper.get("interpreter"),
+                                                       os.path.basename(wrapper.get("interpreter") or "")):
+                    continue
+                rows.append({"name": name, "path": handler.get_command_path(name), "mode": wrapper.get("mode"),
+                             "interpreter": wrapper.get("interpreter"), "source": wrapper.get("source"),
+                             "description": wrapper.get("description")})
+            return list(itertools.islice(rows, offset, offset + limit if limit is not None else None))
+
+    def create_command(self, name: str, source: str, interpreter: Optional[str] = None,
+                       shebang: Optional[str] = None, wrapper: Optional[str] = None, description: Optional[str] = None,
+                       telemetry: bool = False, compile: bool = False, bundle: bool = False, snapshot: bool = False,
+                       cache: Any = None, limits: Optional[dict[str, Any]] = None,
+                       replace: bool = False) -> dict[str, Any]:
+        """
+        Bake a command, as 'bake NAME SOURCE' does.
+
+        :param name: The name of the command.
+        :param source: The script to run.
+        :param interpreter: A path, a name, or a version spec like '3.11' (defaults to 'python3').
+        :param shebang: Optional shebang line.
+        :param wrapper: Optional wrapper format (see WrapperMode). Defaults to direct with telemetry.
+        :param description: Optional description, for search.
+        :param telemetry: Record each run of the command.
+        :param compile: Precompile the script and its local imports.
+        :param bundle: Precompile and pack the script and its local imports into a zipapp.
+        :param snapshot: Run the command from a copy of the script and its local imports in the snapshot store.
+        :param cache: Cache the command's output: true, or a mapping of ttl, env and inputs. Needs a direct wrapper.
+        :param limits: Concurrency, resource and priority limits (see commands.limits.get_limit_settings). Needs a
+                       direct wrapper.
+        :param replace: Replace an existing command of the same name instead of failing.
+        :return: The baked command, as get_command describes it.
+        :raises BakeError: If the command can't be baked.
+        """
+        name = name.strip().lower()
+        if not name or name == "bake" or os.sep in name:
+            raise BakeError(f"Command name cannot be '{name}'")
+        source = os.path.abspath(source)
+        if not os.path.isfile(source):
+            raise BakeError(f"Source '{source}' does not exist")
+        if snapshot and (compile or bundle):
+            raise BakeError("snapshot can't be combined with compile or bundle")
+
+        with self.synced(writes=True) as handler:
+            if not replace and handler.command_exists(name):
+                raise BakeError(f"Command '{name}' already exists")
+            try:
+                interpreter = handler.find_interpreter(interpreter)
+                target = None
+                if snapshot:
+                    target = handler.snapshot_command(name, source)
+                elif compile or bundle:
+                    target = handler.build_command(name, source, interpreter, bundle)
+                cache = get_cache_settings(cache) if cache else None
+                limits = get_limit_settings(limits) if limits else None
+                mode = WrapperMode(wrapper) if wrapper else \
+                    WrapperMode.DIRECT if telemetry or cache or limits else DEFAULT_WRAPPER_MODE
+                baked_command = handler.bake_command(source, shebang, interpreter, mode, target, telemetry,
+                                                     description, cache, limits)
+            except (OSError, ValueError, subprocess.CalledProcessError) as error:
+                raise BakeError(f"Failed to prepare '{name}': {error}")
+            try:
+                handler.write_command(name, baked_command)
+            except (OSError, ValueError) as error:
+                raise BakeError(f"Failed to create '{name}': {error}")
+        return self.get_command(name)
+
+    def delete_command(self, name: str) -> dict[str, Any]:
+        """
+        Delete a command with its builds and virtualenv.
+
+        :param name: The name of the command.
+        :return: The deleted command's name.
+        :raises BakeError: If the command doesn't exist or can't be deleted.
+        """
+        with self.synced(writes=True) as handler:
+            if not handler.command_exists(name):
+                raise BakeError(f"Command '{name}' does not exist")
+            try:
+                handler.remove_command(name)
+            except OSError as error:
+                raise BakeError(f"Failed to delete '{name}': {error}")
+        return {"name": name, "deleted": True}
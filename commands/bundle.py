@@ -0,0 +1,139 @@
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import zipapp
+from typing import Optional
+
+BUILD_MANIFEST = ".bake-build.json"
+
+
+def get_imported_modules(tree: ast.AST) -> list[str]:
+    """
+    Get the absolute module names imported anywhere in a parsed file.
+
+    :param tree: The parsed file.
+    :return: Imported module names in the order they appear.
+    """
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return names
+
+
+def find_local_files(source: str) -> dict[str, str]:
+    """
+    Find a script and the local modules and packages it imports, following imports recursively.
+
+    :param source: The script to scan.
+    :return: Mapping of paths relative to the script's directory to absolute paths.
+    """
+    root = os.path.dirname(os.path.abspath(source))
+    files = {"__main__.py": os.path.abspath(source)}
+    pending = [os.path.abspath(source)]
+    seen = set()
+
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+
+        try:
+            with open(path, "rb") as file:
+                tree = ast.parse(file.read(), path)
+        except (OSError, SyntaxError, ValueError):
+            continue
+
+        for name in get_imported_modules(tree):
+            top_level = name.split(".")[0]
+            module_path = os.path.join(root, top_level + ".py")
+            package_path = os.path.join(root, top_level)
+            if os.path.isfile(module_path):
+                files[top_level + ".py"] = module_path
+                pending.append(module_path)
+            elif os.path.isfile(os.path.join(package_path, "__init__.py")):
+                for folder, dirs, filenames in os.walk(package_path):
+                    dirs[:] = [d for d in dirs if d != "__pycache__"]
+                    for filename in filenames:
+                        if filename.endswith(".py"):
+                            full_path = os.path.join(folder, filename)
+                            files[os.path.relpath(full_path, root)] = full_path
+                            pending.append(full_path)
+    return files
+
+
+def content_hash(files: dict[str, str], interpreter: str) -> str:
+    """
+    Hash the interpreter and the contents of every file that goes into a build.
+
+    :param files: Mapping of relative paths to absolute paths.
+    :param interpreter: The interpreter the build is compiled for.
+    :return: Hex digest of the build inputs.
+    """
+    digest = hashlib.sha256(interpreter.encode())
+    for relative_path in sorted(files):
+        digest.update(relative_path.encode() + b"\0")
+        with open(files[relative_path], "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def read_build_hash(build_path: str) -> Optional[str]:
+    """
+    Read the content hash a build was made from.
+
+    :param build_path: The build directory.
+    :return: The content hash, or None if there is no complete build.
+    """
+    try:
+        with open(os.path.join(build_path, BUILD_MANIFEST), "r") as manifest:
+            return json.loads(manifest.read()).get("hash")
+    except (OSError, ValueError):
+        return None
+
+
+def build(source: str, build_path: str, interpreter: str, bundle_path: Optional[str] = None) -> bool:
+    """
+    Copy a script and its local imports into a build directory and precompile them with the target interpreter,
+    optionally packing the result into a zipapp. Nothing is rebuilt when the inputs' content hash is unchanged.
+
+    :param source: The script to build.
+    :param build_path: The build directory; the script becomes its __main__.py.
+    :param interpreter: The interpreter the bytecode is compiled for.
+    :param bundle_path: Optional path of a zipapp to write.
+    :return: True if a build was made, False if the existing one was up to date.
+    """
+    files = find_local_files(source)
+    build_hash = content_hash(files, interpreter)
+    if read_build_hash(build_path) == build_hash and (not bundle_path or os.path.exists(bundle_path)):
+        return False
+
+    staging_path = build_path + ".tmp"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    for relative_path, full_path in files.items():
+        target = os.path.join(staging_path, relative_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(full_path, target)
+
+    # __pycache__ is used when running the directory, legacy .pyc files next to the sources when zipped
+    for legacy in ([], ["-b"]) if bundle_path else ([],):
+        subprocess.run([interpreter, "-m", "compileall", "-q", *legacy, staging_path], check=True,
+                       stdout=subprocess.DEVNULL)
+
+    if bundle_path:
+        zipapp.create_archive(staging_path, bundle_path + ".tmp",
+                              filter=lambda path: "__pycache__" not in path.parts)
+        os.replace(bundle_path + ".tmp", bundle_path)
+
+    with open(os.path.join(staging_path, BUILD_MANIFEST), "w") as manifest:
+        manifest.write(json.dumps({"hash": build_hash, "source": os.path.abspath(source)}))
+
+    shutil.rmtree(build_path, ignore_errors=True)
+    os.replace(staging_path, build_path)
+    return True
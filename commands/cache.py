@@ -0,0 +1,269 @@
+import os
+import shutil
+from typing import Any, Optional
+
+DEFAULT_TTL = 3600
+# The whole store, shared by every cached command. The least recently used entries are evicted past it
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+STATS_NAME = ".stats"
+# Running total of the store's size, so a miss only scans the store when it has to evict
+SIZE_NAME = ".size"
+
+# Appended to cached wrappers after the INTERPRETER, RUN_PATH, SOURCE, LOCALS, CACHE, TTL, ENV, INPUTS, STDIN and
+# MAX_BYTES constants. A run is keyed by its arguments, working directory, the selected environment variables, and
+# the modification times and sizes of the script, the local modules it imported at bake time (LOCALS) and the
+# declared inputs, plus stdin: a regular file is keyed by which file it is and where it is read from, /dev/null by
+# its name, and a pipe or socket by its content, read up front, only when the command opts in with STDIN. Runs with
+# any other stdin (a terminal, or a pipe that wasn't opted in) aren't cached, since their output may depend on it.
+# On a hit the recorded output and exit code are replayed without starting the script; on a miss the script runs as
+# a child whose output is passed through and recorded. A cache failure never affects the command. Each entry is a JSON header line followed by the raw stdout and stderr,
+# and every run appends 'hit bytes-saved seconds-saved' to the command's stats file.
+CACHE_RUNNER = """import hashlib, json, os, signal, stat, subprocess, sys, threading, time
+ARGV = list(sys.argv)
+COMMAND = os.path.basename(ARGV[0])
+FOLDER = os.path.join(CACHE, COMMAND)
+_bake_record = globals().get("_bake_record", lambda start, code: None)
+
+def _bake_stat(path):
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+    return [path_stat.st_mtime_ns, path_stat.st_size]
+
+def _bake_write(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+def _bake_count(hit, saved_bytes=0, saved_time=0.0):
+    try:
+        fd = os.open(os.path.join(FOLDER, ".stats"), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b"%d %d %.6f\\n" % (hit, saved_bytes, saved_time))
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def _bake_lookup(path):
+    try:
+        with open(path, "rb") as file:
+            header = json.loads(file.readline())
+            if time.time() - header["created"] > TTL:
+                os.remove(path)
+                return None
+            stdout, stderr = file.read(header["stdout"]), file.read(header["stderr"])
+        os.utime(path)  # Recency for the LRU eviction
+        return header, stdout, stderr
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _bake_evict():
+    entries, total = [], 0
+    for folder in os.scandir(CACHE):
+        if folder.is_dir():
+            for entry in os.scandir(folder.path):
+                if not entry.name.startswith("."):
+                    entry_stat = entry.stat()
+                    entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+                    total += entry_stat.st_size
+    # Evicting down to three quarters leaves room for many misses before the next scan
+    for _, size, entry_path in sorted(entries):
+        if total <= MAX_BYTES * 3 // 4:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        total -= size
+    return total
+
+def _bake_store(path, header, stdout, stderr):
+    try:
+        import fcntl
+        os.makedirs(FOLDER, exist_ok=True)
+        data = json.dumps(header).encode() + b"\\n" + stdout + stderr
+        temp_path = os.path.join(FOLDER, ".%s.%d.tmp" % (os.path.basename(path), os.getpid()))
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        fd = os.open(os.path.join(CACHE, ".size"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            # Removals outside of eviction aren't subtracted, so the total only ever overestimates
+            total = int(os.pread(fd, 32, 0) or b"0") + len(data)
+            if total > MAX_BYTES:
+                total = _bake_evict()
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, b"%d" % total, 0)
+        finally:
+            os.close(fd)
+    except (OSError, ValueError):
+        pass
+
+def _bake_tee(source, target, chunks):
+    while True:
+        chunk = os.read(source, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        try:
+            _bake_write(target, chunk)
+        except OSError:
+            pass
+
+_bake_start = time.time()
+command = [INTERPRETER, RUN_PATH] + ARGV[1:]
+stdin, stdin_key, bypass = None, None, False
+try:
+    stdin_stat = os.fstat(0)
+except OSError:
+    stdin_stat = None
+if stdin_stat is None:
+    pass
+elif stat.S_ISREG(stdin_stat.st_mode):
+    # The script still reads the file itself
+    stdin_key = [stdin_stat.st_dev, stdin_stat.st_ino, stdin_stat.st_mtime_ns, stdin_stat.st_size,
+                 os.lseek(0, 0, os.SEEK_CUR)]
+elif stat.S_ISCHR(stdin_stat.st_mode) and not os.isatty(0) and stdin_stat.st_rdev == os.stat(os.devnull).st_rdev:
+    stdin_key = os.devnull
+elif STDIN and (stat.S_ISFIFO(stdin_stat.st_mode) or stat.S_ISSOCK(stdin_stat.st_mode)):
+    stdin = b"".join(iter(lambda: os.read(0, 65536), b""))
+else:
+    bypass = True  # A terminal, or a pipe the command didn't opt in to reading
+if bypass:
+    process = subprocess.Popen(command)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    code = process.wait()
+    _bake_record(_bake_start, code)
+    sys.exit(code if code >= 0 else 128 - code)
+
+key = hashlib.sha256(json.dumps([ARGV[1:], os.getcwd(), {name: os.environ.get(name) for name in ENV},
+                                 [_bake_stat(path) for path in [SOURCE, RUN_PATH] + LOCALS + INPUTS],
+                                 stdin_key]).encode())
+if stdin is not None:
+    key.update(stdin)
+path = os.path.join(FOLDER, key.hexdigest())
+cached = _bake_lookup(path)
+if cached:
+    header, stdout, stderr = cached
+    _bake_write(1, stdout)
+    _bake_write(2, stderr)
+    _bake_count(1, len(stdout) + len(stderr), header["time"])
+    _bake_record(_bake_start, header["code"])
+    sys.exit(header["code"])
+
+process = subprocess.Popen(command, stdin=None if stdin is None else subprocess.PIPE, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE)
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+stdout, stderr = [], []
+threads = [threading.Thread(target=_bake_tee, args=(process.stdout.fileno(), 1, stdout)),
+           threading.Thread(target=_bake_tee, args=(process.stderr.fileno(), 2, stderr))]
+for thread in threads:
+    thread.start()
+if stdin is not None:
+    try:
+        process.stdin.write(stdin)
+        process.stdin.close()
+    except OSError:
+        pass
+code = process.wait()
+for thread in threads:
+    thread.join()
+_bake_record(_bake_start, code)
+if code < 0:
+    sys.exit(128 - code)
+_bake_store(path, {"created": time.time(), "code": code, "time": time.time() - _bake_start,
+                   "stdout": sum(map(len, stdout)), "stderr": sum(map(len, stderr))},
+            b"".join(stdout), b"".join(stderr))
+_bake_count(0)
+sys.exit(code)
+"""
+
+
+def get_cache_settings(settings: Any) -> dict[str, Any]:
+    """
+    Normalise output cache settings, from the --cache flags or a manifest's 'cache' value.
+
+    :param settings: True for the defaults, or a mapping with an optional 'ttl' in seconds, lists of environment
+                     variable names ('env') and input file paths ('inputs'), and whether piped stdin is read up
+                     front and made part of the key ('stdin').
+    :return: The settings as wrappers store them, with absolute input paths.
+    :raises ValueError: If the settings aren't valid.
+    """
+    if settings is True:
+        settings = {}
+    if not isinstance(settings, dict) or set(settings) - {"ttl", "env", "inputs", "stdin"}:
+        raise ValueError("Cache settings must be true or a table of ttl, env, inputs and stdin")
+    ttl = settings.get("ttl", DEFAULT_TTL)
+    env, inputs = settings.get("env") or [], settings.get("inputs") or []
+    if not isinstance(ttl, int) or isinstance(ttl, bool) or ttl <= 0:
+        raise ValueError("Cache ttl must be a positive number of seconds")
+    if not all(isinstance(value, str) for value in [*env, *inputs]):
+        raise ValueError("Cache env and inputs must be lists of strings")
+    if not isinstance(settings.get("stdin", False), bool):
+        raise ValueError("Cache stdin must be true or false")
+    cache = {"ttl": ttl, "env": list(env), "inputs": [os.path.abspath(os.path.expanduser(path)) for path in inputs]}
+    if settings.get("stdin"):
+        cache["stdin"] = True
+    return cache
+
+
+def read_cache_stats(cache_path: str, command_name: Optional[str] = None) -> dict[str, dict[str, Any]]:
+    """
+    Summarize the output cache per command.
+
+    :param cache_path: The cache's directory.
+    :param command_name: Optional command to summarize.
+    :return: Hits, misses, hit rate, bytes and seconds saved, and the number and size of entries, by command.
+    """
+    try:
+        folders = [folder for folder in os.scandir(cache_path) if folder.is_dir()]
+    except OSError:
+        return {}
+
+    stats = {}
+    for folder in folders:
+        if command_name and folder.name != command_name:
+            continue
+        row = {"hits": 0, "misses": 0, "bytes_saved": 0, "time_saved": 0.0, "entries": 0, "size": 0}
+        try:
+            with open(os.path.join(folder.path, STATS_NAME), "r") as file:
+                for line in file:
+                    try:
+                        hit, saved_bytes, saved_time = line.split()
+                        row["hits" if hit == "1" else "misses"] += 1
+                        row["bytes_saved"] += int(saved_bytes)
+                        row["time_saved"] += float(saved_time)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+        except OSError:
+            pass
+        for entry in os.scandir(folder.path):
+            if not entry.name.startswith("."):
+                row["entries"] += 1
+                row["size"] += entry.stat().st_size
+        calls = row["hits"] + row["misses"]
+        row["hit_rate"] = row["hits"] / calls if calls else 0.0
+        stats[folder.name] = row
+    return stats
+
+
+def clear_cache(cache_path: str, command_name: Optional[str] = None) -> int:
+    """
+    Remove cached output and statistics.
+
+    :param cache_path: The cache's directory.
+    :param command_name: Optional command to clear. Defaults to every command.
+    :return: The number of entries removed.
+    """
+    stats = read_cache_stats(cache_path, command_name)
+    for name in stats:
+        shutil.rmtree(os.path.join(cache_path, name), ignore_errors=True)
+    if not command_name:
+        # Clearing one command leaves the total too high, which the next eviction scan corrects
+        try:
+            os.remove(os.path.join(cache_path, SIZE_NAME))
+        except OSError:
+            pass
+    return sum(row["entries"] for row in stats.values())
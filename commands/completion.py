@@ -0,0 +1,181 @@
+import argparse
+import shlex
+from typing import Any
+
+SHELLS = ("bash", "zsh", "fish")
+# Flags whose value is a baked command's name or a path are tagged with these metavars in get_args
+COMMAND_METAVAR = "COMMAND_NAME"
+PATH_METAVAR = "PATH"
+
+
+def get_flags(parser: argparse.ArgumentParser) -> list[dict[str, Any]]:
+    """
+    Describe the optional arguments of a parser for completion scripts.
+
+    :param parser: The parser.
+    :return: Each flag's option strings, help, choices and what kind of value it takes: 'command', 'path',
+             'choice', 'value', or 'none'.
+    """
+    flags = []
+    for action in parser._actions:
+        if not action.option_strings:
+            continue
+        if action.choices:
+            kind = "choice"
+        elif action.nargs == 0:
+            kind = "none"
+        elif action.metavar == COMMAND_METAVAR:
+            kind = "command"
+        elif action.metavar == PATH_METAVAR:
+            kind = "path"
+        # An optional value can't be told apart from the next argument
+        elif action.nargs == "?":
+            kind = "none"
+        else:
+            kind = "value"
+        flags.append({
+            "options": list(action.option_strings),
+            "help": (action.help or "").replace("%%", "%"),
+            "choices": [str(choice) for choice in action.choices or []],
+            "kind": kind
+        })
+    return flags
+
+
+def options_of(flags: list[dict[str, Any]], kind: str) -> list[str]:
+    """
+    Get the option strings of every flag of a kind.
+
+    :param flags: Flags from get_flags.
+    :param kind: The kind of value.
+    :return: Option strings.
+    """
+    return [option for flag in flags if flag["kind"] == kind for option in flag["options"]]
+
+
+def render_bash(flags: list[dict[str, Any]], names_path: str) -> str:
+    """
+    Render a bash completion script.
+
+    :param flags: Flags from get_flags.
+    :param names_path: The file listing every command's name, one per line.
+    :return: The script.
+    """
+    names = shlex.quote(names_path)
+    choices = "".join(f"        {'|'.join(flag['options'])})\n"
+                      f"            COMPREPLY=($(compgen -W {shlex.quote(' '.join(flag['choices']))} -- \"$cur\"))\n"
+                      f"            return;;\n" for flag in flags if flag["kind"] == "choice")
+    all_options = " ".join(option for flag in flags for option in flag["options"])
+    return f"""# bake completion for bash
+_bake_complete() {{
+    local cur="${{COMP_WORDS[COMP_CWORD]}}" prev="${{COMP_WORDS[COMP_CWORD-1]}}"
+    local names=()
+    case "$prev" in
+        {'|'.join(options_of(flags, "command"))})
+            [[ -r {names} ]] && mapfile -t names < {names}
+            COMPREPLY=($(compgen -W "${{names[*]}}" -- "$cur"))
+            return;;
+{choices}        {'|'.join(options_of(flags, "path"))})
+            COMPREPLY=($(compgen -f -- "$cur"))
+            return;;
+        {'|'.join(options_of(flags, "value"))})
+            return;;
+    esac
+    if [[ "$cur" == -* ]]; then
+        COMPREPLY=($(compgen -W "{all_options}" -- "$cur"))
+    else
+        COMPREPLY=($(compgen -f -- "$cur"))
+    fi
+}}
+complete -o filenames -F _bake_complete bake
+"""
+
+
+def render_zsh(flags: list[dict[str, Any]], names_path: str) -> str:
+    """
+    Render a zsh completion script. It needs compinit to have run.
+
+    :param flags: Flags from get_flags.
+    :param names_path: The file listing every command's name, one per line.
+    :return: The script.
+    """
+    names = shlex.quote(names_path)
+    choices = "".join(f"        ({'|'.join(flag['options'])})\n"
+                      f"            compadd -- {' '.join(shlex.quote(choice) for choice in flag['choices'])}\n"
+                      f"            return;;\n" for flag in flags if flag["kind"] == "choice")
+    descriptions = "\n".join(shlex.quote(f"{option}:{flag['help']}") for flag in flags for option in flag["options"])
+    return f"""#compdef bake
+# bake completion for zsh
+_bake() {{
+    local -a names flags
+    case "${{words[CURRENT-1]}}" in
+        ({'|'.join(options_of(flags, "command"))})
+            [[ -r {names} ]] && names=("${{(@f)$(<{names})}}")
+            compadd -a names
+            return;;
+{choices}        ({'|'.join(options_of(flags, "path"))})
+            _files
+            return;;
+        ({'|'.join(options_of(flags, "value"))})
+            return;;
+    esac
+    if [[ "$PREFIX" == -* ]]; then
+        flags=(
+{descriptions}
+        )
+        _describe -t flags 'bake flags' flags
+    else
+        _files
+    fi
+}}
+compdef _bake bake
+"""
+
+
+def render_fish(flags: list[dict[str, Any]], names_path: str) -> str:
+    """
+    Render a fish completion script.
+
+    :param flags: Flags from get_flags.
+    :param names_path: The file listing every command's name, one per line.
+    :return: The script.
+    """
+    lines = ["# bake completion for fish",
+             "function __bake_command_names",
+             f"    test -r {shlex.quote(names_path)}; and while read -l name; echo $name; end < "
+             f"{shlex.quote(names_path)}",
+             "end"]
+    for flag in flags:
+        parts = ["complete -c bake"]
+        for option in flag["options"]:
+            if option.startswith("--"):
+                parts.append(f"-l {option[2:]}")
+            elif len(option) == 2:
+                parts.append(f"-s {option[1:]}")
+            else:
+                parts.append(f"-o {option[1:]}")
+        if flag["kind"] == "command":
+            parts.append("-x -a '(__bake_command_names)'")
+        elif flag["kind"] == "choice":
+            parts.append(f"-x -a {shlex.quote(' '.join(flag['choices']))}")
+        elif flag["kind"] == "path":
+            parts.append("-r -F")
+        elif flag["kind"] == "value":
+            parts.append("-x")
+        if flag["help"]:
+            parts.append(f"-d {shlex.quote(flag['help'])}")
+        lines.append(" ".join(parts))
+    return "\n".join(lines) + "\n"
+
+
+def render_completion(shell: str, parser: argparse.ArgumentParser, names_path: str) -> str:
+    """
+    Render the completion script for a shell.
+
+    :param shell: One of SHELLS.
+    :param parser: bake's argument parser.
+    :param names_path: The file listing every command's name, one per line.
+    :return: The script.
+    """
+    renderers = {"bash": render_bash, "zsh": render_zsh, "fish": render_fish}
+    return renderers[shell](get_flags(parser), names_path)
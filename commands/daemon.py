@@ -0,0 +1,319 @@
+"""
+Warm-interpreter fork server for baked commands.
+
+This module only uses the standard library because the server runs under the baked command's own interpreter:
+
+    <interpreter> daemon.py serve <source> <socket> <idle timeout>
+"""
+import ast
+import hashlib
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from typing import Optional
+
+DEFAULT_IDLE_TIMEOUT = 600
+# Seconds a client has to send its request, so a stalled client can't hold up the accept loop
+REQUEST_TIMEOUT = 2
+
+
+def get_socket_path(source: str, daemon_folder: str) -> str:
+    """
+    Get the socket path of the daemon serving a source file.
+
+    :param source: The baked source file.
+    :param daemon_folder: The folder daemon sockets live in.
+    :return: Path of the Unix socket.
+    """
+    digest = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:16]
+    return os.path.join(daemon_folder, f"{digest}.sock")
+
+
+def get_pid_path(socket_path: str) -> str:
+    """
+    Get the pid file path that belongs to a daemon socket.
+
+    :param socket_path: Path of the daemon socket.
+    :return: Path of the pid file.
+    """
+    return os.path.splitext(socket_path)[0] + ".pid"
+
+
+def daemon_status(socket_path: str) -> Optional[int]:
+    """
+    Get the pid of a running daemon.
+
+    :param socket_path: Path of the daemon socket.
+    :return: The daemon's pid, or None if it isn't running.
+    """
+    try:
+        with open(get_pid_path(socket_path), "r") as pid_file:
+            pid = int(pid_file.read().strip())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    return pid if os.path.exists(socket_path) else None
+
+
+def start_daemon(interpreter: str, source: str, socket_path: str, idle_timeout: int = DEFAULT_IDLE_TIMEOUT,
+                 wait: float = 10) -> int:
+    """
+    Start a daemon for a source file in the background.
+
+    :param interpreter: The interpreter the daemon runs under.
+    :param source: The baked source file.
+    :param socket_path: Path of the daemon socket.
+    :param idle_timeout: Seconds without invocations before the daemon exits.
+    :param wait: Seconds to wait for the daemon to start listening.
+    :return: The daemon's pid.
+    """
+    pid = daemon_status(socket_path)
+    if pid:
+        return pid
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    log_path = os.path.splitext(socket_path)[0] + ".log"
+    with open(log_path, "a") as log_file:
+        process = subprocess.Popen([interpreter, os.path.abspath(__file__), "serve", source, socket_path,
+                                    str(idle_timeout)],
+                                   stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file,
+                                   start_new_session=True)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise OSError(f"Daemon exited with code {process.returncode}, see {log_path}")
+        pid = daemon_status(socket_path)
+        if pid:
+            return pid
+        time.sleep(0.05)
+    raise OSError(f"Daemon did not start listening within {wait} seconds, see {log_path}")
+
+
+def stop_daemon(socket_path: str) -> bool:
+    """
+    Stop a running daemon.
+
+    :param socket_path: Path of the daemon socket.
+    :return: True if a daemon was stopped, otherwise False.
+    """
+    pid = daemon_status(socket_path)
+    if not pid:
+        return False
+    os.kill(pid, signal.SIGTERM)
+    return True
+
+
+def preload(source: str) -> None:
+    """
+    Import the top-level imports of a source file without running it.
+
+    :param source: The baked source file.
+    """
+    sys.path[0] = os.path.dirname(os.path.abspath(source))
+    with open(source, "rb") as source_file:
+        tree = ast.parse(source_file.read(), source)
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"Could not preload '{name}': {e}", flush=True)
+
+
+def run_child(source: str, request: dict, fds: list[int]) -> None:
+    """
+    Run the source as __main__ inside a forked child with the client's stdio, argv, env and cwd.
+
+    :param source: The baked source file.
+    :param request: The client's argv, env and cwd.
+    :param fds: The client's stdin, stdout and stderr file descriptors.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+    code = 0
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = [source] + request["argv"]
+        runpy.run_path(source, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except OSError:
+                pass
+    os._exit(code)
+
+
+def read_request(conn: socket.socket) -> tuple[dict, list[int]]:
+    """
+    Read a client request: one byte carrying the stdio fds, then a length-prefixed JSON header.
+
+    :param conn: The client connection.
+    :return: The decoded request and the received file descriptors.
+    """
+    _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+    try:
+        if len(fds) != 3:
+            raise OSError("Client did not pass stdio file descriptors")
+        header = conn.makefile("rb")
+        size = int.from_bytes(header.read(4), "big")
+        data = header.read(size)
+        if len(data) != size:
+            raise OSError("Client sent a short request")
+        return json.loads(data), fds
+    except (OSError, ValueError):
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def send_message(conn: socket.socket, message: dict) -> None:
+    """
+    Send a newline-delimited JSON message to a client, ignoring clients that went away.
+
+    :param conn: The client connection.
+    :param message: The message to send.
+    """
+    try:
+        conn.sendall(json.dumps(message).encode() + b"\n")
+    except OSError:
+        pass
+
+
+def serve(source: str, socket_path: str, idle_timeout: int) -> None:
+    """
+    Preload a source file's imports and fork one child per invocation until idle or stopped.
+
+    :param source: The baked source file.
+    :param socket_path: Path of the daemon socket.
+    :param idle_timeout: Seconds without invocations before the daemon exits.
+    """
+    def source_mtime() -> Optional[float]:
+        try:
+            return os.stat(source).st_mtime
+        except OSError:
+            return None
+
+    loaded_mtime = source_mtime()
+    preload(source)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(64)
+    with open(get_pid_path(socket_path), "w") as pid_file:
+        pid_file.write(str(os.getpid()))
+
+    def cleanup() -> None:
+        server.close()
+        for path in (socket_path, get_pid_path(socket_path)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    children: dict[int, socket.socket] = {}
+    last_active = time.monotonic()
+
+    try:
+        while True:
+            readable, _, _ = select.select([server], [], [], 0.5)
+
+            # Report exit codes of finished children
+            while children:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if not pid:
+                    break
+                code = os.waitstatus_to_exitcode(status)
+                conn = children.pop(pid, None)
+                if conn:
+                    send_message(conn, {"exit": 128 - code if code < 0 else code})
+                    conn.close()
+
+            now = time.monotonic()
+            if children:
+                last_active = now
+            stale = source_mtime() != loaded_mtime
+
+            if readable:
+                conn, _ = server.accept()
+                conn.settimeout(REQUEST_TIMEOUT)
+                last_active = now
+                if stale:
+                    # The client cold starts this run while we reload
+                    send_message(conn, {"fallback": True})
+                    conn.close()
+                else:
+                    try:
+                        request, fds = read_request(conn)
+                    except (OSError, ValueError) as e:
+                        print(f"Bad request: {e}", flush=True)
+                        conn.close()
+                        continue
+                    conn.settimeout(None)
+
+                    pid = os.fork()
+                    if pid == 0:
+                        server.close()
+                        conn.close()
+                        run_child(source, request, fds)
+                    for fd in fds:
+                        os.close(fd)
+                    send_message(conn, {"pid": pid})
+                    children[pid] = conn
+
+            if stale and not children:
+                print("Source changed, restarting", flush=True)
+                cleanup()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+
+            if not children and now - last_active > idle_timeout:
+                print("Idle timeout reached, exiting", flush=True)
+                break
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] != "serve":
+        sys.exit(f"usage: {sys.argv[0]} serve SOURCE SOCKET IDLE_TIMEOUT")
+    serve(sys.argv[2], sys.argv[3], int(sys.argv[4]))
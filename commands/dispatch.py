@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from commands.wrapper import WRAPPER_HEADER
+from utils.filesystem import atomic_write, locked
+
+# Multi-call dispatcher every '-w dispatch' command is a symlink to. It finds its command by name in the command
+# table with a binary search over the memory-mapped file, whose lines are sorted by name:
+#   name<TAB>interpreter<TAB>run path<TAB>search path<TAB>wrapper metadata
+# It starts without site, so a command run by another interpreter is exec'd after one cheap startup, and one run by
+# the dispatcher's own interpreter loads site and runs in-process like a direct wrapper.
+DISPATCHER = """#!{interpreter} -S
+# bake-run: dispatcher for commands baked with '-w dispatch' (see commands/dispatch.py)
+import mmap, os, sys
+NAME = os.fsencode(os.path.basename(sys.argv[0]))
+try:
+    with open({table!r}, "rb") as file:
+        table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+except (OSError, ValueError):
+    table = b""
+entry, low, high = None, 0, len(table)
+while low < high:
+    start = table.rfind(b"\\n", 0, (low + high) // 2) + 1
+    end = table.find(b"\\n", start)
+    fields = table[start:end].split(b"\\t", 4)
+    if fields[0] == NAME:
+        entry = [os.fsdecode(field) for field in fields[1:4]]
+        break
+    if fields[0] < NAME:
+        low = end + 1
+    else:
+        high = start
+if entry is None:
+    sys.stderr.write("bake-run: no command named %r\\n" % os.fsdecode(NAME))
+    sys.exit(127)
+interpreter, run_path, search_path = entry
+if interpreter != sys.executable:
+    os.execv(interpreter, [interpreter, run_path] + sys.argv[1:])
+import runpy, site
+site.main()
+sys.argv[0] = run_path
+sys.path[0] = search_path
+runpy.run_path(run_path, run_name="__main__")
+"""
+
+
+def render_dispatcher(interpreter: str, table_path: str) -> str:
+    """
+    Render the dispatcher script.
+
+    :param interpreter: The absolute path of the interpreter the dispatcher runs on.
+    :param table_path: The command table it reads.
+    :return: The script's contents.
+    """
+    return DISPATCHER.format(interpreter=interpreter, table=table_path)
+
+
+def read_table(path: str) -> dict[str, str]:
+    """
+    Read a command table.
+
+    :param path: The table file.
+    :return: Each command's table line by name. Empty if there is no table.
+    """
+    try:
+        with open(path, "r") as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return {}
+    return {line.split("\t", 1)[0]: line for line in lines if line}
+
+
+class CommandTable:
+    def __init__(self, path: str, dispatcher_path: str) -> None:
+        """
+        Initializes the CommandTable instance, the sorted table the dispatcher looks commands up in. Changes are
+        merged into the file under its lock, so concurrent bake processes don't drop each other's commands.
+
+        :param path: Path of the table file.
+        :param dispatcher_path: Path of the dispatcher the commands link to.
+        """
+        self.path = path
+        self.dispatcher_path = dispatcher_path
+        self.entries: Optional[dict[str, str]] = None
+        # None marks a removal
+        self.changes: dict[str, Optional[str]] = {}
+        # Command paths whose symlinks are swapped in once a batch's table write is done
+        self.pending_links: list[str] = []
+        self.batch_depth = 0
+
+    def load(self) -> dict[str, str]:
+        """
+        Load the table on first use.
+
+        :return: Each command's table line by name.
+        """
+        if self.entries is None:
+            self.entries = read_table(self.path)
+        return self.entries
+
+    def is_link(self, command_path: str) -> bool:
+        """
+        Check whether a command is a symlink to the dispatcher.
+
+        :param command_path: The command's path.
+        :return: True if it is.
+        """
+        try:
+            return os.readlink(command_path) == self.dispatcher_path
+        except OSError:
+            return False
+
+    def read_wrapper(self, command_name: str) -> Optional[str]:
+        """
+        Render a dispatched command as a wrapper, so it parses like any other.
+
+        :param command_name: The name of the command.
+        :return: The wrapper contents, or None if the command isn't in the table.
+        """
+        line = self.load().get(command_name)
+        if line is None:
+            return None
+        header = line.split("\t", 4)[4]
+        return f"#!{self.dispatcher_path}\n{WRAPPER_HEADER}{header}\n"
+
+    def install_dispatcher(self, interpreter: str) -> None:
+        """
+        Write the dispatcher unless it is already up to date.
+
+        :param interpreter: The absolute path of the interpreter the dispatcher runs on.
+        """
+        contents = render_dispatcher(interpreter, self.path)
+        try:
+            with open(self.dispatcher_path, "r") as file:
+                if file.read() == contents:
+                    return
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(self.dispatcher_path), exist_ok=True)
+        atomic_write(self.dispatcher_path, contents, 0o755)
+
+    def link(self, command_path: str, baked_command: str) -> None:
+        """
+        Add or replace a command: one table update and one symlink to the dispatcher.
+
+        :param command_path: The command's path.
+        :param baked_command: The command's rendered dispatch wrapper.
+        :raises ValueError: If the wrapper has no metadata, or a path contains a tab or newline.
+        """
+        command_name = os.path.basename(command_path)
+        header = next((line[len(WRAPPER_HEADER):] for line in baked_command.splitlines()
+                       if line.startswith(WRAPPER_HEADER)), None)
+        if header is None:
+            raise ValueError("Dispatch wrappers need their metadata line")
+        metadata = json.loads(header)
+        fields = [command_name, metadata["interpreter"], metadata.get("target") or metadata["source"],
+                  metadata.get("target") or os.path.dirname(metadata["source"])]
+        if any("\t" in field or "\n" in field for field in fields):
+            raise ValueError("Dispatched commands can't have tabs or newlines in their name or paths")
+
+        self.load()[command_name] = self.changes[command_name] = "\t".join(fields + [header])
+        # The table is written first, so the link never points at a command the dispatcher can't find
+        if self.batch_depth:
+            if command_path not in self.pending_links:
+                self.pending_links.append(command_path)
+            return
+        self.save()
+        self.place_link(command_path)
+
+    def place_link(self, command_path: str) -> None:
+        """
+        Atomically replace a command with a symlink to the dispatcher.
+
+        :param command_path: The command's path.
+        """
+        command_name = os.path.basename(command_path)
+        folder = os.path.dirname(command_path)
+        temp_path = os.path.join(folder, f".{command_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        os.symlink(self.dispatcher_path, temp_path)
+        os.replace(temp_path, command_path)
+
+    def remove(self, command_name: str) -> None:
+        """
+        Remove a command from the table. Its symlink is removed by the caller.
+
+        :param command_name: The name of the command.
+        """
+        self.pending_links = [path for path in self.pending_links if os.path.basename(path) != command_name]
+        if self.load().pop(command_name, None) is not None:
+            self.changes[command_name] = None
+            self.save()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Defer writing the table until the enclosed block finishes, so a batch of changes costs one write. Symlinks
+        to the dispatcher are only swapped in after that write.
+        """
+        self.batch_depth += 1
+        try:
+            yield
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth:
+                if self.changes:
+                    self.save()
+                pending_links, self.pending_links = self.pending_links, []
+                error = None
+                for command_path in pending_links:
+                    try:
+                        self.place_link(command_path)
+                    except OSError as e:
+                        error = error or e  # The other commands still get their links
+                if error:
+                    raise error
+
+    def save(self) -> None:
+        """
+        Merge the pending changes into the table on disk, unless a batch is open.
+        """
+        if self.batch_depth or not self.changes:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with locked(self.path + ".lock"):
+            entries = read_table(self.path)
+            for command_name, line in self.changes.items():
+                if line is None:
+                    entries.pop(command_name, None)
+                else:
+                    entries[command_name] = line
+            # The dispatcher compares raw bytes, so the table is sorted the same way
+            names = sorted(entries, key=os.fsencode)
+            atomic_write(self.path, "".join(entries[name] + "\n" for name in names))
+        self.entries = entries
+        self.changes = {}
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from commands.wrapper import resolve_interpreter
+from config import Config
+
+DOCTOR_CACHE_VERSION = 1
+# How deep to look for a moved source below the nearest folder that still exists
+MOVED_SOURCE_DEPTH = 3
+
+# Run by each command's own interpreter, so scripts are compiled by the Python version that runs them. Reads one
+# path per line and prints 'path<TAB>error' for every file that doesn't compile.
+COMPILE_CHECK = """import sys
+for path in sys.stdin.read().splitlines():
+    try:
+        with open(path, 'rb') as file:
+            compile(file.read(), path, 'exec')
+    except Exception as error:
+        line = getattr(error, 'lineno', None)
+        message = getattr(error, 'msg', None) or str(error)
+        print(path + '\\t' + type(error).__name__ + (' on line %s' % line if line else '') + ': ' + message)
+"""
+
+
+def hash_file(path: str) -> str:
+    """
+    Hash a file's contents.
+
+    :param path: The file.
+    :return: Hex digest of the contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_shebang(shebang: str) -> Optional[str]:
+    """
+    Check that a wrapper's shebang points at an executable.
+
+    :param shebang: The shebang line.
+    :return: A problem, or None if the shebang is fine.
+    """
+    parts = shlex.split(shebang[2:]) if shebang.startswith("#!") else []
+    if not parts:
+        return "Missing shebang"
+    if not os.access(parts[0], os.X_OK):
+        return f"Shebang interpreter '{parts[0]}' is not executable"
+    if os.path.basename(parts[0]) == "env" and len(parts) > 1 and not shutil.which(parts[1]):
+        return f"Shebang program '{parts[1]}' is not on PATH"
+    return None
+
+
+def compile_sources(interpreter: str, sources: list[str]) -> dict[str, Optional[str]]:
+    """
+    Compile scripts with an interpreter, without running them.
+
+    :param interpreter: The interpreter.
+    :param sources: The scripts.
+    :return: The compile error of each script, or None if it compiles.
+    :raises RuntimeError: If the interpreter itself fails.
+    """
+    try:
+        completed = subprocess.run([interpreter, "-c", COMPILE_CHECK], input="\n".join(sources),
+                                   capture_output=True, text=True)
+    except OSError as error:
+        raise RuntimeError(f"Interpreter '{interpreter}' failed to start: {error}")
+    if completed.returncode:
+        lines = completed.stderr.strip().splitlines()
+        raise RuntimeError(f"Interpreter '{interpreter}' failed: {lines[-1] if lines else completed.returncode}")
+
+    errors: dict[str, Optional[str]] = dict.fromkeys(sources)
+    for line in completed.stdout.splitlines():
+        path, _, error = line.partition("\t")
+        if path in errors:
+            errors[path] = error
+    return errors
+
+
+def find_moved_source(source: str) -> Optional[str]:
+    """
+    Look for a moved script: a file with the same name below the nearest folder of its old path that still exists.
+
+    :param source: The script's old path.
+    :return: The new path if exactly one candidate was found, otherwise None.
+    """
+    root = os.path.dirname(source)
+    while root and not os.path.isdir(root):
+        root = os.path.dirname(root)
+    if not root or root == os.path.dirname(root):
+        return None  # Don't search the whole file system
+
+    candidates = []
+    base_depth = root.rstrip(os.sep).count(os.sep)
+    for folder, dirs, filenames in os.walk(root):
+        if folder.count(os.sep) - base_depth >= MOVED_SOURCE_DEPTH:
+            dirs[:] = []
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in ("__pycache__", "node_modules")]
+        if os.path.basename(source) in filenames:
+            candidates.append(os.path.join(folder, os.path.basename(source)))
+    return candidates[0] if len(candidates) == 1 else None
+
+
+class Doctor:
+    def __init__(self, cache_path: str) -> None:
+        """
+        Initializes the Doctor instance, which health checks baked commands. Compile results are cached by each
+        script's modification time and content hash, so reruns only compile scripts that changed.
+
+        :param cache_path: Path of the compile cache.
+        """
+        self.cache = Config(cache_path)
+
+    def check_command(self, command_name: str, command_path: str, wrapper: Optional[dict[str, Any]],
+                      cached: dict[str, Any]) -> dict[str, Any]:
+        """
+        Run the checks that don't compile anything: the wrapper parses and is executable, the shebang, source and
+        build exist, and the interpreter resolves.
+
+        :param command_name: The name of the command.
+        :param command_path: The wrapper file.
+        :param wrapper: The parsed wrapper, or None if it didn't parse.
+        :param cached: The command's compile cache entry.
+        :return: The command's result. 'compile' holds the cache key when the script still has to be compiled.
+        """
+        start = time.perf_counter()
+        result = {"name": command_name, "problems": [], "cached": False, "compiled": False, "compile": None}
+
+        def problem(check: str, message: str) -> None:
+            result["problems"].append({"check": check, "message": message})
+
+        if not wrapper:
+            problem("wrapper", "Not a baked wrapper, or it doesn't parse")
+        else:
+            result["source"] = source = wrapper["source"]
+            if not os.access(command_path, os.X_OK):
+                problem("wrapper", "Wrapper is not executable")
+            shebang_problem = check_shebang(wrapper["shebang"])
+            if shebang_problem:
+                problem("shebang", shebang_problem)
+
+            interpreter = resolve_interpreter(wrapper["interpreter"])
+            if not interpreter:
+                problem("interpreter", f"Interpreter '{wrapper['interpreter']}' does not resolve")
+            if wrapper.get("target") and not os.path.exists(wrapper["target"]):
+                problem("build", f"Build '{wrapper['target']}' is missing")
+
+            try:
+                stat = os.stat(source)
+            except OSError:
+                problem("source", f"Source '{source}' does not exist")
+            else:
+                if interpreter:
+                    key = [interpreter, stat.st_mtime_ns, stat.st_size]
+                    if cached.get("key") == key:
+                        result["cached"] = True
+                    elif cached.get("interpreter") == interpreter and cached.get("hash") == hash_file(source):
+                        # Touched but unchanged
+                        cached["key"] = key
+                        result["cached"] = True
+                    else:
+                        result["compile"] = key
+                    if result["cached"] and cached.get("error"):
+                        problem("compile", cached["error"])
+
+        result["time"] = time.perf_counter() - start
+        return result
+
+    def run(self, commands: dict[str, tuple[str, Optional[dict[str, Any]]]], jobs: Optional[int] = None,
+            prune: bool = True) -> list[dict[str, Any]]:
+        """
+        Check every command on a thread pool, compiling the scripts that changed with one process per interpreter.
+
+        :param commands: Each command's wrapper file and parsed wrapper, keyed by name.
+        :param jobs: Number of commands checked at once. Defaults to the thread pool's default.
+        :param prune: Drop cached results of commands that weren't checked, i.e. when checking every command.
+        :return: Each command's name, problems, whether its script was compiled or its compile result came from
+                 the cache, and timing.
+        """
+        try:
+            cache = self.cache.load_config()
+        except (OSError, ValueError):
+            cache = {}
+        if cache.get("version") != DOCTOR_CACHE_VERSION:
+            cache = {"version": DOCTOR_CACHE_VERSION, "commands": {}}
+        entries = cache["commands"]
+
+        with ThreadPoolExecutor(max(1, jobs) if jobs is not None else None) as executor:
+            results = list(executor.map(
+                lambda name: self.check_command(name, commands[name][0], commands[name][1], entries.get(name, {})),
+                sorted(commands)))
+
+            pending: dict[str, list[dict[str, Any]]] = {}
+            for result in results:
+                if result["compile"]:
+                    pending.setdefault(result["compile"][0], []).append(result)
+
+            def compile_group(interpreter: str) -> None:
+                start = time.perf_counter()
+                group = pending[interpreter]
+                try:
+                    errors = compile_sources(interpreter, sorted({result["source"] for result in group}))
+                except RuntimeError as error:
+                    # Not the scripts' fault, so nothing is cached
+                    for result in group:
+                        result["problems"].append({"check": "interpreter", "message": str(error)})
+                    return
+                elapsed = (time.perf_counter() - start) / len(group)
+                for result in group:
+                    result["compiled"] = True
+                    error = errors[result["source"]]
+                    entries[result["name"]] = {"key": result["compile"], "interpreter": interpreter,
+                                               "hash": hash_file(result["source"]), "error": error}
+                    if error:
+                        result["problems"].append({"check": "compile", "message": error})
+                    result["time"] += elapsed
+
+            list(executor.map(compile_group, pending))
+
+        for name in set(entries) - set(commands) if prune else ():
+            del entries[name]
+        for result in results:
+            if result["name"] in entries and not result.get("source"):
+                del entries[result["name"]]
+            del result["compile"]
+
+        os.makedirs(os.path.dirname(self.cache.path), exist_ok=True)
+        self.cache.write_config(cache)
+        return results
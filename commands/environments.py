@@ -0,0 +1,228 @@
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+from typing import Optional
+
+from commands.bundle import find_local_files, get_imported_modules
+from config import Config
+
+ENVIRONMENT_MANIFEST = ".bake-packages.json"
+# The store keys each set of requirements resolved to, by interpreter, so pip only runs for sets never seen before
+RESOLVED_INDEX = "resolved.json"
+
+# Import names whose distribution on PyPI is called something else
+DISTRIBUTION_NAMES = {
+    "PIL": "Pillow",
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "jwt": "PyJWT",
+    "sklearn": "scikit-learn",
+    "yaml": "PyYAML",
+}
+
+
+def read_requirements(path: str) -> list[str]:
+    """
+    Read the requirement specifiers from a requirements file, skipping comments and pip options.
+
+    :param path: The requirements file.
+    :return: Requirement specifiers.
+    """
+    requirements = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.split("#", 1)[0].strip()
+            if line and not line.startswith("-"):
+                requirements.append(line)
+    return requirements
+
+
+def get_stdlib_names() -> frozenset[str]:
+    """
+    Get the names of the standard library's top-level modules.
+
+    :return: The module names.
+    """
+    if hasattr(sys, "stdlib_module_names"):
+        return frozenset(sys.stdlib_module_names)
+
+    # Python < 3.10: list the standard library's folders instead
+    names = set(sys.builtin_module_names)
+    stdlib_path = sysconfig.get_paths()["stdlib"]
+    for folder in (stdlib_path, os.path.join(stdlib_path, "lib-dynload")):
+        try:
+            entries = os.listdir(folder)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.endswith(".py") or ".so" in entry or ".pyd" in entry:
+                names.add(entry.split(".")[0])
+            elif os.path.isfile(os.path.join(folder, entry, "__init__.py")):
+                names.add(entry)
+    return frozenset(names)
+
+
+def detect_requirements(source: str, requirements_path: Optional[str] = None) -> list[str]:
+    """
+    Work out which third-party distributions a script needs: from an explicit requirements file, a
+    requirements.txt next to the script, or by scanning the imports of the script and its local modules.
+
+    :param source: The script.
+    :param requirements_path: Optional requirements file to use instead of detection.
+    :return: Requirement specifiers.
+    """
+    sibling = os.path.join(os.path.dirname(os.path.abspath(source)), "requirements.txt")
+    if requirements_path or os.path.isfile(sibling):
+        return read_requirements(requirements_path or sibling)
+
+    files = find_local_files(source)
+    local_names = {relative_path.split(os.sep)[0].removesuffix(".py") for relative_path in files}
+    stdlib_names = get_stdlib_names()
+    requirements = []
+    for path in files.values():
+        try:
+            with open(path, "rb") as file:
+                tree = ast.parse(file.read(), path)
+        except (OSError, SyntaxError, ValueError):
+            continue
+
+        for name in get_imported_modules(tree):
+            top_level = name.split(".")[0]
+            if top_level in stdlib_names or top_level in local_names or top_level == "__future__":
+                continue
+            distribution = DISTRIBUTION_NAMES.get(top_level, top_level)
+            if distribution not in requirements:
+                requirements.append(distribution)
+    return requirements
+
+
+def link_tree(source_path: str, target_path: str, skip: frozenset[str] = frozenset()) -> None:
+    """
+    Hardlink every file under a directory into another, copying when the two are on different file systems.
+
+    :param source_path: The directory to link from.
+    :param target_path: The directory to link into.
+    :param skip: Names of top-level directories to leave out.
+    """
+    for folder, dirs, filenames in os.walk(source_path):
+        if folder == source_path:
+            dirs[:] = [d for d in dirs if d not in skip]
+        target_folder = os.path.join(target_path, os.path.relpath(folder, source_path))
+        os.makedirs(target_folder, exist_ok=True)
+        for filename in filenames:
+            target = os.path.join(target_folder, filename)
+            if os.path.lexists(target):
+                os.remove(target)
+            try:
+                os.link(os.path.join(folder, filename), target)
+            except OSError:
+                shutil.copy2(os.path.join(folder, filename), target)
+
+
+def add_to_store(wheel_path: str, interpreter: str, store_path: str) -> str:
+    """
+    Install a wheel into the content-addressed package store unless it is already there.
+
+    :param wheel_path: The wheel file.
+    :param interpreter: The interpreter that installs (and byte-compiles) the wheel.
+    :param store_path: The package store.
+    :return: The wheel's store key.
+    """
+    digest = hashlib.sha256()
+    with open(wheel_path, "rb") as wheel:
+        for chunk in iter(lambda: wheel.read(1 << 20), b""):
+            digest.update(chunk)
+    key = f"{digest.hexdigest()[:32]}-{os.path.basename(wheel_path)}"
+
+    installed_path = os.path.join(store_path, key)
+    if not os.path.isdir(installed_path):
+        staging_path = tempfile.mkdtemp(prefix=".install-", dir=store_path)
+        try:
+            subprocess.run([interpreter, "-m", "pip", "install", "--quiet", "--disable-pip-version-check",
+                            "--no-deps", "--no-index", "--target", staging_path, wheel_path], check=True)
+            os.replace(staging_path, installed_path)
+        except OSError:
+            if not os.path.isdir(installed_path):  # Another bake process didn't install it first
+                raise
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+    return key
+
+
+def build_environment(venv_path: str, interpreter: str, requirements: list[str], store_path: str,
+                      wheel_dir: Optional[str] = None) -> tuple[str, bool]:
+    """
+    Create a virtualenv whose packages are hardlinked from the shared package store. Each unique wheel is
+    installed into the store once, and the virtualenv is only recreated when its set of wheels changes. A set of
+    requirements is resolved together by pip the first time an interpreter needs it, and later bakes of the same
+    set reuse what it resolved to while those wheels are still in the store, so they don't run pip or touch the
+    network.
+
+    :param venv_path: Where the virtualenv lives.
+    :param interpreter: The base interpreter of the virtualenv.
+    :param requirements: Requirement specifiers to install.
+    :param store_path: The package store.
+    :param wheel_dir: Optional local directory of wheels to install from without touching the network.
+    :return: The virtualenv's interpreter and whether the virtualenv was (re)created.
+    :raises ValueError: If the resolved wheels include two versions of one distribution.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    index = Config(os.path.join(store_path, RESOLVED_INDEX))
+    requirements_key = "\n".join(sorted(set(requirements)))
+    try:
+        keys = index.load_config().get(interpreter, {}).get(requirements_key)
+    except (OSError, ValueError):
+        keys = None
+
+    if requirements and (keys is None or not all(os.path.isdir(os.path.join(store_path, key)) for key in keys)):
+        with tempfile.TemporaryDirectory(prefix=".wheels-", dir=store_path) as wheelhouse:
+            command = [interpreter, "-m", "pip", "wheel", "--quiet", "--disable-pip-version-check",
+                       "--wheel-dir", wheelhouse]
+            if wheel_dir:
+                command += ["--no-index", "--find-links", wheel_dir]
+            subprocess.run(command + requirements, check=True)
+            keys = [add_to_store(os.path.join(wheelhouse, wheel), interpreter, store_path)
+                    for wheel in sorted(os.listdir(wheelhouse)) if wheel.endswith(".whl")]
+        with index.transaction() as data:
+            data.setdefault(interpreter, {})[requirements_key] = keys
+    keys = sorted(keys or [])
+
+    # Overlaying two versions of a distribution would leave a mix of both versions' files
+    distributions = {}
+    for key in keys:
+        distribution = key.split("-")[1].lower()  # Keys are '<digest>-<wheel file name>'
+        if distribution in distributions:
+            raise ValueError(f"Requirements resolved to two versions of '{distribution}': "
+                             f"{distributions[distribution]} and {key}")
+        distributions[distribution] = key
+
+    python_path = os.path.join(venv_path, "bin", "python")
+    manifest_path = os.path.join(venv_path, ENVIRONMENT_MANIFEST)
+    manifest = {"interpreter": interpreter, "packages": keys}
+    try:
+        with open(manifest_path, "r") as file:
+            if json.loads(file.read()) == manifest and os.path.exists(python_path):
+                return python_path, False
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(venv_path, ignore_errors=True)
+    subprocess.run([interpreter, "-m", "venv", "--without-pip", venv_path], check=True)
+    site_packages = subprocess.run([python_path, "-c", "import sysconfig; print(sysconfig.get_path('purelib'))"],
+                                   check=True, capture_output=True, text=True).stdout.strip()
+
+    for key in keys:
+        # Console scripts point at the store's interpreter, so they aren't linked
+        link_tree(os.path.join(store_path, key), site_packages, skip=frozenset({"bin"}))
+
+    with open(manifest_path, "w") as file:
+        file.write(json.dumps(manifest))
+    return python_path, True
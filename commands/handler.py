@@ -1,39 +1,141 @@
+import fnmatch
+import itertools
+import json
 import os
+import shutil
+import subprocess
+import sys
 import time
-from typing import Optional
-
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Iterator, Optional, TextIO
+
+from commands.cache import get_cache_settings
+from commands.dispatch import CommandTable
+from commands.limits import get_limit_settings
+from commands.registry import Registry
+from commands.store import SnapshotStore
+from constants import COMMAND_TABLE_LOCATION, DISPATCHER_LOCATION, INTERPRETER_CACHE_LOCATION, PACKAGE_STORE_FOLDER, \
+    SNAPSHOT_STORE_FOLDER, TELEMETRY_LOCATION, VENV_FOLDER
+from commands.wrapper import DEFAULT_INTERPRETER, DEFAULT_WRAPPER_MODE, EXEC_SHEBANG, SHEBANG_MODES, WrapperMode, \
+    parse_wrapper, render_wrapper, resolve_interpreter
 from utils.console import MessageType, format_msg
-from utils.shell import chmod_executable, get_current_shell_path
+from utils.filesystem import atomic_write
+
+LIST_SORT_KEYS = ("name", "mtime", "size", "last-used")
+LIST_FORMATS = ("table", "json", "ndjson", "tsv")
+LIST_FIELDS = ("name", "mode", "interpreter", "source", "size", "modified", "last_used", "broken", "path")
 
 
 class CommandHandler:
-    def __init__(self, commands_path: str, verbose: bool = False) -> None:
+    def __init__(self, commands_path: str, verbose: bool = False, registry_path: Optional[str] = None) -> None:
         """
         Initializes the CommandHandler instance.
 
         :param commands_path: Directory path where commands are stored.
         :param verbose: Flag to enable verbose output.
+        :param registry_path: Optional path of a registry index to answer lookups from instead of the wrapper files.
         """
         self.commands_path = commands_path
         self.verbose = verbose
+        self.registry = Registry(registry_path, commands_path) if registry_path else None
+        self.table = CommandTable(COMMAND_TABLE_LOCATION, DISPATCHER_LOCATION)
+
+    def get_registry(self) -> Optional[Registry]:
+        """
+        Get the registry index, loading or rebuilding it on first use.
+
+        :return: The registry, or None if this handler doesn't use one.
+        """
+        if self.registry:
+            self.registry.ensure_loaded(parse_wrapper, self.read_wrapper)
+        return self.registry
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Group changes so the registry and the command table are each written once when the block finishes.
+        """
+        registry = self.get_registry()
+        with registry.batch() if registry else nullcontext(), self.table.batch():
+            yield
 
-    def create_command(self, command_name: str, baked_command: str, starting_location: Optional[str] = None) -> None:
+    def read_wrapper(self, command_path: str) -> str:
         """
-        Create a new baked command.
+        Read a command's wrapper. Commands linked to the dispatcher are read from the command table.
+
+        :param command_path: The command's path.
+        :return: The wrapper contents, empty for a dispatcher link missing from the table.
+        :raises OSError: If the wrapper can't be read.
+        """
+        if self.table.is_link(command_path):
+            return self.table.read_wrapper(os.path.basename(command_path)) or ""
+        with open(command_path, "r") as file:
+            return file.read()
+
+    def reindex(self) -> int:
+        """
+        Rebuild the registry index from the wrapper files on disk.
+
+        :return: The number of indexed commands.
+        """
+        if not self.registry:
+            return 0
+        return self.registry.reindex(parse_wrapper, self.read_wrapper)
+
+    def get_command_names(self) -> list[str]:
+        """
+        Get the names of all commands.
+
+        :return: Sorted command names.
+        """
+        registry = self.get_registry()
+        if registry:
+            return sorted(registry.names())
+        return sorted(cmd for cmd in os.listdir(self.commands_path) if not cmd.startswith("."))
+
+    def create_command(self, command_name: str, baked_command: str, starting_location: Optional[str] = None) -> bool:
+        """
+        Create a new baked command. The wrapper is written to a temporary file, fsynced and renamed into place, so
+        it is never seen half-written.
 
         :param command_name: The name of the command.
         :param baked_command: The command's compiled string.
         :param starting_location: Optional path where the command will be created. Defaults to `self.commands_path`.
+        :return: True if the command was created, otherwise False.
+        """
+        try:
+            self.write_command(command_name, baked_command, starting_location)
+            return True
+        except (IOError, ValueError) as e:
+            print(f"{format_msg(MessageType.ERROR)} Failed to create command: {e}")
+            return False
+
+    def write_command(self, command_name: str, baked_command: str, starting_location: Optional[str] = None) -> None:
+        """
+        Write a baked command's wrapper and registry entry.
+
+        :param command_name: The name of the command.
+        :param baked_command: The command's compiled string.
+        :param starting_location: Optional path where the command will be created. Defaults to `self.commands_path`.
+        :raises OSError: If the wrapper can't be written.
+        :raises ValueError: If a dispatch wrapper can't be added to the command table.
         """
         location = starting_location or self.commands_path
         full_path = os.path.join(location, command_name)
 
-        try:
-            with open(full_path, "w") as command_file:
-                command_file.write(baked_command)
-            chmod_executable(full_path)
-        except IOError as e:
-            print(f"{format_msg(MessageType.ERROR)} Failed to create command: {e}")
+        if baked_command.startswith(f"#!{DISPATCHER_LOCATION}\n"):
+            self.table.install_dispatcher(sys.executable)
+            self.table.link(full_path, baked_command)
+        else:
+            linked = self.table.is_link(full_path) or full_path in self.table.pending_links
+            atomic_write(full_path, baked_command, 0o755)
+            if linked:
+                self.table.remove(command_name)
+
+        registry = self.get_registry()
+        if registry and location == self.commands_path:
+            registry.update(command_name, baked_command, parse_wrapper(baked_command))
 
     def edit_command(self, command_name: str) -> None:
         """
@@ -48,36 +150,78 @@ class CommandHandler:
             return
 
         try:
-            with open(full_path, "r") as file:
-                contents = file.read()
+            contents = self.read_wrapper(full_path)
+
+            wrapper = self.parse_command(command_name)
+            if not wrapper:
+                print(f"{format_msg(MessageType.ERROR)} Command '{command_name}' is not a baked command")
+                return
 
             # Display current command and prompt for updates
             print(contents)
             new_name = input(f"Command name (leave empty for '{command_name}'): ").strip() or command_name
-            parts = contents.split()
-            new_shebang = input(f"Shebang (leave empty for '{parts[0]}'): ").strip() or parts[0]
-            new_interpreter = input(f"Interpreter (leave empty for '{parts[1]}'): ").strip() or parts[1]
-            new_source = input(f"Source (leave empty for '{parts[2]}'): ").strip() or parts[2]
+            new_mode = input(f"Wrapper mode (leave empty for '{wrapper['mode']}'): ").strip() or wrapper["mode"]
+            new_shebang = input(f"Shebang (leave empty for '{wrapper['shebang']}'): ").strip()
+            new_interpreter = input(f"Interpreter (leave empty for '{wrapper['interpreter']}'): ").strip()
+            new_interpreter = self.find_interpreter(new_interpreter) if new_interpreter else wrapper["interpreter"]
+            new_source = input(f"Source (leave empty for '{wrapper['source']}'): ").strip() or wrapper["source"]
+            new_description = (input(f"Description (leave empty for '{wrapper.get('description', '')}'): ").strip()
+                               or wrapper.get("description"))
+
+            # A command's virtualenv follows it when it is renamed
+            old_venv, new_venv = self.get_venv_path(command_name), self.get_venv_path(new_name)
+            if new_name != command_name and new_interpreter.startswith(old_venv + os.sep):
+                shutil.rmtree(new_venv, ignore_errors=True)
+                os.rename(old_venv, new_venv)
+                new_interpreter = new_venv + new_interpreter[len(old_venv):]
+
+            # Compiled, bundled and snapshotted commands are rebuilt for their new name, source and interpreter
+            target = None
+            if wrapper.get("target"):
+                target = self.rebuild_target(new_name, new_source, new_interpreter, wrapper["target"])
+
+            # Only shell and exec wrappers keep their shebang
+            if not new_shebang and WrapperMode(new_mode) in SHEBANG_MODES:
+                new_shebang = wrapper["shebang"]
 
             # Create updated command
-            baked_command = self.bake_command(new_source, new_shebang, new_interpreter)
+            baked_command = self.bake_command(new_source, new_shebang or None, new_interpreter, WrapperMode(new_mode),
+                                              target, wrapper.get("telemetry", False), new_description,
+                                              wrapper.get("cache"), wrapper.get("limits"))
             self.create_command(new_name, baked_command)
 
             # Delete old command if name changed
             if new_name != command_name:
                 self.delete_command(command_name)
 
+        except ValueError as e:
+            print(f"{format_msg(MessageType.ERROR)} Failed to edit command: {e}")
+        except subprocess.CalledProcessError as e:
+            print(f"{format_msg(MessageType.ERROR)} Failed to compile command: {e}")
         except IOError as e:
             print(f"{format_msg(MessageType.ERROR)} Failed to edit command: {e}")
 
     def command_exists(self, command_name: str) -> bool:
         """
-        Check if a command exists.
+        Check if a command exists. An indexed command whose wrapper was removed by hand is cleaned up and reported
+        as missing.
 
         :param command_name: The name of the command to check.
         :return: True if the command exists, otherwise False.
         """
-        return os.path.exists(self.get_command_path(command_name))
+        registry = self.get_registry()
+        command_path = self.get_command_path(command_name)
+        if not registry:
+            return os.path.exists(command_path)
+        if registry.get(command_name) is None:
+            return False
+        if os.path.lexists(command_path) or command_path in self.table.pending_links:
+            return True
+        try:  # Its wrapper was removed by hand, so clear what it left behind
+            self.remove_command(command_name)
+        except OSError:
+            pass
+        return False
 
     def view_command(self, command_name: str) -> None:
         """
@@ -89,45 +233,150 @@ class CommandHandler:
             print(f"{format_msg(MessageType.ERROR)} Command '{command_name}' does not exist")
             return
 
-        try:
-            with open(self.get_command_path(command_name), "r") as file:
-                content = file.read().splitlines()
-                shebang, command = content[0], content[1].split()
-
-                # Set a fixed width for formatted output
-                field_width = 25
-                print(f"{format_msg(MessageType.SHEBANG):<{field_width}} {shebang}")
-                print(f"{format_msg(MessageType.INTERPRETER):<{field_width}} {command[0]}")
-                print(f"{format_msg(MessageType.PATH):<{field_width}} {command[1]}")
-                print(f"{format_msg(MessageType.SYMBOL):<{field_width}} {command[2]}")
-        except IOError as e:
-            print(f"{format_msg(MessageType.ERROR)} Failed to read command: {e}")
+        wrapper = self.parse_command(command_name)
+        if not wrapper:
+            print(f"{format_msg(MessageType.ERROR)} Command '{command_name}' is not a baked command")
+            return
+
+        # Set a fixed width for formatted output
+        field_width = 25
+        print(f"{format_msg(MessageType.SHEBANG):<{field_width}} {wrapper['shebang']}")
+        print(f"{format_msg(MessageType.INTERPRETER):<{field_width}} {wrapper['interpreter']}")
+        print(f"{format_msg(MessageType.PATH):<{field_width}} {wrapper['source']}")
+        print(f"{format_msg(MessageType.MODE):<{field_width}} {wrapper['mode']}")
+
+    def iter_commands(self, sort: str = "name", interpreter: Optional[str] = None, broken_only: bool = False,
+                      pattern: Optional[str] = None, details: bool = False) -> Iterator[dict[str, Any]]:
+        """
+        Scan the commands directory, yielding one row per command. Rows are built lazily, so when sorting by name
+        only the rows that are consumed get stat'ed.
+
+        :param sort: One of LIST_SORT_KEYS. Name sorts ascending, the others newest or largest first.
+        :param interpreter: Only yield commands using this interpreter (a path or a name like 'python3').
+        :param broken_only: Only yield commands whose source, build or interpreter is missing.
+        :param pattern: Only yield commands whose names match this glob.
+        :param details: Include size, modification time, last use and whether the command is broken.
+        :return: Rows with the command's name, path, mode, interpreter and source, plus any details.
+        """
+        details = details or broken_only or sort != "name"
+        last_used = self.get_last_used() if details else {}
+        resolved: dict[str, Optional[str]] = {}
+
+        def make_row(entry: os.DirEntry) -> dict[str, Any]:
+            wrapper = self.parse_command(entry.name) or {}
+            row = {"name": entry.name, "path": entry.path, "mode": wrapper.get("mode"),
+                   "interpreter": wrapper.get("interpreter"), "source": wrapper.get("source")}
+            if details:
+                stat = entry.stat(follow_symlinks=False)
+                row["size"] = stat.st_size
+                row["modified"] = stat.st_mtime
+                row["last_used"] = last_used.get(entry.name, stat.st_atime)
+                broken = False
+                if wrapper:
+                    if wrapper["interpreter"] not in resolved:
+                        resolved[wrapper["interpreter"]] = resolve_interpreter(wrapper["interpreter"])
+                    broken = not (resolved[wrapper["interpreter"]] and os.path.exists(wrapper["source"])
+                                  and os.path.exists(wrapper.get("target") or wrapper["source"]))
+                row["broken"] = broken
+            return row
+
+        def keep(row: dict[str, Any]) -> bool:
+            if broken_only and not row["broken"]:
+                return False
+            if interpreter and interpreter not in (row["interpreter"], os.path.basename(row["interpreter"] or "")):
+                return False
+            return True
+
+        with os.scandir(self.commands_path) as scanned:
+            entries = [entry for entry in scanned if not entry.name.startswith(".")
+                       and (not pattern or fnmatch.fnmatchcase(entry.name, pattern))]
+
+        if sort == "name":
+            entries.sort(key=lambda entry: entry.name)
+            yield from filter(keep, map(make_row, entries))
+            return
 
-    def list_commands(self) -> None:
+        rows = list(filter(keep, map(make_row, entries)))
+        key = {"mtime": "modified", "size": "size", "last-used": "last_used"}[sort]
+        rows.sort(key=lambda row: (-row[key], row["name"]))
+        yield from rows
+
+    @staticmethod
+    def get_last_used() -> dict[str, float]:
         """
-        List all available baked commands.
+        Get when each command baked with telemetry last ran.
 
-        :return: None
+        :return: Start time of the latest recorded run, keyed by command name.
         """
-        try:
-            # List all non-hidden files in the commands directory
-            commands = [cmd for cmd in os.listdir(self.commands_path) if not cmd.startswith(".")]
+        from commands.telemetry import read_records
 
-            # Define column widths for consistent formatting
-            command_width = 15
-            path_width = max(len(os.path.join(self.commands_path, cmd)) for cmd in commands)
+        last_used = {}
+        for record in read_records(TELEMETRY_LOCATION):
+            last_used[record["command"]] = max(last_used.get(record["command"], 0), record["start"])
+        return last_used
 
-            for command in commands:
-                full_path = os.path.join(self.commands_path, command)
-                # Include modification time and path if verbose
-                if self.verbose:
-                    mod_time = time.ctime(os.path.getmtime(full_path))
-                    extra = f" | {full_path:<{path_width}} | {mod_time}"
+    def list_commands(self, sort: str = "name", interpreter: Optional[str] = None, broken_only: bool = False,
+                      pattern: Optional[str] = None, offset: int = 0, limit: Optional[int] = None,
+                      output_format: str = "table", stream: Optional[TextIO] = None) -> int:
+        """
+        List baked commands, streaming them to the output in buffered chunks. Colors are only used on a terminal.
+
+        :param sort: One of LIST_SORT_KEYS.
+        :param interpreter: Only list commands using this interpreter.
+        :param broken_only: Only list commands whose source, build or interpreter is missing.
+        :param pattern: Only list commands whose names match this glob.
+        :param offset: Number of matching commands to skip.
+        :param limit: Maximum number of commands to list.
+        :param output_format: One of LIST_FORMATS.
+        :param stream: Where to write. Defaults to stdout.
+        :return: The number of commands listed.
+        """
+        stream = stream or sys.stdout
+        color = stream.isatty()
+        details = self.verbose or output_format != "table"
+        buffer = []
+        listed = 0
+
+        def flush() -> None:
+            stream.write("".join(buffer))
+            buffer.clear()
+
+        try:
+            rows = self.iter_commands(sort, interpreter, broken_only, pattern, details)
+            rows = itertools.islice(rows, offset, offset + limit if limit else None)
+            if output_format == "json":
+                buffer.append("[")
+            elif output_format == "tsv":
+                buffer.append("\t".join(LIST_FIELDS) + "\n")
+
+            for row in rows:
+                if output_format == "json":
+                    buffer.append(("," if listed else "") + "\n    " + json.dumps(row))
+                elif output_format == "ndjson":
+                    buffer.append(json.dumps(row) + "\n")
+                elif output_format == "tsv":
+                    buffer.append("\t".join("" if row.get(field) is None else str(row[field])
+                                            for field in LIST_FIELDS) + "\n")
                 else:
+                    # Include modification time and path if verbose
                     extra = ""
-                print(f"{format_msg(MessageType.CMD)} {command:<{command_width}} {extra}")
+                    if self.verbose:
+                        extra = f" | {row['path']:<{len(self.commands_path) + 16}} | {time.ctime(row['modified'])}"
+                    buffer.append(f"{format_msg(MessageType.CMD, color)} {row['name']:<15} {extra}\n")
+                listed += 1
+                if len(buffer) >= 256:
+                    flush()
+
+            if output_format == "json":
+                buffer.append("\n]\n" if listed else "]\n")
+            flush()
+            stream.flush()
+        except BrokenPipeError:
+            # The reader went away, e.g. 'bake -l | head'. Point stdout at /dev/null so exiting doesn't fail too
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
         except OSError as e:
             print(f"{format_msg(MessageType.ERROR)} Failed to list commands: {e}")
+        return listed
 
     def delete_command(self, command_name: str) -> None:
         """
@@ -140,10 +389,38 @@ class CommandHandler:
             return
 
         try:
-            os.remove(self.get_command_path(command_name))
+            self.remove_command(command_name)
         except OSError as e:
             print(f"{format_msg(MessageType.ERROR)} Failed to delete command: {e}")
 
+    def remove_command(self, command_name: str) -> None:
+        """
+        Remove a command's wrapper, registry entry, builds and virtualenv.
+
+        :param command_name: The name of the command to remove.
+        :raises OSError: If the wrapper can't be removed.
+        """
+        wrapper = self.parse_command(command_name)
+        linked = self.table.is_link(self.get_command_path(command_name))
+        try:
+            os.remove(self.get_command_path(command_name))
+        except FileNotFoundError:
+            linked = True  # Already removed by hand, so clear any table entry it left too
+        if linked:
+            self.table.remove(command_name)
+        registry = self.get_registry()
+        if registry:
+            registry.remove(command_name)
+        build_path, bundle_path = self.get_build_paths(command_name)
+        shutil.rmtree(build_path, ignore_errors=True)
+        if os.path.exists(bundle_path):
+            os.remove(bundle_path)
+        venv_path = self.get_venv_path(command_name)
+        if wrapper and wrapper["interpreter"].startswith(venv_path + os.sep):
+            shutil.rmtree(venv_path, ignore_errors=True)
+        if wrapper and self.get_snapshot_store().is_snapshot(wrapper.get("target")):
+            self.collect_snapshots()
+
     def get_command_path(self, command_name: str) -> str:
         """
         Get the full path for a command.
@@ -160,22 +437,417 @@ class CommandHandler:
         :param command_name: The name of the command.
         :return: Path of the command's source, or None if the command doesn't exist.
         """
+        wrapper = self.parse_command(command_name)
+        return wrapper["source"] if wrapper else None
+
+    def parse_command(self, command_name: str) -> Optional[dict[str, Any]]:
+        """
+        Read and parse a command's wrapper file.
+
+        :param command_name: The name of the command.
+        :return: The wrapper's mode, shebang, interpreter and source, or None if it isn't a readable baked command.
+        """
+        registry = self.get_registry()
+        if registry:
+            entry = registry.get(command_name)
+            return dict(entry["wrapper"]) if entry and entry["wrapper"] else None
+
         if not self.command_exists(command_name):
             return None
 
-        with open(self.get_command_path(command_name), "r") as file:
-            return file.read().split()[2]
+        try:
+            return parse_wrapper(self.read_wrapper(self.get_command_path(command_name)))
+        except (IOError, UnicodeDecodeError):
+            return None
+
+    def repair_command(self, command_name: str, problems: list[dict[str, Any]]) -> list[str]:
+        """
+        Fix what can be fixed about a broken command (see commands.doctor): re-point a moved source or a moved
+        interpreter, reset a broken shebang, rebuild a missing build and make the wrapper executable. Commands
+        whose source is gone for good are removed.
+
+        :param command_name: The name of the command.
+        :param problems: The command's problems as reported by the doctor.
+        :return: Descriptions of what was done.
+        """
+        from commands.doctor import find_moved_source
+
+        checks = {problem["check"] for problem in problems}
+        wrapper = self.parse_command(command_name)
+        if not wrapper:
+            return []
+
+        actions = []
+        source, interpreter = wrapper["source"], wrapper["interpreter"]
+        if "source" in checks:
+            source = find_moved_source(wrapper["source"])
+            if not source:
+                self.delete_command(command_name)
+                return ["removed, its source is gone"]
+            actions.append(f"re-pointed source to {source}")
+        if "interpreter" in checks:
+            interpreter = shutil.which(os.path.basename(wrapper["interpreter"])) or wrapper["interpreter"]
+            if interpreter != wrapper["interpreter"]:
+                actions.append(f"re-pointed interpreter to {interpreter}")
+        keeps_shebang = "shebang" not in checks and WrapperMode(wrapper["mode"]) in SHEBANG_MODES
+        shebang = wrapper["shebang"] if keeps_shebang else None
+        if "shebang" in checks:
+            actions.append("reset shebang")
+
+        if actions or "build" in checks:
+            try:
+                target = None
+                if wrapper.get("target"):
+                    target = self.rebuild_target(command_name, source, interpreter, wrapper["target"])
+                    actions.append("rebuilt")
+                baked_command = self.bake_command(source, shebang, interpreter, WrapperMode(wrapper["mode"]), target,
+                                                  wrapper.get("telemetry", False), wrapper.get("description"),
+                                                  wrapper.get("cache"), wrapper.get("limits"))
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                return [f"failed to repair: {e}"]
+            self.create_command(command_name, baked_command)
+        elif "wrapper" in checks:
+            os.chmod(self.get_command_path(command_name), 0o755)
+            actions.append("made executable")
+        return actions
+
+    def migrate_wrappers(self, mode: WrapperMode = DEFAULT_WRAPPER_MODE) -> int:
+        """
+        Rewrite every baked command in the given wrapper format.
+
+        :param mode: The wrapper format to convert to.
+        :return: The number of commands that were rewritten.
+        """
+        migrated = 0
+        with self.batch():
+            for command_name in self.get_command_names():
+                wrapper = self.parse_command(command_name)
+                if not wrapper or wrapper["mode"] == mode.value:
+                    continue
+
+                # Shell shebangs don't carry over to the other formats
+                shebang = wrapper["shebang"] if mode is WrapperMode.SHELL else None
+                try:
+                    baked_command = self.bake_command(wrapper["source"], shebang, wrapper["interpreter"], mode,
+                                                      wrapper.get("target"), wrapper.get("telemetry", False),
+                                                      wrapper.get("description"), wrapper.get("cache"),
+                                                      wrapper.get("limits"))
+                except ValueError as e:
+                    print(f"{format_msg(MessageType.ERROR)} Failed to migrate '{command_name}': {e}")
+                    continue
+
+                if not self.create_command(command_name, baked_command):
+                    continue
+                migrated += 1
+                if self.verbose:
+                    print(f"{format_msg(MessageType.CMD)} {command_name}: {wrapper['mode']} -> {mode.value}")
+        return migrated
+
+    def apply_manifest(self, entries: list[dict[str, Any]], prune: bool = False,
+                       jobs: Optional[int] = None) -> list[tuple[str, str]]:
+        """
+        Bake every command in a validated manifest (see commands.manifest) in parallel, writing the registry and
+        command table once.
+
+        :param entries: The manifest entries.
+        :param prune: Delete baked commands that aren't in the manifest.
+        :param jobs: Number of commands written at once. Defaults to the thread pool's default.
+        :return: The name and outcome (created, updated, unchanged, pruned or failed) of every command touched.
+        """
+        existing = set(self.get_command_names())
+
+        def apply(entry: dict[str, Any]) -> tuple[str, str]:
+            name, source = entry["name"], entry["source"]
+            try:
+                interpreter = self.find_interpreter(entry.get("interpreter"))
+                target = None
+                if entry.get("snapshot"):
+                    target = self.snapshot_command(name, source)
+                elif entry.get("compile") or entry.get("bundle"):
+                    target = self.build_command(name, source, interpreter, bool(entry.get("bundle")))
+                telemetry = bool(entry.get("telemetry"))
+                cache = get_cache_settings(entry["cache"]) if entry.get("cache") else None
+                limits = get_limit_settings(entry["limits"]) if entry.get("limits") else None
+                mode = WrapperMode(entry["wrapper"]) if entry.get("wrapper") else \
+                    WrapperMode.DIRECT if telemetry or cache or limits else DEFAULT_WRAPPER_MODE
+                baked_command = self.bake_command(source, entry.get("shebang"), interpreter, mode, target, telemetry,
+                                                  entry.get("description"), cache, limits)
+
+                if name in existing and self.read_wrapper(self.get_command_path(name)) == baked_command:
+                    return name, "unchanged"
+            except (OSError, UnicodeDecodeError, ValueError, subprocess.CalledProcessError) as e:
+                return name, f"failed: {e}"
+
+            if not self.create_command(name, baked_command):
+                return name, "failed"
+            return name, "updated" if name in existing else "created"
+
+        with self.batch():
+            with ThreadPoolExecutor(max(1, jobs) if jobs is not None else None) as executor:
+                results = list(executor.map(apply, entries))
+
+            if prune:
+                wanted = {entry["name"] for entry in entries}
+                for name in sorted(existing - wanted):
+                    if name != "bake" and self.parse_command(name):
+                        self.delete_command(name)
+                        results.append((name, "pruned"))
+        return results
+
+    def export_manifest(self) -> list[dict[str, Any]]:
+        """
+        Describe every baked command as a manifest entry.
+
+        :return: The manifest entries.
+        """
+        entries = []
+        for name in self.get_command_names():
+            wrapper = self.parse_command(name)
+            if not wrapper or name == "bake":
+                continue
+
+            entry = {"name": name, "source": wrapper["source"], "interpreter": wrapper["interpreter"],
+                     "wrapper": wrapper["mode"]}
+            if wrapper["mode"] == WrapperMode.SHELL.value or (wrapper["mode"] == WrapperMode.EXEC.value
+                                                             and wrapper["shebang"] != EXEC_SHEBANG):
+                entry["shebang"] = wrapper["shebang"]
+            if self.get_snapshot_store().is_snapshot(wrapper.get("target")):
+                entry["snapshot"] = True
+            elif wrapper.get("target"):
+                entry["bundle" if wrapper["target"].endswith(".pyz") else "compile"] = True
+            if wrapper.get("telemetry"):
+                entry["telemetry"] = True
+            if wrapper.get("cache"):
+                entry["cache"] = wrapper["cache"]
+            if wrapper.get("limits"):
+                entry["limits"] = wrapper["limits"]
+            if wrapper.get("description"):
+                entry["description"] = wrapper["description"]
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    def get_venv_path(command_name: str) -> str:
+        """
+        Get the path of a command's dedicated virtualenv.
+
+        :param command_name: The name of the command.
+        :return: Path of the virtualenv.
+        """
+        return os.path.join(VENV_FOLDER, command_name)
+
+    @staticmethod
+    def find_interpreter(spec: Optional[str] = None) -> str:
+        """
+        Resolve an interpreter spec to the absolute path wrappers run, so no PATH search happens at runtime.
+
+        :param spec: A path, an executable name, or a version spec like '3.11' or 'pypy' (defaults to 'python3').
+        :return: The interpreter's absolute path. Without a spec, 'python3' is kept as is if it isn't on PATH.
+        :raises ValueError: If nothing matches the spec.
+        """
+        from commands.interpreters import InterpreterIndex
+
+        interpreter = InterpreterIndex(INTERPRETER_CACHE_LOCATION).find(spec or DEFAULT_INTERPRETER)
+        if not interpreter:
+            if not spec:
+                return DEFAULT_INTERPRETER
+            raise ValueError(f"No interpreter matches '{spec}', see 'bake --interpreters'")
+        return interpreter
+
+    def create_environment(self, command_name: str, source: str, interpreter: Optional[str] = None,
+                           requirements_path: Optional[str] = None, wheel_dir: Optional[str] = None) -> str:
+        """
+        Create a dedicated virtualenv for a command, with its packages hardlinked from the shared package store.
+
+        :param command_name: The name of the command.
+        :param source: The source of the Python file, scanned for third-party imports.
+        :param interpreter: Optional base interpreter (defaults to 'python3').
+        :param requirements_path: Optional requirements file to install instead of the detected imports.
+        :param wheel_dir: Optional local directory of wheels to install from offline.
+        :return: The virtualenv's interpreter, for the wrapper to run.
+        """
+        from commands.environments import build_environment, detect_requirements
+
+        interpreter = interpreter or DEFAULT_INTERPRETER
+        requirements = detect_requirements(source, requirements_path)
+        if self.verbose:
+            print(f"{format_msg(MessageType.NOTICE)} Requirements: {', '.join(requirements) or 'none'}")
+
+        start = time.perf_counter()
+        python_path, created = build_environment(self.get_venv_path(command_name),
+                                                 resolve_interpreter(interpreter) or interpreter, requirements,
+                                                 PACKAGE_STORE_FOLDER, wheel_dir)
+        if self.verbose:
+            print(f"{format_msg(MessageType.NOTICE)} {'Created' if created else 'Reused'} virtualenv for "
+                  f"'{command_name}' in {time.perf_counter() - start:.2f}s")
+        return python_path
+
+    def get_build_paths(self, command_name: str) -> tuple[str, str]:
+        """
+        Get the paths of a command's compiled build directory and zipapp, which are kept hidden next to it.
+
+        :param command_name: The name of the command.
+        :return: The build directory and zipapp paths.
+        """
+        return (os.path.join(self.commands_path, f".{command_name}.build"),
+                os.path.join(self.commands_path, f".{command_name}.pyz"))
+
+    def build_command(self, command_name: str, source: str, interpreter: Optional[str] = None,
+                      bundle: bool = False) -> str:
+        """
+        Precompile a command's source and local imports, optionally bundling them into a zipapp.
+
+        :param command_name: The name of the command.
+        :param source: The source of the Python file.
+        :param interpreter: Optional interpreter to compile for (defaults to 'python3').
+        :param bundle: Pack the build into a zipapp.
+        :return: The build directory or zipapp for the wrapper to run.
+        """
+        from commands.bundle import build
+
+        build_path, bundle_path = self.get_build_paths(command_name)
+        interpreter = interpreter or DEFAULT_INTERPRETER
+        built = build(source, build_path, resolve_interpreter(interpreter) or interpreter,
+                      bundle_path if bundle else None)
+        if not bundle and os.path.exists(bundle_path):
+            os.remove(bundle_path)
+        if self.verbose:
+            print(f"{format_msg(MessageType.NOTICE)} {'Rebuilt' if built else 'Up to date'}: '{command_name}'")
+        return bundle_path if bundle else build_path
+
+    def rebuild_commands(self, command_name: Optional[str] = None) -> int:
+        """
+        Rebuild compiled and bundled commands whose sources changed.
+
+        :param command_name: Optional command to rebuild. Defaults to every compiled command.
+        :return: The number of compiled commands that were checked.
+        """
+        command_names = [command_name] if command_name else self.get_command_names()
+        store = self.get_snapshot_store()
+        checked = 0
+        for name in command_names:
+            wrapper = self.parse_command(name)
+            # Snapshots are brought up to date by refresh_snapshots
+            if not wrapper or not wrapper.get("target") or store.is_snapshot(wrapper["target"]):
+                continue
+
+            try:
+                self.build_command(name, wrapper["source"], wrapper["interpreter"],
+                                   wrapper["target"].endswith(".pyz"))
+                checked += 1
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"{format_msg(MessageType.ERROR)} Failed to rebuild '{name}': {e}")
+        return checked
+
+    @staticmethod
+    def get_snapshot_store() -> SnapshotStore:
+        """
+        Get the content-addressed store that snapshotted commands run from.
+
+        :return: The snapshot store.
+        """
+        return SnapshotStore(SNAPSHOT_STORE_FOLDER)
+
+    def snapshot_command(self, command_name: str, source: str, previous: Optional[str] = None) -> str:
+        """
+        Copy a command's source and local imports into the snapshot store, so it runs from local disk.
+
+        :param command_name: The name of the command.
+        :param source: The source of the Python file.
+        :param previous: Optional snapshot the command ran from until now.
+        :return: The snapshot directory for the wrapper to run.
+        """
+        snapshot_path, changed = self.get_snapshot_store().snapshot(source, previous)
+        if self.verbose:
+            print(f"{format_msg(MessageType.NOTICE)} Snapshotted '{command_name}': "
+                  f"{', '.join(changed) if changed else 'no changes'}")
+        return snapshot_path
+
+    def rebuild_target(self, command_name: str, source: str, interpreter: str, target: str) -> str:
+        """
+        Make a fresh build or snapshot of the same kind as a command's current target.
+
+        :param command_name: The name of the command.
+        :param source: The source of the Python file.
+        :param interpreter: The interpreter to compile for.
+        :param target: The command's current build directory, zipapp or snapshot.
+        :return: The new target for the wrapper to run.
+        """
+        if self.get_snapshot_store().is_snapshot(target):
+            return self.snapshot_command(command_name, source, target)
+        return self.build_command(command_name, source, interpreter, target.endswith(".pyz"))
+
+    def refresh_snapshots(self, command_name: Optional[str] = None) -> int:
+        """
+        Re-snapshot snapshotted commands whose files changed, then remove what no command uses any more. Commands
+        whose source can't be read keep running from their current snapshot.
+
+        :param command_name: Optional command to refresh. Defaults to every snapshotted command.
+        :return: The number of snapshotted commands that were checked.
+        """
+        store = self.get_snapshot_store()
+        command_names = [command_name] if command_name else self.get_command_names()
+        checked = 0
+        with self.batch():
+            for name in command_names:
+                wrapper = self.parse_command(name)
+                if not wrapper or not store.is_snapshot(wrapper.get("target")):
+                    continue
+
+                try:
+                    target = self.snapshot_command(name, wrapper["source"], wrapper["target"])
+                    checked += 1
+                    if target == wrapper["target"]:
+                        continue
+                    mode = WrapperMode(wrapper["mode"])
+                    shebang = wrapper["shebang"] if mode in SHEBANG_MODES else None
+                    baked_command = self.bake_command(wrapper["source"], shebang, wrapper["interpreter"], mode, target,
+                                                      wrapper.get("telemetry", False), wrapper.get("description"),
+                                                      wrapper.get("cache"), wrapper.get("limits"))
+                except (OSError, ValueError) as e:
+                    print(f"{format_msg(MessageType.ERROR)} Failed to refresh '{name}': {e}")
+                    continue
+                self.create_command(name, baked_command)
+        self.collect_snapshots()
+        return checked
+
+    def collect_snapshots(self) -> tuple[int, int]:
+        """
+        Remove snapshots and blobs that no baked command references.
+
+        :return: The number of snapshots and blobs removed.
+        """
+        store = self.get_snapshot_store()
+        referenced = []
+        for name in self.get_command_names():
+            wrapper = self.parse_command(name)
+            if wrapper and store.is_snapshot(wrapper.get("target")):
+                referenced.append(wrapper["target"])
+        removed_snapshots, removed_blobs = store.collect_garbage(referenced)
+        if self.verbose and (removed_snapshots or removed_blobs):
+            print(f"{format_msg(MessageType.NOTICE)} Removed {removed_snapshots} unused snapshot(s) and "
+                  f"{removed_blobs} blob(s)")
+        return removed_snapshots, removed_blobs
 
     @staticmethod
-    def bake_command(source: str, shebang: Optional[str] = None, interpreter: Optional[str] = None) -> str:
+    def bake_command(source: str, shebang: Optional[str] = None, interpreter: Optional[str] = None,
+                     mode: WrapperMode = DEFAULT_WRAPPER_MODE, target: Optional[str] = None,
+                     telemetry: bool = False, description: Optional[str] = None,
+                     cache: Optional[dict[str, Any]] = None, limits: Optional[dict[str, Any]] = None) -> str:
         """
         Create the command string.
 
         :param source: The source of the Python file.
-        :param shebang: Optional shebang for the file (defaults to the current shell).
+        :param shebang: Optional shebang for the file (defaults to the current shell, or /bin/sh in exec mode).
         :param interpreter: Optional interpreter (defaults to 'python3').
+        :param mode: The wrapper format (see WrapperMode).
+        :param target: Optional build directory, zipapp or snapshot to run instead of the source (see build_command
+                       and snapshot_command).
+        :param telemetry: Record every run in the telemetry ring buffer (direct wrappers only).
+        :param description: Optional description of the command, for 'bake --search'.
+        :param cache: Optional output cache settings (see commands.cache.get_cache_settings, direct wrappers only).
+        :param limits: Optional concurrency and resource limits (see commands.limits.get_limit_settings, direct
+                       wrappers only).
         :return: The compiled string for the baked command.
         """
-        shebang = shebang or "#!" + get_current_shell_path()
-        interpreter = interpreter or "python3"
-        return f"{shebang}\n{interpreter} {source} $@"
+        return render_wrapper(source, shebang, interpreter, mode, target, telemetry, description, cache, limits)
@@ -0,0 +1,200 @@
+import glob
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from config import Config
+
+INTERPRETER_CACHE_VERSION = 1
+PROBE_TIMEOUT = 10
+# Executables that look like Python interpreters, e.g. 'python3', 'python3.11' or 'pypy3.10'
+INTERPRETER_NAME = re.compile(r"^(python|pypy)(\d+(\.\d+)?)?$")
+# Version specs accepted by -i, e.g. '3.11', 'pypy', 'pypy3.10' or 'cpython3.12'
+INTERPRETER_SPEC = re.compile(r"^(?P<implementation>python|cpython|pypy)?-?(?P<version>\d+(\.\d+){0,2})?$",
+                              re.IGNORECASE)
+IMPLEMENTATIONS = {"python": "CPython", "cpython": "CPython", "pypy": "PyPy"}
+# Folders searched after PATH, pyenv and asdf
+COMMON_PREFIXES = ("/usr/local/bin", "/usr/bin", "/opt/homebrew/bin", "/opt/local/bin",
+                   "/Library/Frameworks/Python.framework/Versions/*/bin", "~/.local/share/uv/python/*/bin")
+
+PROBE = "import platform, sys; print(platform.python_implementation(), *sys.version_info[:3])"
+
+
+def get_search_folders() -> list[str]:
+    """
+    Get the folders interpreters are discovered in: PATH, then pyenv and asdf installs, then common prefixes.
+    Version manager shims are skipped, since they pick an interpreter at runtime.
+
+    :return: Existing folders, in search order and without duplicates.
+    """
+    pyenv_root = os.environ.get("PYENV_ROOT") or os.path.expanduser("~/.pyenv")
+    asdf_root = os.environ.get("ASDF_DATA_DIR") or os.path.expanduser("~/.asdf")
+    patterns = os.environ.get("PATH", "").split(os.pathsep) + [
+        os.path.join(pyenv_root, "versions", "*", "bin"),
+        os.path.join(asdf_root, "installs", "python", "*", "bin"),
+        *COMMON_PREFIXES
+    ]
+
+    folders = []
+    for pattern in patterns:
+        if not pattern:
+            continue
+        for folder in sorted(glob.glob(os.path.expanduser(pattern)), reverse=True) if "*" in pattern else [pattern]:
+            folder = os.path.abspath(folder)
+            if os.path.basename(folder) != "shims" and folder not in folders and os.path.isdir(folder):
+                folders.append(folder)
+    return folders
+
+
+def parse_spec(spec: str) -> Optional[tuple[Optional[str], tuple[int, ...]]]:
+    """
+    Parse an interpreter version spec.
+
+    :param spec: The spec, e.g. '3.11', 'pypy' or 'pypy3.10'.
+    :return: The implementation (None for any) and version prefix, or None if it isn't a version spec.
+    """
+    match = INTERPRETER_SPEC.match(spec.strip())
+    if not match or not (match["implementation"] or match["version"]):
+        return None
+    implementation = IMPLEMENTATIONS[match["implementation"].lower()] if match["implementation"] else None
+    version = tuple(int(part) for part in match["version"].split(".")) if match["version"] else ()
+    return implementation, version
+
+
+def probe(path: str) -> Optional[tuple[str, list[int]]]:
+    """
+    Ask an interpreter for its implementation and version.
+
+    :param path: The interpreter.
+    :return: Its implementation and version, or None if it doesn't run.
+    """
+    try:
+        completed = subprocess.run([path, "-c", PROBE], capture_output=True, text=True, timeout=PROBE_TIMEOUT,
+                                   stdin=subprocess.DEVNULL)
+        implementation, *version = completed.stdout.split()
+        return implementation, [int(part) for part in version]
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+class InterpreterIndex:
+    def __init__(self, cache_path: str) -> None:
+        """
+        Initializes the InterpreterIndex instance, which discovers Python interpreters and caches what it found.
+        A folder is only listed again when its modification time changes, and an interpreter is only run again
+        when the file it resolves to changes.
+
+        :param cache_path: Path of the discovery cache.
+        """
+        self.cache = Config(cache_path)
+        self.interpreters: Optional[list[dict[str, Any]]] = None
+        self.stats: dict[str, Any] = {}
+
+    def discover(self) -> list[dict[str, Any]]:
+        """
+        Discover every interpreter, using the cache for folders and interpreters that haven't changed.
+
+        :return: Each interpreter's path, resolved path, implementation, version and modification time, in search
+                 order. Paths resolving to the same interpreter are listed once.
+        """
+        if self.interpreters is not None:
+            return self.interpreters
+
+        start = time.perf_counter()
+        try:
+            cache = self.cache.load_config()
+        except (OSError, ValueError):
+            cache = {}
+        if cache.get("version") != INTERPRETER_CACHE_VERSION:
+            cache = {"version": INTERPRETER_CACHE_VERSION, "folders": {}, "interpreters": {}}
+        changed = False
+
+        folders = {}
+        for folder in get_search_folders():
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            cached = cache["folders"].get(folder)
+            if not cached or cached["mtime"] != mtime:
+                try:
+                    names = sorted(name for name in os.listdir(folder) if INTERPRETER_NAME.match(name)
+                                   and os.access(os.path.join(folder, name), os.X_OK))
+                except OSError:
+                    continue
+                cached = {"mtime": mtime, "names": names}
+                changed = True
+            folders[folder] = cached
+
+        entries, pending = {}, []
+        for folder, cached in folders.items():
+            for name in cached["names"]:
+                path = os.path.join(folder, name)
+                real_path = os.path.realpath(path)
+                try:
+                    mtime = os.stat(real_path).st_mtime_ns
+                except OSError:
+                    continue
+                entry = cache["interpreters"].get(path)
+                if not entry or entry["real_path"] != real_path or entry["mtime"] != mtime:
+                    entry = {"path": path, "real_path": real_path, "mtime": mtime}
+                    pending.append(entry)
+                entries[path] = entry
+
+        # Each resolved interpreter is only run once, however many names point at it
+        real_paths = sorted({entry["real_path"] for entry in pending})
+        probes = {}
+        if real_paths:
+            with ThreadPoolExecutor() as executor:
+                probes = dict(zip(real_paths, executor.map(probe, real_paths)))
+        for entry in pending:
+            found = probes[entry["real_path"]]
+            entry["implementation"], entry["version"] = found if found else (None, None)
+
+        changed = changed or bool(pending) or set(folders) != set(cache["folders"]) \
+            or set(entries) != set(cache["interpreters"])
+        if changed:
+            cache["folders"], cache["interpreters"] = folders, entries
+            try:
+                os.makedirs(os.path.dirname(self.cache.path), exist_ok=True)
+                self.cache.write_config(cache)
+            except OSError:
+                pass
+
+        self.interpreters, seen = [], set()
+        for entry in entries.values():
+            if entry["version"] and entry["real_path"] not in seen:
+                seen.add(entry["real_path"])
+                self.interpreters.append(entry)
+        self.stats = {"time": time.perf_counter() - start, "folders": len(folders), "probed": len(probes),
+                      "cached": len(entries) - len(pending)}
+        return self.interpreters
+
+    def find(self, spec: str) -> Optional[str]:
+        """
+        Find the interpreter a spec means. Paths are used as they are and names are looked up on PATH, while
+        version specs pick the newest matching discovered interpreter, the first found winning ties.
+
+        :param spec: A path, an executable name like 'python3', or a version spec like '3.11' or 'pypy'.
+        :return: The interpreter's absolute path, or None if nothing matches.
+        """
+        if os.sep in spec:
+            path = os.path.abspath(os.path.expanduser(spec))
+            return path if os.access(path, os.X_OK) else None
+        found = shutil.which(spec)
+        if found:
+            return os.path.abspath(found)
+
+        parsed = parse_spec(spec)
+        if not parsed:
+            return None
+        implementation, version = parsed
+        matches = [entry for entry in self.discover()
+                   if (not implementation or entry["implementation"] == implementation)
+                   and tuple(entry["version"][:len(version)]) == version]
+        best = max(matches, key=lambda entry: entry["version"], default=None)
+        return best["path"] if best else None
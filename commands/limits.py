@@ -0,0 +1,169 @@
+import json
+import os
+import time
+from typing import Any
+
+ON_LIMIT_CHOICES = ("queue", "fail")
+LIMIT_KEYS = ("instances", "on_limit", "memory", "cpu", "files", "nice", "ionice")
+
+# Inserted into limited wrappers after the LIMITS and RUN constants, before the script starts. It applies the
+# priority and resource limits, which the script and anything it starts inherit, then takes one of the command's
+# instance slots: RUN/<name>.<slot>.lock files held with flock for as long as the process lives, so a crashed run
+# never keeps its slot. A run that finds every slot taken either exits with 75 (EX_TEMPFAIL) or queues, announcing
+# itself in RUN/<name>.<pid>.wait until a slot frees up. Slots record when their run queued and started, for
+# 'bake --running'. Anything going wrong with the bookkeeping lets the command run unlimited rather than not at all.
+LIMITER = """def _bake_limit():
+    import os, sys, time
+    name = os.path.basename(sys.argv[0])
+    if LIMITS.get("nice"):
+        try:
+            os.nice(LIMITS["nice"])
+        except OSError:
+            pass
+    if LIMITS.get("ionice") is not None:
+        try:
+            import subprocess
+            subprocess.run(["ionice", "-c", "2", "-n", str(LIMITS["ionice"]), "-p", str(os.getpid())],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            pass  # No ionice, as on macOS
+    import resource
+    for key, limit, scale in (("memory", resource.RLIMIT_AS, 1048576), ("cpu", resource.RLIMIT_CPU, 1),
+                              ("files", resource.RLIMIT_NOFILE, 1)):
+        if LIMITS.get(key):
+            try:
+                soft, hard = resource.getrlimit(limit)
+                value = LIMITS[key] * scale
+                resource.setrlimit(limit, (value if hard == resource.RLIM_INFINITY else min(value, hard), hard))
+            except (OSError, ValueError):
+                pass
+    if not LIMITS.get("instances"):
+        return None
+
+    import fcntl, json
+    queued, delay, wait_path = time.time(), 0.01, None
+    try:
+        os.makedirs(RUN, exist_ok=True)
+        paths = [os.path.join(RUN, "%s.%d.lock" % (name, slot)) for slot in range(LIMITS["instances"])]
+        while True:
+            for path in paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    continue
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps({"pid": os.getpid(), "queued": queued, "started": time.time(),
+                                         "argv": sys.argv[1:]}).encode())
+                return fd
+            if LIMITS.get("on_limit") == "fail":
+                sys.stderr.write("%s: already running %d time(s), the most allowed\\n" % (name, len(paths)))
+                sys.exit(75)
+            if wait_path is None:
+                wait_path = os.path.join(RUN, "%s.%d.wait" % (name, os.getpid()))
+                with open(wait_path, "w") as file:
+                    file.write(json.dumps({"pid": os.getpid(), "queued": queued, "argv": sys.argv[1:]}))
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+    except OSError:
+        return None
+    finally:
+        if wait_path:
+            try:
+                os.remove(wait_path)
+            except OSError:
+                pass
+
+_bake_slot = _bake_limit()
+"""
+
+
+def get_limit_settings(settings: Any) -> dict[str, Any]:
+    """
+    Normalise per-command limits, from the limit flags or a manifest's 'limits' table.
+
+    :param settings: A mapping of any of: 'instances' (most concurrent runs), 'on_limit' ('queue' or 'fail'),
+                     'memory' (address space in MB), 'cpu' (CPU seconds), 'files' (open files), 'nice' (-20 to 19)
+                     and 'ionice' (best-effort I/O priority, 0 to 7). Unset (None) values are dropped.
+    :return: The settings as wrappers store them, or an empty dict if nothing is limited.
+    :raises ValueError: If the settings aren't valid.
+    """
+    if not isinstance(settings, dict) or set(settings) - set(LIMIT_KEYS):
+        raise ValueError(f"Limits must be a table of {', '.join(LIMIT_KEYS)}")
+    limits = {key: settings[key] for key in LIMIT_KEYS if settings.get(key) is not None}
+
+    for key in ("instances", "memory", "cpu", "files"):
+        if key in limits and (not isinstance(limits[key], int) or isinstance(limits[key], bool) or limits[key] <= 0):
+            raise ValueError(f"Limit '{key}' must be a positive whole number")
+    for key, low, high in (("nice", -20, 19), ("ionice", 0, 7)):
+        if key in limits and (not isinstance(limits[key], int) or isinstance(limits[key], bool)
+                              or not low <= limits[key] <= high):
+            raise ValueError(f"Limit '{key}' must be a whole number from {low} to {high}")
+    if "on_limit" in limits:
+        if limits["on_limit"] not in ON_LIMIT_CHOICES:
+            raise ValueError(f"Limit 'on_limit' must be one of {', '.join(ON_LIMIT_CHOICES)}")
+        if "instances" not in limits:
+            raise ValueError("Limit 'on_limit' needs 'instances'")
+    elif "instances" in limits:
+        limits["on_limit"] = "queue"
+    return {key: limits[key] for key in LIMIT_KEYS if key in limits}
+
+
+def is_alive(pid: int) -> bool:
+    """
+    Check whether a process is still running.
+
+    :param pid: The process id.
+    :return: True if it is.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Running as another user
+    return True
+
+
+def read_running(run_path: str) -> list[dict[str, Any]]:
+    """
+    Find the runs of limited commands that hold an instance slot or are queued for one. A slot counts as held
+    while the run recorded in it is alive; its lock is never probed, since a run starting at that moment would
+    find the slot taken. Wait files left by runs that were killed while queued are removed.
+
+    :param run_path: The directory of slot and wait files.
+    :return: Each run's command, pid, state ('running' or 'queued'), arguments, when it queued, when it started
+             (None while queued) and how many seconds it waited, oldest first.
+    """
+    try:
+        entries = list(os.scandir(run_path))
+    except OSError:
+        return []
+
+    now = time.time()
+    runs = []
+    for entry in entries:
+        parts = entry.name.rsplit(".", 2)
+        if len(parts) != 3 or parts[2] not in ("lock", "wait"):
+            continue
+        command_name, suffix = parts[0], parts[2]
+        try:
+            with open(entry.path, "r") as file:
+                info = json.loads(file.read())
+        except (OSError, ValueError):
+            continue  # A slot that was never used, or is being written
+        if not is_alive(info["pid"]):
+            if suffix == "lock":
+                continue  # Its run has finished
+            try:  # Left by a run killed while queued
+                os.remove(entry.path)
+            except OSError:
+                pass
+            continue
+
+        started = info.get("started") if suffix == "lock" else None
+        runs.append({"command": command_name, "pid": info["pid"], "state": "running" if started else "queued",
+                     "argv": info.get("argv", []), "queued": info["queued"], "started": started,
+                     "waited": (started or now) - info["queued"]})
+    return sorted(runs, key=lambda run: run["queued"])
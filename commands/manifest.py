@@ -0,0 +1,145 @@
+import json
+import os
+from typing import Any
+
+from commands.cache import get_cache_settings
+from commands.limits import get_limit_settings
+from commands.wrapper import WrapperMode
+
+MANIFEST_KEYS = ("name", "source", "interpreter", "shebang", "wrapper", "compile", "bundle", "snapshot",
+                 "telemetry", "cache", "limits", "description")
+
+
+def load_manifest(path: str) -> list[dict[str, Any]]:
+    """
+    Load a JSON or TOML manifest of commands. Both formats hold a list of tables under 'commands', e.g.
+
+        [[commands]]
+        name = "greet"
+        source = "scripts/greet.py"
+
+    :param path: Path of the manifest. Files ending in '.toml' are read as TOML, anything else as JSON.
+    :return: The manifest entries with sources resolved relative to the manifest.
+    """
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as file:
+            data = tomllib.load(file)
+    else:
+        with open(path, "r") as file:
+            data = json.loads(file.read())
+
+    entries = data.get("commands") if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError("Manifest must contain a list of tables under 'commands'")
+
+    root = os.path.dirname(os.path.abspath(path))
+    entries = [dict(entry, source=os.path.join(root, os.path.expanduser(entry["source"])))
+               if isinstance(entry.get("source"), str) else dict(entry) for entry in entries]
+    for entry in entries:
+        cache = entry.get("cache")
+        if isinstance(cache, dict) and isinstance(cache.get("inputs"), list):
+            entry["cache"] = dict(cache, inputs=[os.path.join(root, os.path.expanduser(input_path))
+                                                 if isinstance(input_path, str) else input_path
+                                                 for input_path in cache["inputs"]])
+    return entries
+
+
+def scan_directory(path: str) -> list[dict[str, Any]]:
+    """
+    Create manifest entries for every Python script in a directory, named after the script.
+
+    :param path: The directory to scan (not recursive).
+    :return: The manifest entries.
+    """
+    entries = []
+    for entry in sorted(os.scandir(path), key=lambda item: item.name):
+        if entry.is_file() and entry.name.endswith(".py") and not entry.name.startswith((".", "_")):
+            entries.append({"name": entry.name[:-3], "source": os.path.abspath(entry.path)})
+    return entries
+
+
+def validate_manifest(entries: list[dict[str, Any]]) -> list[str]:
+    """
+    Check every manifest entry before anything is written, normalising command names in place.
+
+    :param entries: The manifest entries.
+    :return: A list of problems; empty if the manifest is valid.
+    """
+    problems = []
+    seen = set()
+    for index, entry in enumerate(entries):
+        unknown = set(entry) - set(MANIFEST_KEYS)
+        if unknown:
+            problems.append(f"Entry {index + 1}: unknown key(s) {', '.join(sorted(unknown))}")
+
+        name = entry.get("name")
+        if not isinstance(name, str) or not name.strip():
+            problems.append(f"Entry {index + 1}: missing command name")
+            continue
+        name = entry["name"] = name.strip().lower()
+
+        if name == "bake":
+            problems.append(f"'{name}': command name cannot be 'bake'")
+        elif name.startswith(".") or os.sep in name:
+            problems.append(f"'{name}': invalid command name")
+        if name in seen:
+            problems.append(f"'{name}': listed more than once")
+        seen.add(name)
+
+        source = entry.get("source")
+        if not isinstance(source, str) or not os.path.isfile(source):
+            problems.append(f"'{name}': source '{source}' does not exist")
+
+        wrapper = entry.get("wrapper")
+        if wrapper is not None and wrapper not in [mode.value for mode in WrapperMode]:
+            problems.append(f"'{name}': unknown wrapper '{wrapper}'")
+        if entry.get("snapshot") and (entry.get("compile") or entry.get("bundle")):
+            problems.append(f"'{name}': snapshot can't be combined with compile or bundle")
+        if entry.get("cache"):
+            try:
+                get_cache_settings(entry["cache"])
+            except ValueError as error:
+                problems.append(f"'{name}': {error}")
+        if entry.get("limits"):
+            try:
+                get_limit_settings(entry["limits"])
+            except ValueError as error:
+                problems.append(f"'{name}': {error}")
+    return problems
+
+
+def to_toml(value: Any) -> str:
+    """
+    Format a manifest value as TOML.
+
+    :param value: A string, number, boolean, list of those, or a table of them.
+    :return: The TOML value, with tables written inline.
+    """
+    if isinstance(value, dict):
+        return "{ " + ", ".join(f"{key} = {to_toml(item)}" for key, item in value.items()) + " }"
+    # JSON string, number, boolean and array literals are valid TOML
+    return json.dumps(value)
+
+
+def write_manifest(path: str, entries: list[dict[str, Any]]) -> None:
+    """
+    Write manifest entries as JSON, or as TOML if the path ends in '.toml'.
+
+    :param path: Path of the manifest.
+    :param entries: The manifest entries.
+    """
+    if path.endswith(".toml"):
+        tables = []
+        for entry in entries:
+            fields = [f"{key} = {to_toml(entry[key])}" for key in MANIFEST_KEYS if entry.get(key) is not None]
+            tables.append("[[commands]]\n" + "\n".join(fields) + "\n")
+        contents = "\n".join(tables)
+    else:
+        contents = json.dumps({"commands": entries}, indent=4) + "\n"
+
+    with open(path, "w") as file:
+        file.write(contents)
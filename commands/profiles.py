@@ -0,0 +1,195 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Optional
+
+IMPORT_TIME_PREFIX = "import time:"
+TOP_ENTRIES = 15
+# A metric regresses when it grows by more than this fraction and by more than the absolute floor
+REGRESSION_FRACTION = 0.10
+REGRESSION_FLOOR = 0.001
+
+
+def parse_importtime(lines: list[str]) -> list[dict[str, Any]]:
+    """
+    Parse the output of '-X importtime'.
+
+    :param lines: Lines starting with 'import time:'.
+    :return: Imported modules with self and cumulative seconds, slowest cumulative first.
+    """
+    imports = []
+    for line in lines:
+        fields = line[len(IMPORT_TIME_PREFIX):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header line
+        imports.append({"module": fields[2].strip(), "self": int(fields[0]) / 1e6, "cumulative": int(fields[1]) / 1e6})
+    return sorted(imports, key=lambda entry: -entry["cumulative"])
+
+
+def label(function: tuple[str, int, str]) -> str:
+    """
+    Format a pstats function key for reports and stacks.
+
+    :param function: (file, line, function name) as used by pstats.
+    :return: 'file.py:line(name)', or just the name for built-ins.
+    """
+    filename, line, name = function
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def analyse_profile(profile_path: str) -> tuple[list[dict[str, Any]], list[str]]:
+    """
+    Read a cProfile dump into its hottest functions and collapsed stacks for flamegraph tools.
+
+    cProfile only records caller/callee pairs, so each stack's time is estimated by splitting a function's time
+    between its callers in proportion to the time each caller spent in it. Time no caller accounts for (such as
+    the script's top-level exec) starts a stack of its own.
+
+    :param profile_path: File written by 'python -m cProfile -o'.
+    :return: The hottest functions by cumulative time, and 'frame;frame;frame microseconds' lines.
+    """
+    import pstats
+
+    stats = pstats.Stats(profile_path).stats
+    functions = [{"function": label(function), "calls": calls, "total": total, "cumulative": cumulative}
+                 for function, (_, calls, total, cumulative, _) in stats.items()]
+    functions.sort(key=lambda entry: -entry["cumulative"])
+
+    callees: dict[tuple, list[tuple[tuple, float]]] = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, edge_cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, edge_cumulative))
+
+    totals: dict[str, float] = {}
+
+    def visit(function: tuple, stack: list[str], fraction: float) -> None:
+        if fraction < 1e-4 or len(stack) > 64:
+            return
+        _, _, total, cumulative, _ = stats[function]
+        key = ";".join(stack)
+        totals[key] = totals.get(key, 0) + total * fraction
+        for callee, edge_cumulative in callees.get(function, []):
+            callee_cumulative = stats[callee][3]
+            if callee_cumulative and label(callee) not in stack:
+                visit(callee, stack + [label(callee)], fraction * edge_cumulative / callee_cumulative)
+
+    for function, (_, _, _, cumulative, callers) in stats.items():
+        called = sum(edge_cumulative for _, _, _, edge_cumulative in callers.values())
+        if not callers or (cumulative and called < cumulative):
+            visit(function, [label(function)], 1.0 if not callers else (cumulative - called) / cumulative)
+
+    stacks = [f"{key} {round(seconds * 1e6)}" for key, seconds in totals.items() if round(seconds * 1e6) > 0]
+    return functions, stacks
+
+
+def get_report_paths(profiles_folder: str, command_name: str) -> list[str]:
+    """
+    Get a command's stored reports.
+
+    :param profiles_folder: The folder reports are stored in.
+    :param command_name: The name of the command.
+    :return: Report directories, oldest first.
+    """
+    folder = os.path.join(profiles_folder, command_name)
+    try:
+        names = sorted(name for name in os.listdir(folder) if os.path.isfile(os.path.join(folder, name, "report.json")))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(folder, name) for name in names]
+
+
+def load_report(report_path: str) -> dict[str, Any]:
+    """
+    Load a stored report.
+
+    :param report_path: The report directory.
+    :return: The report.
+    """
+    with open(os.path.join(report_path, "report.json"), "r") as file:
+        return json.loads(file.read())
+
+
+def profile_command(command_name: str, interpreter: str, source: str, args: list[str],
+                    profiles_folder: str) -> tuple[str, dict[str, Any]]:
+    """
+    Run a command's source under '-X importtime' and cProfile and store a timestamped report.
+
+    :param command_name: The name of the command.
+    :param interpreter: The command's interpreter.
+    :param source: The command's source.
+    :param args: Arguments to pass to the command.
+    :param profiles_folder: The folder reports are stored in.
+    :return: The report directory and the report.
+    """
+    report_path = os.path.join(profiles_folder, command_name, time.strftime("%Y%m%d-%H%M%S"))
+    suffix = 1
+    while os.path.exists(report_path + (f"-{suffix}" if suffix > 1 else "")):
+        suffix += 1
+    report_path += f"-{suffix}" if suffix > 1 else ""
+    os.makedirs(report_path)
+    profile_path = os.path.join(report_path, "profile.prof")
+
+    start = time.perf_counter()
+    completed = subprocess.run([interpreter, "-X", "importtime", "-m", "cProfile", "-o", profile_path, source,
+                                *args], stderr=subprocess.PIPE, text=True)
+    wall_time = time.perf_counter() - start
+
+    # Hand the command's own stderr back and keep the import timings
+    import_lines = []
+    for line in completed.stderr.splitlines(True):
+        if line.startswith(IMPORT_TIME_PREFIX):
+            import_lines.append(line)
+        else:
+            sys.stderr.write(line)
+    with open(os.path.join(report_path, "importtime.txt"), "w") as file:
+        file.writelines(import_lines)
+
+    functions, stacks = [], []
+    if os.path.exists(profile_path):
+        functions, stacks = analyse_profile(profile_path)
+    with open(os.path.join(report_path, "stacks.collapsed"), "w") as file:
+        file.write("\n".join(stacks) + "\n")
+
+    imports = parse_importtime(import_lines)
+    report = {
+        "command": command_name,
+        "args": args,
+        "timestamp": time.time(),
+        "exit_code": completed.returncode,
+        "wall_time": wall_time,
+        "import_time": sum(entry["self"] for entry in imports),
+        "top_imports": imports[:TOP_ENTRIES],
+        "top_functions": functions[:TOP_ENTRIES]
+    }
+    with open(os.path.join(report_path, "report.json"), "w") as file:
+        file.write(json.dumps(report, indent=4))
+    return report_path, report
+
+
+def compare_reports(baseline: dict[str, Any], latest: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Compare two reports' wall time, import time, imports and functions.
+
+    :param baseline: The earlier report.
+    :param latest: The later report.
+    :return: One row per metric present in either report, with both values and whether it regressed.
+    """
+    def metrics(report: dict[str, Any]) -> dict[str, float]:
+        values = {"wall time": report["wall_time"], "import time": report["import_time"]}
+        values.update({f"import {entry['module']}": entry["cumulative"] for entry in report["top_imports"]})
+        values.update({f"function {entry['function']}": entry["cumulative"] for entry in report["top_functions"]})
+        return values
+
+    before, after = metrics(baseline), metrics(latest)
+    rows = []
+    for name in list(before) + [name for name in after if name not in before]:
+        old: Optional[float] = before.get(name)
+        new: Optional[float] = after.get(name)
+        regressed = (old is not None and new is not None and new - old > REGRESSION_FLOOR
+                     and new > old * (1 + REGRESSION_FRACTION))
+        rows.append({"metric": name, "before": old, "after": new, "regressed": regressed})
+    return rows
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from commands.search import SearchIndex
+from config import Config
+from utils.filesystem import atomic_write
+
+REGISTRY_VERSION = 1
+
+
+def read_file(path: str) -> str:
+    """
+    Read a wrapper file.
+
+    :param path: The file.
+    :return: Its contents.
+    """
+    with open(path, "r") as file:
+        return file.read()
+
+
+class Registry:
+    def __init__(self, path: str, commands_path: str) -> None:
+        """
+        Initializes the Registry instance, an index of every command in a commands directory.
+
+        :param path: Path of the registry file.
+        :param commands_path: Directory path where commands are stored.
+        """
+        self.config = Config(path)
+        self.commands_path = commands_path
+        # Plain list of command names for shell completion scripts, which can't afford to start Python
+        self.names_path = os.path.splitext(path)[0] + ".names"
+        self.search_index = SearchIndex(os.path.splitext(path)[0] + ".search.json")
+        self.commands: Optional[dict[str, dict[str, Any]]] = None
+        # Changes since the index was loaded, merged into the file on save so concurrent bake processes
+        # don't drop each other's commands. None marks a removal.
+        self.changes: dict[str, Optional[dict[str, Any]]] = {}
+        self.replaced = False
+        self.batch_depth = 0
+        self.dirty = False
+
+    def load(self) -> bool:
+        """
+        Load the index from disk.
+
+        :return: True if a valid index for this commands directory was loaded, otherwise False.
+        """
+        try:
+            data = self.config.load_config()
+        except (OSError, ValueError):
+            return False
+
+        if not self.is_current(data):
+            return False
+        self.commands = data.get("commands", {})
+        return True
+
+    def is_current(self, data: dict[str, Any]) -> bool:
+        """
+        Check whether index data is in the current format and belongs to this commands directory.
+
+        :param data: The index data.
+        :return: True if the data can be used.
+        """
+        return data.get("version") == REGISTRY_VERSION and data.get("commands_path") == self.commands_path
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Defer writing the index until the enclosed block finishes, so a batch of changes costs one write.
+        """
+        self.batch_depth += 1
+        try:
+            yield
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth and self.dirty:
+                self.save()
+
+    def save(self) -> None:
+        """
+        Write the index to disk, or mark it dirty while a batch is open. Changes are merged into the index on disk
+        under its lock, unless the whole index was rebuilt.
+        """
+        if self.batch_depth:
+            self.dirty = True
+            return
+
+        self.dirty = False
+        os.makedirs(os.path.dirname(self.config.path), exist_ok=True)
+        with self.config.transaction() as data:
+            merged = self.is_current(data) and not self.replaced
+            if merged:
+                commands = data.get("commands", {})
+                for command_name, entry in self.changes.items():
+                    if entry is None:
+                        commands.pop(command_name, None)
+                    else:
+                        commands[command_name] = entry
+            else:
+                commands = self.commands or {}
+            data.clear()
+            data.update({"version": REGISTRY_VERSION, "commands_path": self.commands_path, "commands": commands})
+
+        self.commands = commands
+        self.search_index.update(commands, self.changes if merged else None)
+        self.changes = {}
+        self.replaced = False
+        self.save_names()
+
+    def save_names(self) -> None:
+        """
+        Write the names of every indexed command to the names file, one per line.
+        """
+        atomic_write(self.names_path, "".join(f"{name}\n" for name in sorted(self.commands or {})))
+
+    def ensure_loaded(self, parse: Callable[[str], Optional[dict[str, Any]]],
+                      read: Callable[[str], str] = read_file) -> None:
+        """
+        Load the index, rebuilding it from disk if it is missing or belongs to another commands directory.
+
+        :param parse: Function that parses a wrapper file's contents (see parse_wrapper).
+        :param read: Function that reads a wrapper's contents from its path.
+        """
+        if self.commands is None and not self.load():
+            self.reindex(parse, read)
+
+    def reindex(self, parse: Callable[[str], Optional[dict[str, Any]]],
+                read: Callable[[str], str] = read_file) -> int:
+        """
+        Rebuild the index by reading every wrapper in the commands directory.
+
+        :param parse: Function that parses a wrapper file's contents (see parse_wrapper).
+        :param read: Function that reads a wrapper's contents from its path.
+        :return: The number of indexed commands.
+        """
+        previous = self.commands or {}
+        self.commands = {}
+        try:
+            entries = list(os.scandir(self.commands_path))
+        except OSError:
+            entries = []
+
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                contents = read(entry.path)
+            except (OSError, UnicodeDecodeError):
+                contents = ""
+            created = previous.get(entry.name, {}).get("created")
+            self.commands[entry.name] = self.make_entry(contents, parse(contents), entry.stat().st_mtime, created)
+
+        self.replaced = True
+        self.save()
+        return len(self.commands)
+
+    @staticmethod
+    def make_entry(contents: str, wrapper: Optional[dict[str, Any]], modified: float,
+                   created: Optional[float] = None) -> dict[str, Any]:
+        """
+        Build an index entry for a wrapper.
+
+        :param contents: The wrapper file contents.
+        :param wrapper: The parsed wrapper, or None if the file isn't a baked wrapper.
+        :param modified: Modification time of the wrapper file.
+        :param created: Time the command was first indexed. Defaults to the modification time.
+        :return: The index entry.
+        """
+        return {
+            "wrapper": wrapper,
+            "hash": hashlib.sha256(contents.encode()).hexdigest(),
+            "created": created or modified,
+            "modified": modified
+        }
+
+    def get(self, command_name: str) -> Optional[dict[str, Any]]:
+        """
+        Get a command's index entry.
+
+        :param command_name: The name of the command.
+        :return: The entry, or None if the command isn't indexed.
+        """
+        return (self.commands or {}).get(command_name)
+
+    def names(self) -> list[str]:
+        """
+        Get the names of every indexed command.
+
+        :return: Command names in index order.
+        """
+        return list(self.commands or {})
+
+    def update(self, command_name: str, contents: str, wrapper: Optional[dict[str, Any]]) -> None:
+        """
+        Record a created or rewritten command and write the index.
+
+        :param command_name: The name of the command.
+        :param contents: The wrapper file contents.
+        :param wrapper: The parsed wrapper, or None if the file isn't a baked wrapper.
+        """
+        if self.commands is None:
+            self.commands = {}
+        existing = self.commands.get(command_name, {})
+        self.commands[command_name] = self.changes[command_name] = \
+            self.make_entry(contents, wrapper, time.time(), existing.get("created"))
+        self.save()
+
+    def remove(self, command_name: str) -> None:
+        """
+        Remove a deleted command and write the index.
+
+        :param command_name: The name of the command.
+        """
+        if self.commands and self.commands.pop(command_name, None) is not None:
+            self.changes[command_name] = None
+            self.save()
@@ -0,0 +1,135 @@
+import os
+import subprocess
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, BinaryIO, Iterable, Optional
+
+from commands.telemetry import percentile
+
+# Replaced by each input in the command's arguments. Without it, the input is appended as the last argument
+INPUT_PLACEHOLDER = "{}"
+
+
+def read_inputs(path: str, stdin: BinaryIO) -> Iterable[str]:
+    """
+    Read inputs one per line, lazily so inputs can still be arriving on stdin while the first ones run.
+
+    :param path: The file of inputs, or '-' for stdin.
+    :param stdin: The stream '-' reads from.
+    :return: Non-empty lines without their line endings.
+    """
+    file = stdin if path == "-" else open(path, "rb")
+    try:
+        for line in file:
+            line = line.rstrip(b"\r\n").decode(errors="surrogateescape")
+            if line:
+                yield line
+    finally:
+        if file is not stdin:
+            file.close()
+
+
+def run_one(command: list[str]) -> dict[str, Any]:
+    """
+    Run a command to completion, capturing its output.
+
+    :param command: The command line.
+    :return: Its exit code, output, error output and run time.
+    """
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True)
+        returncode, stdout, stderr = completed.returncode, completed.stdout, completed.stderr
+    except OSError as error:
+        returncode, stdout, stderr = 127, b"", f"{error}\n".encode()
+    return {"returncode": returncode, "stdout": stdout, "stderr": stderr, "time": time.perf_counter() - start}
+
+
+def run_each(interpreter: str, run_path: str, args: list[str], inputs: Iterable[str], jobs: Optional[int] = None,
+             keep_going: bool = False, stdout: Optional[BinaryIO] = None,
+             stderr: Optional[BinaryIO] = None) -> dict[str, Any]:
+    """
+    Run a script once per input on a bounded pool of processes. Each run's output is written in input order once
+    the runs before it have finished, so output never interleaves. Unless keep_going is set, no new runs start
+    after the first failure and queued runs are cancelled.
+
+    :param interpreter: The interpreter to run the script with.
+    :param run_path: The script, build directory or zipapp to run.
+    :param args: Arguments for every run. INPUT_PLACEHOLDER is replaced by the input, otherwise it is appended.
+    :param inputs: The inputs.
+    :param jobs: Number of runs at once. Defaults to the number of CPUs.
+    :param keep_going: Run every input even after failures.
+    :param stdout: Where the runs' output goes.
+    :param stderr: Where the runs' error output goes.
+    :return: Counts of runs, failures and queued inputs skipped after a failure, whether inputs were left unread
+             after a failure, the failed inputs, wall time, throughput and latency percentiles.
+    """
+    jobs = max(1, jobs or os.cpu_count() or 1)
+
+    def get_command(value: str) -> list[str]:
+        if any(INPUT_PLACEHOLDER in arg for arg in args):
+            return [interpreter, run_path, *(arg.replace(INPUT_PLACEHOLDER, value) for arg in args)]
+        return [interpreter, run_path, *args, value]
+
+    start = time.perf_counter()
+    latencies, failed = [], []
+    pending: dict[int, tuple[str, Future]] = {}
+    next_index = next_output = skipped = 0
+    stopped = exhausted = False
+    inputs = iter(inputs)
+
+    def flush(block: bool) -> None:
+        # Write finished runs in input order, stopping at the first one still running
+        nonlocal next_output, skipped, stopped
+        while next_output in pending:
+            value, future = pending[next_output]
+            if not block and not future.done():
+                return
+            del pending[next_output]
+            next_output += 1
+            if future.cancelled():
+                skipped += 1
+                continue
+            result = future.result()
+            if stdout:
+                stdout.write(result["stdout"])
+                stdout.flush()
+            if stderr:
+                stderr.write(result["stderr"])
+                stderr.flush()
+            latencies.append(result["time"])
+            if result["returncode"]:
+                failed.append({"input": value, "returncode": result["returncode"]})
+                if not keep_going:
+                    # Runs that haven't started yet never will
+                    stopped = True
+                    for _, queued in pending.values():
+                        queued.cancel()
+
+    with ThreadPoolExecutor(jobs) as executor:
+        while not stopped:
+            # Keep every worker busy without holding the output of more than a few runs per worker
+            while not stopped and len(pending) < jobs * 4:
+                # Reading the next input can block on a slow producer, so finished output is written first
+                flush(block=False)
+                if stopped:
+                    break
+                value = next(inputs, None)
+                if value is None:
+                    stopped = exhausted = True
+                    break
+                pending[next_index] = (value, executor.submit(run_one, get_command(value)))
+                next_index += 1
+            if pending and not stopped:
+                # The window only moves once the oldest run's output is written
+                wait([pending[next_output][1]])
+            flush(block=False)
+        flush(block=True)
+
+    # The rest of the inputs are never read, since stdin may never end
+    unread = bool(failed) and not keep_going and not exhausted
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"runs": len(latencies), "failed": failed, "skipped": skipped, "unread": unread, "time": elapsed,
+            "throughput": len(latencies) / elapsed if elapsed else 0.0, "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95), "max": latencies[-1] if latencies else 0.0}
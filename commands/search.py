@@ -0,0 +1,183 @@
+import heapq
+import re
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Any, Iterator, Optional
+
+from config import Config
+
+SEARCH_INDEX_VERSION = 1
+GRAM_SIZE = 3
+# Scores of each kind of match, best first
+MATCH_SCORES = {"exact": 1.0, "prefix": 0.9, "substring": 0.8, "description": 0.6, "source": 0.5, "fuzzy": 0.3}
+
+
+def get_grams(text: str) -> set[str]:
+    """
+    Split text into lowercase trigrams.
+
+    :param text: The text.
+    :return: Its trigrams, or the whole text if it is shorter than a trigram.
+    """
+    text = text.lower()
+    if len(text) < GRAM_SIZE:
+        return {text} if text else set()
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def make_document(command_name: str, entry: dict[str, Any]) -> list[str]:
+    """
+    Build the searchable fields of a registry entry.
+
+    :param command_name: The name of the command.
+    :param entry: The command's registry entry.
+    :return: The command's name, source and description.
+    """
+    wrapper = entry.get("wrapper") or {}
+    return [command_name, wrapper.get("source", ""), wrapper.get("description", "")]
+
+
+class SearchIndex:
+    def __init__(self, path: str) -> None:
+        """
+        Initializes the SearchIndex instance, an index of every command's name, source and description. Documents
+        are numbered, and each trigram of a name or description maps to the space-separated numbers of the
+        documents containing it, so loading the index doesn't parse every posting list.
+
+        :param path: Path of the index file.
+        """
+        self.config = Config(path)
+        self.document_ids: list[int] = []
+        self.fields: Optional[list[list]] = None
+
+    def load(self) -> bool:
+        """
+        Load the index from disk.
+
+        :return: True if a valid index was loaded, otherwise False.
+        """
+        try:
+            data = self.config.load_config()
+        except (OSError, ValueError):
+            return False
+        self.fields = None
+        return data.get("version") == SEARCH_INDEX_VERSION
+
+    def update(self, commands: dict[str, dict[str, Any]],
+               changes: Optional[dict[str, Optional[dict[str, Any]]]] = None) -> None:
+        """
+        Apply changed registry entries to the index, or rebuild it from every entry.
+
+        :param commands: Every registry entry, used when the index has to be rebuilt.
+        :param changes: Changed entries, None marking a removal. Rebuilds the index when None.
+        """
+        with self.config.transaction() as data:
+            # Rebuild instead of applying changes when removals have left the index mostly empty
+            if (changes is None or data.get("version") != SEARCH_INDEX_VERSION
+                    or data["documents"].count(None) > len(data["ids"])):
+                data.clear()
+                data.update({"version": SEARCH_INDEX_VERSION, "ids": {}, "documents": [], "grams": {}})
+                changes = commands
+
+            ids, documents, grams = data["ids"], data["documents"], data["grams"]
+            for command_name, entry in changes.items():
+                if command_name in ids:
+                    document_id = ids.pop(command_name)
+                    name, _, description = documents[document_id]
+                    for gram in get_grams(name) | get_grams(description):
+                        postings = [posting for posting in grams.get(gram, "").split()
+                                    if posting != str(document_id)]
+                        if postings:
+                            grams[gram] = " ".join(postings)
+                        else:
+                            grams.pop(gram, None)
+                    documents[document_id] = None
+
+                if entry is not None:
+                    document = make_document(command_name, entry)
+                    document_id = ids[command_name] = len(documents)
+                    documents.append(document)
+                    for gram in get_grams(command_name) | get_grams(document[2]):
+                        grams[gram] = f"{grams[gram]} {document_id}" if gram in grams else str(document_id)
+        self.fields = None
+
+    def get_fields(self) -> tuple[list[int], list[list[str]]]:
+        """
+        Get the searchable fields of every indexed command, lowercased and joined into one string per field so
+        substring and abbreviation matching runs over a single string rather than a Python loop.
+
+        :return: The document number of each line, and for each field its joined text and line offsets.
+        """
+        if self.fields is None:
+            documents = self.config.get_config().get("documents", [])
+            self.document_ids = [document_id for document_id, document in enumerate(documents) if document]
+            self.fields = []
+            for field in range(3):
+                values = [documents[document_id][field].lower() for document_id in self.document_ids]
+                self.fields.append(["\n".join(values), list(accumulate([0] + [len(value) + 1 for value in values]))])
+        return self.document_ids, self.fields
+
+    def search(self, query: str, limit: Optional[int] = None) -> list[dict[str, Any]]:
+        """
+        Rank commands by how well they match a query: exact and prefix matches on the name first, then substring
+        matches on the name, description and source, then fuzzy matches on the name.
+
+        :param query: The query.
+        :param limit: Optional maximum number of results.
+        :return: Matching commands with their source, description, kind of match and score, best first.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        data = self.config.get_config()
+        documents = data.get("documents", [])
+        document_ids, fields = self.get_fields()
+
+        def find(pattern: str, field: int) -> Iterator[int]:
+            text, offsets = fields[field]
+            for found in re.finditer(pattern, text, re.MULTILINE):
+                yield document_ids[bisect_right(offsets, found.start()) - 1]
+
+        matches: dict[int, tuple[str, float]] = {}
+
+        def add(document_id: int, match: str, score: float) -> None:
+            if document_id not in matches or matches[document_id][1] < score:
+                matches[document_id] = (match, score)
+
+        escaped = re.escape(query)
+        for document_id in find(f"^{escaped}$", 0):
+            add(document_id, "exact", MATCH_SCORES["exact"])
+        for document_id in find(f"^{escaped}", 0):
+            add(document_id, "prefix", MATCH_SCORES["prefix"])
+        for field, match in ((0, "substring"), (2, "description"), (1, "source")):
+            for document_id in find(escaped, field):
+                add(document_id, match, MATCH_SCORES[match])
+
+        # Abbreviations of the name, e.g. 'gst' for 'git-status'
+        for document_id in find("^[^\n]*?" + "[^\n]*?".join(map(re.escape, query)), 0):
+            coverage = min(1.0, len(query) / len(documents[document_id][0]))
+            add(document_id, "fuzzy", MATCH_SCORES["fuzzy"] + 0.1 * coverage)
+
+        # Typos that leave at least half the query's trigrams intact in the name or description. Trigrams most
+        # commands share say little about a match, so they are skipped
+        query_grams = get_grams(query)
+        if len(query_grams) > 1 and (not limit or len(matches) < limit):
+            shared: dict[int, int] = {}
+            common = max(GRAM_SIZE, len(document_ids) // 10) * 4
+            for gram in query_grams:
+                postings = data.get("grams", {}).get(gram, "")
+                if len(postings) > common:
+                    continue
+                for posting in postings.split():
+                    shared[int(posting)] = shared.get(int(posting), 0) + 1
+            for document_id, count in shared.items():
+                if count * 2 >= len(query_grams):
+                    add(document_id, "fuzzy", MATCH_SCORES["fuzzy"] * 0.5 + 0.1 * count / len(query_grams))
+
+        def rank(item: tuple[int, tuple[str, float]]) -> tuple[float, str]:
+            return -item[1][1], documents[item[0]][0]
+
+        ranked = heapq.nsmallest(limit, matches.items(), key=rank) if limit else sorted(matches.items(), key=rank)
+        return [{"name": documents[document_id][0], "source": documents[document_id][1],
+                 "description": documents[document_id][2], "match": match, "score": round(score, 3)}
+                for document_id, (match, score) in ranked]
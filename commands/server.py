@@ -0,0 +1,160 @@
+import inspect
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+from typing import Any, Callable, Optional, TextIO
+
+from commands.api import BakeAPI, BakeError
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+BAKE_ERROR = -32000
+
+
+def make_error(request_id: Any, code: int, message: str) -> dict[str, Any]:
+    """
+    Build a JSON-RPC error response.
+
+    :param request_id: The request's id, or None if it couldn't be read.
+    :param code: The error code.
+    :param message: The error message.
+    :return: The response.
+    """
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+class Server:
+    def __init__(self, api: BakeAPI) -> None:
+        """
+        Initializes the Server instance, which answers JSON-RPC 2.0 requests with one BakeAPI. Requests are
+        newline-delimited JSON, and a batch (an array of requests) writes the registry once.
+
+        :param api: The API to call.
+        """
+        self.api = api
+        self.methods: dict[str, Callable[..., Any]] = {
+            "create": api.create_command,
+            "delete": api.delete_command,
+            "list": api.list_commands,
+            "view": api.get_command,
+            "exists": api.command_exists
+        }
+        self.signatures = {name: inspect.signature(method) for name, method in self.methods.items()}
+        # The API isn't thread-safe, so socket connections take turns
+        self.lock = threading.Lock()
+
+    def call(self, request: Any) -> Optional[dict[str, Any]]:
+        """
+        Answer one request.
+
+        :param request: The decoded request.
+        :return: The response, or None for a notification (a request without an id).
+        """
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or \
+                not isinstance(request.get("method"), str):
+            return make_error(None, INVALID_REQUEST, "Invalid request")
+
+        request_id = request.get("id")
+        params = request.get("params", {})
+        method = self.methods.get(request["method"])
+        if not method:
+            response = make_error(request_id, METHOD_NOT_FOUND, f"Method '{request['method']}' not found")
+        elif not isinstance(params, (dict, list)):
+            response = make_error(request_id, INVALID_PARAMS, "Params must be an object or an array")
+        else:
+            signature = self.signatures[request["method"]]
+            try:
+                bound = signature.bind(*params) if isinstance(params, list) else signature.bind(**params)
+            except TypeError as error:
+                response = make_error(request_id, INVALID_PARAMS, str(error))
+            else:
+                try:
+                    response = {"jsonrpc": "2.0", "id": request_id, "result": method(*bound.args, **bound.kwargs)}
+                except BakeError as error:
+                    response = make_error(request_id, BAKE_ERROR, str(error))
+                except Exception as error:
+                    # One bad request mustn't take the resident server down
+                    response = make_error(request_id, INTERNAL_ERROR, f"{type(error).__name__}: {error}")
+        return response if "id" in request else None
+
+    def handle_line(self, line: str) -> Optional[str]:
+        """
+        Answer one line of input.
+
+        :param line: A JSON request or batch of requests.
+        :return: The JSON response, or None if nothing needs an answer.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return json.dumps(make_error(None, PARSE_ERROR, f"Parse error: {error}"))
+
+        with self.lock:
+            if not isinstance(request, list):
+                response = self.call(request)
+                return json.dumps(response) if response else None
+            if not request:
+                return json.dumps(make_error(None, INVALID_REQUEST, "Empty batch"))
+            with self.api.batch():
+                responses = [response for response in map(self.call, request) if response]
+        return json.dumps(responses) if responses else None
+
+    def serve_stream(self, stdin: TextIO, stdout: TextIO) -> None:
+        """
+        Answer requests from a stream until it ends.
+
+        :param stdin: The stream requests are read from.
+        :param stdout: The stream responses are written to.
+        """
+        for line in stdin:
+            if not line.strip():
+                continue
+            response = self.handle_line(line)
+            if response:
+                stdout.write(response + "\n")
+                stdout.flush()
+
+    def serve_socket(self, socket_path: str) -> None:
+        """
+        Answer requests from any number of connections to a Unix socket until interrupted.
+
+        :param socket_path: Path of the socket. A stale socket file left by a previous server is replaced.
+        :raises FileExistsError: If the path is taken by something other than a stale socket.
+        """
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response = server.handle_line(line.decode())
+                    if response:
+                        self.wfile.write(response.encode() + b"\n")
+                        self.wfile.flush()
+
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f"'{socket_path}' already exists and isn't a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.remove(socket_path)  # Nobody is listening, so it was left by a server that died
+            else:
+                raise FileExistsError(f"Another server is already listening on '{socket_path}'")
+            finally:
+                probe.close()
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as unix_server:
+            unix_server.daemon_threads = True
+            try:
+                unix_server.serve_forever()
+            finally:
+                os.remove(socket_path)
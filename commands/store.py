@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Iterable, Optional
+
+SNAPSHOT_MANIFEST = ".bake-snapshot.json"
+# Snapshots and blobs younger than this are never collected, so one being baked isn't removed before its wrapper
+# is written
+GC_GRACE_PERIOD = 3600
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """
+    Hash a file's contents.
+
+    :param path: The file.
+    :return: Hex digest of the contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SnapshotStore:
+    def __init__(self, store_path: str) -> None:
+        """
+        Initializes the SnapshotStore instance, a content-addressed copy of baked scripts on local disk. Every file
+        is stored once as a read-only blob named by the hash of its contents, and a snapshot is a directory of
+        hardlinks to the blobs of a script and its local imports, named by the hash of its file list.
+
+        :param store_path: The store's directory.
+        """
+        self.store_path = store_path
+        self.blobs_path = os.path.join(store_path, "blobs")
+        self.snapshots_path = os.path.join(store_path, "snapshots")
+
+    def is_snapshot(self, target: Optional[str]) -> bool:
+        """
+        Check whether a wrapper's target is a snapshot in this store.
+
+        :param target: The target, or None.
+        :return: True if it is a snapshot.
+        """
+        return bool(target) and os.path.dirname(os.path.normpath(target)) == self.snapshots_path
+
+    def get_blob_path(self, digest: str) -> str:
+        """
+        Get the path of a blob.
+
+        :param digest: The hash of the blob's contents.
+        :return: Path of the blob.
+        """
+        return os.path.join(self.blobs_path, digest[:2], digest)
+
+    def add_blob(self, path: str) -> tuple[str, bool]:
+        """
+        Store a file's contents unless an identical file is already stored.
+
+        :param path: The file.
+        :return: The hash of its contents and whether a new blob was written.
+        """
+        digest = hash_file(path)
+        blob_path = self.get_blob_path(digest)
+        if os.path.exists(blob_path):
+            # Marks the blob as in use for the garbage collector's grace period
+            os.utime(blob_path)
+            return digest, False
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        temp_path = f"{blob_path}.{os.getpid()}.tmp"
+        try:
+            shutil.copyfile(path, temp_path)
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, blob_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return digest, True
+
+    @staticmethod
+    def read_snapshot(snapshot_path: str) -> Optional[dict[str, Any]]:
+        """
+        Read what a snapshot was made from.
+
+        :param snapshot_path: The snapshot directory.
+        :return: The snapshot's source and the hash of each file by relative path, or None if it can't be read.
+        """
+        try:
+            with open(os.path.join(snapshot_path, SNAPSHOT_MANIFEST), "r") as manifest:
+                return json.loads(manifest.read())
+        except (OSError, ValueError):
+            return None
+
+    def snapshot(self, source: str, previous: Optional[str] = None) -> tuple[str, list[str]]:
+        """
+        Snapshot a script and the local modules it imports. Only files whose contents aren't stored yet are
+        copied, and an identical snapshot is reused as is.
+
+        :param source: The script. It becomes the snapshot's __main__.py.
+        :param previous: Optional earlier snapshot of the same command, to report which files changed since.
+        :return: The snapshot directory for the wrapper to run, and the relative paths of files that changed.
+        """
+        from commands.bundle import find_local_files
+
+        files = find_local_files(source)
+        previous_files = (self.read_snapshot(previous) or {}).get("files", {}) if previous else {}
+
+        hashes, changed = {}, []
+        for relative_path in sorted(files):
+            hashes[relative_path], _ = self.add_blob(files[relative_path])
+            if previous_files.get(relative_path) != hashes[relative_path]:
+                changed.append(relative_path)
+
+        tree = "".join(f"{relative_path}\0{digest}\n" for relative_path, digest in hashes.items())
+        snapshot_path = os.path.join(self.snapshots_path, hashlib.sha256(tree.encode()).hexdigest())
+        if os.path.isdir(snapshot_path):
+            os.utime(snapshot_path)
+            return snapshot_path, changed
+
+        staging_path = os.path.join(self.snapshots_path, f".{os.path.basename(snapshot_path)}.{os.getpid()}.tmp")
+        shutil.rmtree(staging_path, ignore_errors=True)
+        for relative_path, digest in hashes.items():
+            target = os.path.join(staging_path, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(self.get_blob_path(digest), target)
+            except OSError:
+                shutil.copyfile(self.get_blob_path(digest), target)
+        with open(os.path.join(staging_path, SNAPSHOT_MANIFEST), "w") as manifest:
+            manifest.write(json.dumps({"source": os.path.abspath(source), "files": hashes}))
+
+        try:
+            os.rename(staging_path, snapshot_path)
+        except OSError:
+            # Another bake made the same snapshot first
+            shutil.rmtree(staging_path, ignore_errors=True)
+            if not os.path.isdir(snapshot_path):
+                raise
+        return snapshot_path, changed
+
+    def collect_garbage(self, referenced: Iterable[str]) -> tuple[int, int]:
+        """
+        Remove snapshots no command runs, then blobs no remaining snapshot holds.
+
+        :param referenced: The snapshot directories baked commands point at.
+        :return: The number of snapshots and blobs removed.
+        """
+        referenced = {os.path.normpath(path) for path in referenced}
+        cutoff = time.time() - GC_GRACE_PERIOD
+        removed_snapshots = removed_blobs = 0
+        live_blobs = set()
+
+        if os.path.isdir(self.snapshots_path):
+            for entry in os.scandir(self.snapshots_path):
+                if entry.path in referenced or entry.stat().st_mtime > cutoff:
+                    live_blobs.update((self.read_snapshot(entry.path) or {}).get("files", {}).values())
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed_snapshots += 1
+
+        if os.path.isdir(self.blobs_path):
+            for folder in os.scandir(self.blobs_path):
+                for entry in os.scandir(folder.path):
+                    if entry.name in live_blobs or entry.stat().st_mtime > cutoff:
+                        continue
+                    os.remove(entry.path)
+                    removed_blobs += 1
+        return removed_snapshots, removed_blobs
@@ -0,0 +1,241 @@
+import json
+import os
+import shlex
+import shutil
+import textwrap
+from enum import Enum
+from typing import Any, Optional
+
+from commands.cache import CACHE_RUNNER, DEFAULT_MAX_BYTES
+from commands.limits import LIMITER
+from commands.telemetry import RECORDER
+from constants import CACHE_FOLDER, DAEMON_FOLDER, DISPATCHER_LOCATION, RUN_FOLDER, TELEMETRY_LOCATION
+from utils.shell import get_current_shell_path
+
+# Every non-legacy wrapper carries its metadata on this comment line so it can be parsed without guessing
+WRAPPER_HEADER = "# bake: "
+
+
+class WrapperMode(Enum):
+    """
+    Representation of the formats a baked command can be written in.
+    """
+    SHELL = "shell"  # Legacy: the user's shell runs the interpreter as a child process
+    EXEC = "exec"  # A minimal /bin/sh wrapper that replaces itself with the interpreter
+    DIRECT = "direct"  # The shebang points straight at the resolved interpreter
+    DAEMON = "daemon"  # Forked from a warm bake daemon, falling back to a cold start when it's down
+    DISPATCH = "dispatch"  # A symlink to the shared bake-run dispatcher, which looks the command up in a table
+
+
+DEFAULT_WRAPPER_MODE = WrapperMode.EXEC
+# The other formats start the resolved interpreter (or the dispatcher) themselves
+SHEBANG_MODES = (WrapperMode.SHELL, WrapperMode.EXEC)
+DEFAULT_INTERPRETER = "python3"
+EXEC_SHEBANG = "#!/bin/sh"
+
+# Client side of the daemon protocol (see commands/daemon.py); anything going wrong before the daemon
+# reports a child pid falls back to exec'ing the interpreter directly
+DAEMON_CLIENT = """import os, sys
+def cold_start():
+    os.execv(INTERPRETER, [INTERPRETER, SOURCE] + sys.argv[1:])
+try:
+    import json, signal, socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(SOCKET)
+    socket.send_fds(client, [b"F"], [0, 1, 2])
+    header = json.dumps({"argv": sys.argv[1:], "env": dict(os.environ), "cwd": os.getcwd()}).encode()
+    client.sendall(len(header).to_bytes(4, "big") + header)
+    replies = client.makefile("r")
+    reply = json.loads(replies.readline() or '{"fallback": true}')
+except (OSError, ValueError):
+    cold_start()
+if reply.get("fallback"):
+    client.close()
+    cold_start()
+for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+    signal.signal(signum, lambda received, frame: os.kill(reply["pid"], received))
+try:
+    reply = json.loads(replies.readline() or '{"exit": 1}')
+except ValueError:
+    reply = {"exit": 1}
+sys.exit(reply["exit"])
+"""
+
+
+def resolve_interpreter(interpreter: str) -> Optional[str]:
+    """
+    Resolve an interpreter to an absolute path.
+
+    :param interpreter: Interpreter name or path.
+    :return: The absolute path of the interpreter, or None if it cannot be found.
+    """
+    if os.path.isabs(interpreter):
+        return interpreter if os.access(interpreter, os.X_OK) else None
+    return shutil.which(interpreter)
+
+
+def render_wrapper(source: str, shebang: Optional[str] = None, interpreter: Optional[str] = None,
+                   mode: WrapperMode = DEFAULT_WRAPPER_MODE, target: Optional[str] = None,
+                   telemetry: bool = False, description: Optional[str] = None,
+                   cache: Optional[dict[str, Any]] = None, limits: Optional[dict[str, Any]] = None) -> str:
+    """
+    Render the contents of a wrapper file.
+
+    :param source: The source of the Python file.
+    :param shebang: Optional shebang for the file. Only shell and exec wrappers take one.
+    :param interpreter: Optional interpreter (defaults to 'python3').
+    :param mode: The wrapper format to render.
+    :param target: Optional compiled build directory, zipapp or snapshot to run instead of the source.
+    :param telemetry: Record every run in the telemetry ring buffer. Only direct wrappers can do this, since they
+                      are the only ones that run the script in-process.
+    :param description: Optional description of the command, for 'bake --search'.
+    :param cache: Optional output cache settings: the 'ttl' in seconds, the names of environment variables
+                  ('env') and paths of input files ('inputs') that are part of each run's key, and whether piped
+                  stdin is too ('stdin', see commands.cache). The script's local imports are found at bake time
+                  and always part of the key. Only direct wrappers cache output.
+    :param limits: Optional concurrency, resource and priority limits, applied before the script starts (see
+                   commands.limits.get_limit_settings). Only direct wrappers enforce limits.
+    :return: The wrapper file contents.
+    """
+    interpreter = interpreter or DEFAULT_INTERPRETER
+    run_path = target or source
+
+    if shebang and mode not in SHEBANG_MODES:
+        raise ValueError(f"A shebang (-s) is only used by shell and exec wrappers, not {mode.value} wrappers")
+    metadata = {"mode": mode.value, "interpreter": interpreter, "source": source}
+    if target:
+        metadata["target"] = target
+    if telemetry:
+        if mode is not WrapperMode.DIRECT:
+            raise ValueError("Telemetry is only recorded by direct wrappers (-w direct)")
+        metadata["telemetry"] = True
+    if description:
+        metadata["description"] = description
+    if cache:
+        if mode is not WrapperMode.DIRECT:
+            raise ValueError("Output is only cached by direct wrappers (-w direct)")
+        metadata["cache"] = cache
+    if limits:
+        if mode is not WrapperMode.DIRECT:
+            raise ValueError("Limits are only enforced by direct wrappers (-w direct)")
+        metadata["limits"] = limits
+
+    if mode is WrapperMode.SHELL:
+        shebang = shebang or "#!" + get_current_shell_path()
+        # Plain legacy wrappers have no header so older versions of bake can still read them
+        header = f"{WRAPPER_HEADER}{json.dumps(metadata)}\n" if target or description else ""
+        return f"{shebang}\n{header}{interpreter} {run_path} $@"
+
+    if mode is WrapperMode.EXEC:
+        shebang = shebang or EXEC_SHEBANG
+        return (f"{shebang}\n"
+                f"{WRAPPER_HEADER}{json.dumps(metadata)}\n"
+                f'exec {shlex.quote(interpreter)} {shlex.quote(run_path)} "$@"\n')
+
+    resolved = resolve_interpreter(interpreter)
+    if not resolved:
+        raise ValueError(f"Interpreter '{interpreter}' could not be resolved to an absolute path")
+    metadata["interpreter"] = resolved
+
+    if mode is WrapperMode.DISPATCH:
+        # Only the metadata is kept, in the command table (see commands/dispatch.py)
+        return f"#!{DISPATCHER_LOCATION}\n{WRAPPER_HEADER}{json.dumps(metadata)}\n"
+
+    if mode is WrapperMode.DAEMON:
+        if target:
+            raise ValueError("Daemon wrappers run the source directly and can't be compiled, bundled or snapshotted")
+        from commands.daemon import get_socket_path
+
+        metadata["socket"] = get_socket_path(source, DAEMON_FOLDER)
+        return (f"#!{resolved}\n"
+                f"{WRAPPER_HEADER}{json.dumps(metadata)}\n"
+                f"INTERPRETER = {resolved!r}\n"
+                f"SOURCE = {source!r}\n"
+                f"SOCKET = {metadata['socket']!r}\n"
+                f"{DAEMON_CLIENT}")
+
+    limiter = f"LIMITS = {limits!r}\nRUN = {RUN_FOLDER!r}\n{LIMITER}" if limits else ""
+    if cache:
+        from commands.bundle import find_local_files
+
+        # Started without site, since a cache hit never imports anything the script needs
+        local_files = sorted(path for path in find_local_files(source).values() if path != os.path.abspath(source))
+        recorder = f"TELEMETRY = {TELEMETRY_LOCATION!r}\n{RECORDER}" if telemetry else ""
+        return (f"#!{resolved} -S\n"
+                f"{WRAPPER_HEADER}{json.dumps(metadata)}\n"
+                f"{limiter}"
+                f"INTERPRETER = {resolved!r}\n"
+                f"RUN_PATH = {run_path!r}\n"
+                f"SOURCE = {source!r}\n"
+                f"LOCALS = {local_files!r}\n"
+                f"CACHE = {CACHE_FOLDER!r}\n"
+                f"TTL = {cache['ttl']!r}\n"
+                f"ENV = {cache.get('env', [])!r}\n"
+                f"INPUTS = {cache.get('inputs', [])!r}\n"
+                f"STDIN = {cache.get('stdin', False)!r}\n"
+                f"MAX_BYTES = {DEFAULT_MAX_BYTES!r}\n"
+                f"{recorder}"
+                f"{CACHE_RUNNER}")
+
+    # Run the source in-process so the only process started is the interpreter itself. Build directories and
+    # zipapps go on sys.path themselves, just like 'python3 <target>' would do
+    search_path = target or os.path.dirname(source)
+    run = (f"sys.argv[0] = {run_path!r}\n"
+           f"sys.path[0] = {search_path!r}\n"
+           f"runpy.run_path({run_path!r}, run_name='__main__')\n")
+    if not telemetry:
+        return f"#!{resolved}\n{WRAPPER_HEADER}{json.dumps(metadata)}\n{limiter}import runpy, sys\n{run}"
+
+    run = textwrap.indent(run, "    ")
+    return (f"#!{resolved}\n"
+            f"{WRAPPER_HEADER}{json.dumps(metadata)}\n"
+            f"{limiter}"
+            f"import os, runpy, sys, time\n"
+            f"ARGV = list(sys.argv)\n"
+            f"COMMAND = os.path.basename(ARGV[0])\n"
+            f"TELEMETRY = {TELEMETRY_LOCATION!r}\n"
+            f"{RECORDER}"
+            f"_bake_start, _bake_code = time.time(), 1\n"
+            f"try:\n"
+            f"{run}"
+            f"    _bake_code = 0\n"
+            f"except SystemExit as e:\n"
+            f"    _bake_code = e.code if isinstance(e.code, int) else int(e.code is not None)\n"
+            f"    raise\n"
+            f"except KeyboardInterrupt:\n"
+            f"    _bake_code = 130\n"
+            f"    raise\n"
+            f"finally:\n"
+            f"    _bake_record(_bake_start, _bake_code)\n")
+
+
+def parse_wrapper(contents: str) -> Optional[dict[str, Any]]:
+    """
+    Parse the contents of a wrapper file in any supported format.
+
+    :param contents: The wrapper file contents.
+    :return: The wrapper's metadata (mode, shebang, interpreter, source and optionally target, telemetry and
+             description), or None if it is not a baked wrapper.
+    """
+    lines = contents.splitlines()
+    if not lines or not lines[0].startswith("#!"):
+        return None
+
+    for line in lines[1:]:
+        if line.startswith(WRAPPER_HEADER):
+            try:
+                metadata = json.loads(line[len(WRAPPER_HEADER):])
+            except ValueError:
+                return None
+            if not isinstance(metadata, dict) or "source" not in metadata:
+                return None
+            metadata.setdefault("mode", DEFAULT_WRAPPER_MODE.value)
+            metadata.setdefault("interpreter", DEFAULT_INTERPRETER)
+            metadata["shebang"] = lines[0]
+            return metadata
+
+    # Legacy wrappers are exactly "<shebang>\n<interpreter> <source> $@"
+    parts = lines[1].split() if len(lines) > 1 else []
+    if len(parts) != 3 or parts[2] != "$@":
+        return None
+    return {"mode": WrapperMode.SHELL.value, "shebang": lines[0], "interpreter": parts[0], "source": parts[1]}
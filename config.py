@@ -1,11 +1,16 @@
 import json
-from typing import Any
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from utils.filesystem import atomic_write, locked
 
 
 class Config:
     def __init__(self, path, data: dict[Any, Any] = None) -> None:
         self.path = path
         self.data = data if data else {}
+        self.lock_path = path + ".lock"
+        self.transaction_depth = 0
 
     def load_config(self) -> dict[Any, Any]:
         """
@@ -23,16 +28,51 @@ class Config:
         """
         return self.data
 
+    @contextmanager
+    def transaction(self) -> Iterator[dict[Any, Any]]:
+        """
+        Locks the config, reloads it from disk and writes it once when the block finishes, so a batch of changes
+        costs one write and changes made by other bake processes in the meantime aren't lost. Nothing is written
+        if the block raises. Nested transactions join the outermost one.
+        :return: Config data to change in place
+        """
+        self.transaction_depth += 1
+        try:
+            if self.transaction_depth > 1:
+                yield self.data
+                return
+
+            with locked(self.lock_path):
+                try:
+                    with open(self.path, "r") as config_file:
+                        data = json.loads(config_file.read())
+                    # Update in place so callers holding the data see the reloaded values
+                    self.data.clear()
+                    self.data.update(data)
+                except (FileNotFoundError, ValueError):
+                    pass  # Nothing (readable) on disk yet, the data in memory is written as is
+                yield self.data
+                atomic_write(self.path, json.dumps(self.data))
+        finally:
+            self.transaction_depth -= 1
+
     def write_config(self, data: dict[Any, Any] = None) -> None:
         """
         Writes config from memory or if passed in to a file path specified.
+        Inside a transaction the write is left to the transaction.
         :param data: If data is passed in it will overwrite what's in memory.
         """
         d = self.data
         if data:
             d = data
-        with open(self.path, "w") as config_file:
-            config_file.write(json.dumps(d))
+        if self.transaction_depth:
+            # The transaction writes when it finishes
+            if d is not self.data:
+                self.data.clear()
+                self.data.update(d)
+            return
+        with locked(self.lock_path):
+            atomic_write(self.path, json.dumps(d))
         self.data = d
 
     def append_config(self, key: Any, value: Any) -> None:
@@ -42,5 +82,5 @@ class Config:
         :param value: Value to add.
         :return: None
         """
-        self.data[key] = value
-        self.write_config()
+        with self.transaction():
+            self.data[key] = value
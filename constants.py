@@ -1,31 +1,9 @@
 import getpass
 import os
 
-import requests
-
-from utils.console import format_msg, MessageType
-
 GITHUB_VERSION_URL = "https://raw.githubusercontent.com/Izaan17/Bake/refs/heads/master/version.txt"
-
-
-def fetch_latest_version() -> float:
-    """
-    Fetches the latest version of Bake from a GitHub URL.
-
-    :return: Latest version of Bake as a float. Returns -1 if an error occurs.
-    """
-    try:
-        response = requests.get(GITHUB_VERSION_URL)
-        response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
-        return float(response.text.strip())  # Ensure we get the version as a float after stripping whitespace
-    except requests.exceptions.RequestException as e:
-        print(format_msg(MessageType.ERROR), f"Error fetching version from GitHub: {e}")
-    except ValueError as e:
-        print(format_msg(MessageType.ERROR), f"Error parsing version: {e}")
-    except Exception as e:
-        print(format_msg(MessageType.ERROR), f"An unexpected error occurred: {e}")
-    return -1
-
+GITHUB_REPO_URL = "https://github.com/Izaan17/Bake.git"
+UPDATE_BRANCH = "master"
 
 # Path configurations
 SCRIPT_NAME = 'bake'
@@ -35,3 +13,20 @@ BAKE_SCRIPT_HOME_FOLDER = os.path.expanduser("~/.local/bin")
 BAKE_SCRIPT_FILE_PATH = os.path.join(BAKE_SCRIPT_HOME_FOLDER, SCRIPT_NAME)
 BAKE_FOLDER = os.path.join(HOME_PATH, '.bake')
 CONFIG_LOCATION = os.path.join(BAKE_FOLDER, "config.json")
+VERSION_CACHE_LOCATION = os.path.join(BAKE_FOLDER, "version_cache.json")
+REGISTRY_LOCATION = os.path.join(BAKE_FOLDER, "registry.json")
+DISPATCHER_LOCATION = os.path.join(BAKE_FOLDER, "bake-run")
+COMMAND_TABLE_LOCATION = os.path.join(BAKE_FOLDER, "commands.table")
+DAEMON_FOLDER = os.path.join(BAKE_FOLDER, "daemons")
+TELEMETRY_LOCATION = os.path.join(BAKE_FOLDER, "telemetry.bin")
+CACHE_FOLDER = os.path.join(BAKE_FOLDER, "cache")
+RUN_FOLDER = os.path.join(BAKE_FOLDER, "run")
+VENV_FOLDER = os.path.join(BAKE_FOLDER, "venvs")
+PACKAGE_STORE_FOLDER = os.path.join(BAKE_FOLDER, "packages")
+SNAPSHOT_STORE_FOLDER = os.path.join(BAKE_FOLDER, "store")
+PROFILES_FOLDER = os.path.join(BAKE_FOLDER, "profiles")
+DOCTOR_CACHE_LOCATION = os.path.join(BAKE_FOLDER, "doctor.json")
+INTERPRETER_CACHE_LOCATION = os.path.join(BAKE_FOLDER, "interpreters.json")
+RELEASES_FOLDER = os.path.join(BAKE_FOLDER, "releases")
+CURRENT_RELEASE_LINK = os.path.join(BAKE_FOLDER, "current")
+PREVIOUS_RELEASE_LINK = os.path.join(BAKE_FOLDER, "previous")
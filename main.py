@@ -1,14 +1,30 @@
+import time
+
+IMPORT_START = time.perf_counter()
+
 import argparse
 import os
 import shutil
+import subprocess
+import sys
+from typing import Any, Optional
 
 import setup
-from commands.handler import CommandHandler
+from commands.cache import DEFAULT_TTL, get_cache_settings
+from commands.handler import LIST_FORMATS, LIST_SORT_KEYS, CommandHandler
+from commands.limits import ON_LIMIT_CHOICES, get_limit_settings
+from commands.wrapper import DEFAULT_WRAPPER_MODE, WrapperMode, resolve_interpreter
 from config import Config
-from constants import CONFIG_LOCATION, fetch_latest_version, HOME_PATH, SCRIPT_NAME, BAKE_SCRIPT_FILE_PATH, \
-    BAKE_SCRIPT_HOME_FOLDER
+from constants import CONFIG_LOCATION, HOME_PATH, SCRIPT_NAME, BAKE_SCRIPT_FILE_PATH, \
+    BAKE_SCRIPT_HOME_FOLDER, DOCTOR_CACHE_LOCATION, INTERPRETER_CACHE_LOCATION, PROFILES_FOLDER, REGISTRY_LOCATION, \
+    TELEMETRY_LOCATION, CACHE_FOLDER, RUN_FOLDER
 from utils.console import MessageType, format_msg, confirm
-from utils.shell import add_path_to_terminal, open_fs, get_current_shell_path, get_current_shell_rc
+from utils.profiling import StartupProfiler
+from utils.shell import add_path_to_terminal, open_fs, get_current_shell_path, get_current_shell_rc, \
+    measure_shell_startup, repair_rc, write_rc
+from utils.version_check import fetch_latest_version, get_version_cache, read_installed_version
+
+IMPORT_END = time.perf_counter()
 
 
 def ensure_install_dir():
@@ -40,8 +56,20 @@ def install_bake():
         exit(1)
 
 
-def get_args() -> argparse.Namespace:
-    """Parse and return command line arguments."""
+def positive_int(value: str) -> int:
+    """Parse a command line value that must be a whole number of at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Build the command line parser."""
+    # Flags taking a command's name or a path use the COMMAND_NAME and PATH metavars, which completion relies on
     parser = argparse.ArgumentParser(prog="Bake", description="Easily bake new commands.", epilog="Made by Izaan")
 
     # Positional arguments
@@ -49,73 +77,684 @@ def get_args() -> argparse.Namespace:
     parser.add_argument("source", help="The python script to run", type=argparse.FileType(), nargs='?')
 
     # Optional Arguments
-    parser.add_argument("-i", "--interpreter", help="Which version of Python to use")
-    parser.add_argument("-s", "--shebang", help="The shebang line to prepend to the script")
+    parser.add_argument("-i", "--interpreter", help="Which Python to use: a path, a name, or a version like 3.11 or "
+                                                    "pypy (with --list, only show commands using it)")
+    parser.add_argument("-s", "--shebang", help="The shebang line to prepend to the script (shell and exec wrappers "
+                                                "only)")
+    parser.add_argument("-w", "--wrapper", help=f"Wrapper format for the baked command (default: "
+                                                f"{DEFAULT_WRAPPER_MODE.value}, or direct with --telemetry, --cache or "
+                                                "limits)",
+                        choices=[mode.value for mode in WrapperMode])
+    parser.add_argument("--telemetry", help="Record each run of the command for 'bake --stats'", action="store_true")
+    parser.add_argument("--description", help="A short description of the command, for 'bake --search'")
+    parser.add_argument("--cache", help="Replay the command's output for runs with the same arguments, working "
+                                        "directory and stdin instead of running it again", action="store_true")
+    parser.add_argument("--cache-ttl", help="With --cache, seconds a cached run stays valid (default: 3600)",
+                        type=int)
+    parser.add_argument("--cache-env", help="With --cache, an environment variable that is part of each run's key "
+                                            "(repeatable)", action="append", metavar="NAME")
+    parser.add_argument("--cache-input", help="With --cache, a file whose changes invalidate cached runs "
+                                              "(repeatable)", action="append", metavar="PATH")
+    parser.add_argument("--cache-stdin", help="With --cache, read piped stdin up front and key on it, instead of "
+                                              "not caching piped runs", action="store_true")
+
+    # Per-command limits, enforced by direct wrappers
+    parser.add_argument("--max-instances", help="Most runs of the command at once", type=int, metavar="N")
+    parser.add_argument("--on-limit", help="With --max-instances, whether extra runs wait for a free slot or exit "
+                                           "with code 75 (default: queue)", choices=ON_LIMIT_CHOICES)
+    parser.add_argument("--max-memory", help="Address space limit of each run", type=int, metavar="MB")
+    parser.add_argument("--max-cpu", help="CPU time limit of each run", type=int, metavar="SECONDS")
+    parser.add_argument("--max-files", help="Open file limit of each run", type=int, metavar="N")
+    parser.add_argument("--nice", help="Scheduling priority of each run, from -20 to 19", type=int)
+    parser.add_argument("--ionice", help="Best-effort I/O priority of each run, from 0 to 7 (Linux)", type=int,
+                        metavar="LEVEL")
+    parser.add_argument("--compile", help="Precompile the script and its local imports at bake time (__file__ then "
+                                          "points into the build, not at the script)", action="store_true")
+    parser.add_argument("--bundle", help="Precompile and pack the script and its local imports into a zipapp "
+                                         "(__file__ then points into the zipapp, not at the script)",
+                        action="store_true")
+    parser.add_argument("--snapshot", help="Run the command from a local copy of the script and its local imports "
+                                           "in ~/.bake/store", action="store_true")
+    parser.add_argument("--venv", help="Give the command its own virtualenv with the packages it imports",
+                        action="store_true")
+    parser.add_argument("--requirements", help="With --venv, install this requirements file instead of the "
+                                               "detected imports", metavar="PATH")
+    parser.add_argument("--wheel-dir", help="With --venv, install offline from this directory of wheels",
+                        metavar="PATH")
     parser.add_argument("-vb", "--verbose", help="Print out more details in each command", action="store_true")
-    parser.add_argument("-vc", "--view", help="View contents of a baked command")
-    parser.add_argument("-e", "--edit", help="Edit a baked command")
-    parser.add_argument("-d", "--delete", help="Delete a baked command")
-    parser.add_argument("-l", "--list", help="List all baked commands", action="store_true")
+    parser.add_argument("-vc", "--view", help="View contents of a baked command", metavar="COMMAND_NAME")
+    parser.add_argument("-e", "--edit", help="Edit a baked command", metavar="COMMAND_NAME")
+    parser.add_argument("-d", "--delete", help="Delete a baked command", metavar="COMMAND_NAME")
+    parser.add_argument("-l", "--list", help="List all baked commands (or those whose names match the glob "
+                                             "COMMAND_NAME)", action="store_true")
+    parser.add_argument("--sort", help="With --list, sort by name (default), modification time, size or last use",
+                        choices=LIST_SORT_KEYS, default="name")
+    parser.add_argument("--broken", help="With --list, only show commands whose source, build or interpreter is "
+                                         "missing", action="store_true")
+    parser.add_argument("--format", help="With --list, the output format (default: table)", choices=LIST_FORMATS,
+                        default="table")
+    parser.add_argument("--offset", help="With --list, skip this many commands", type=int, default=0)
     parser.add_argument("-p", "--print", help="Print the main path", action="store_true")
+    parser.add_argument("--search", help="Find commands by name, source or description", metavar="QUERY")
+    parser.add_argument("--json", help="With --search, --interpreters or --cache-stats, print the results as JSON",
+                        action="store_true")
+    parser.add_argument("--interpreters", help="List the Python interpreters -i can pick from", action="store_true")
+    parser.add_argument("--limit", help="Maximum number of commands to show (default: all for --list, 20 for "
+                                        "--search)", type=int)
+    parser.add_argument("--rebuild", help="Rebuild compiled commands (or just COMMAND_NAME) whose sources changed",
+                        action="store_true")
+    parser.add_argument("--refresh", help="Re-snapshot snapshotted commands (or just COMMAND_NAME) whose files "
+                                          "changed", action="store_true")
+    parser.add_argument("--reindex", help="Rebuild the command registry index from disk", action="store_true")
+    parser.add_argument("--migrate-wrappers", help="Rewrite all baked commands in the given wrapper format",
+                        nargs="?", const=DEFAULT_WRAPPER_MODE.value, choices=[mode.value for mode in WrapperMode])
 
     # Commands for editing and navigation
-    parser.add_argument("-in", "--into", help="CD into baked commands directory")
-    parser.add_argument("-es", "--edit-script", help="Edit the baked command's script")
+    parser.add_argument("-in", "--into", help="CD into baked commands directory", metavar="COMMAND_NAME")
+    parser.add_argument("-es", "--edit-script", help="Edit the baked command's script", metavar="COMMAND_NAME")
+
+    # Warm-interpreter daemons for commands baked with '-w daemon'
+    parser.add_argument("--daemon", help="Start, stop or show the status of a command's daemon",
+                        choices=["start", "stop", "status"])
+    parser.add_argument("--idle-timeout", help="Seconds a daemon stays up without invocations (default: 600)",
+                        type=int)
 
     # Update and version
     parser.add_argument("-u", "--update", help="Update from git", action="store_true")
     parser.add_argument("-fu", "--force-update", help="Force update from git", action="store_true")
+    parser.add_argument("--rollback", help="Switch back to the version used before the last update",
+                        action="store_true")
     parser.add_argument("-v", "--version", help="Outputs current version", action="store_true")
 
+    # Bulk baking
+    parser.add_argument("--from-manifest", help="Bake every command listed in a JSON or TOML manifest",
+                        metavar="PATH")
+    parser.add_argument("--dir", help="Bake every Python script in a directory, named after the script",
+                        metavar="PATH")
+    parser.add_argument("--prune", help="With --from-manifest or --dir, delete commands that aren't listed",
+                        action="store_true")
+    parser.add_argument("--export", help="Write all baked commands to a JSON or TOML manifest", metavar="PATH")
+    parser.add_argument("-j", "--jobs", help="Number of commands written, checked or run at once",
+                        type=positive_int)
+
+    # Telemetry
+    parser.add_argument("--stats", help="Show call counts and latency percentiles of commands baked with "
+                                        "--telemetry (or just COMMAND_NAME)", action="store_true")
+    parser.add_argument("--ndjson", help="With --stats, print every recorded run as NDJSON", action="store_true")
+    parser.add_argument("--cache-stats", help="Show hit rates and savings of commands baked with --cache (or just "
+                                              "COMMAND_NAME)", action="store_true")
+    parser.add_argument("--running", help="Show the runs of commands baked with --max-instances that are running or "
+                                          "queued (or just COMMAND_NAME's)", action="store_true")
+    parser.add_argument("--cache-clear", help="Remove the cached output of every command (or just COMMAND_NAME)",
+                        action="store_true")
+
+    # Shell config
+    parser.add_argument("--repair-rc", help="Compact duplicate PATH lines left in the shell config by older versions",
+                        action="store_true")
+    parser.add_argument("--dry-run", help="Show what would change without changing anything", action="store_true")
+
+    # Diagnostics
+    parser.add_argument("--doctor", help="Check every command (or just COMMAND_NAME) for moved sources, missing "
+                                         "interpreters and scripts that don't compile", action="store_true")
+    parser.add_argument("--fix", help="With --doctor, re-point or remove broken commands", action="store_true")
+    parser.add_argument("--profile-startup", help="Report how long each startup phase took", action="store_true")
+    parser.add_argument("--profile", help="Run a command under -X importtime and cProfile, passing the arguments "
+                                          "after '--', and store the report", metavar="COMMAND_NAME")
+    parser.add_argument("--compare", help="With --profile, compare the latest report with the one before it "
+                                          "(or with REPORT) instead of running", nargs="?", const="",
+                        metavar="REPORT")
+
+    # Fan-out runs
+    parser.add_argument("--run", help="Run a command once per input from --each, passing the arguments after '--' "
+                                      "({} is replaced by the input)", metavar="COMMAND_NAME")
+    parser.add_argument("--each", help="With --run, the file of inputs, one per line ('-' for stdin)",
+                        metavar="PATH")
+    parser.add_argument("--keep-going", help="With --run, keep running the remaining inputs after a failure",
+                        action="store_true")
+
+    # Library server
+    parser.add_argument("--serve", help="Answer JSON-RPC requests on stdin/stdout, or on the Unix socket at PATH, "
+                                        "from one resident process", nargs="?", const="", metavar="PATH")
+
+    # Shell completion
+    parser.add_argument("--completion", help="Print a completion script for the given shell",
+                        choices=["bash", "zsh", "fish"])
+
     # Install globally
     parser.add_argument("--install", help="Install 'bake' command globally", action="store_true")
 
-    return parser.parse_args()
+    return parser
+
+
+def get_args() -> argparse.Namespace:
+    """Parse and return command line arguments."""
+    parser = get_parser()
+
+    # Everything after '--' is passed through to the command being run
+    argv = sys.argv[1:]
+    passthrough = []
+    if "--" in argv:
+        argv, passthrough = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    args = parser.parse_args(argv)
+    args.passthrough = passthrough
+    return args
+
+
+def update_bake(config_data: dict, latest_version: Optional[float] = None) -> None:
+    """
+    Switch to a verified release of the latest version if one was staged in the background, otherwise stage and
+    switch to one in the background so nothing waits on git.
+    """
+    from utils.updater import get_updater
+
+    updater = get_updater(config_data)
+    staged = updater.get_staged()
+    if staged and latest_version is not None and staged["version"] >= latest_version:
+        try:
+            updater.activate(staged["path"])
+        except BlockingIOError:
+            print(format_msg(MessageType.NOTICE), "An update is already in progress")
+            return
+        print(format_msg(MessageType.NOTICE), f"Updated to version {staged['version']} ({staged['commit'][:12]})")
+        return
+
+    updater.update_in_background()
+    print(format_msg(MessageType.NOTICE), "Updating in the background, the new version is used once it has been "
+                                          "verified")
+
+
+def prefetch_update(config_data: dict, latest_version: float) -> None:
+    """Stage the latest version in the background so 'bake -u' can switch to it instantly."""
+    from utils.updater import get_updater
+
+    updater = get_updater(config_data)
+    staged = updater.get_staged()
+    if not staged or staged["version"] < latest_version:
+        updater.update_in_background(activate=False)
+
+
+def rollback_bake(config_data: dict) -> None:
+    """Switch back to the release used before the last update."""
+    from utils.updater import get_updater
+
+    try:
+        release = get_updater(config_data).rollback()
+    except BlockingIOError:
+        print(format_msg(MessageType.ERROR), "An update is in progress, try again once it has finished")
+        return
+    if not release:
+        print(format_msg(MessageType.ERROR), "There is no previous version to roll back to")
+        return
+    commit = f" ({release['commit'][:12]})" if release["commit"] else ""
+    print(format_msg(MessageType.NOTICE), f"Switched back to version {release['version']}{commit}")
+
+
+def manage_daemon(handler: CommandHandler, action: str, command_name: Optional[str],
+                  idle_timeout: Optional[int]) -> None:
+    """Start, stop or report on the daemons of commands baked in daemon mode."""
+    from commands.daemon import DEFAULT_IDLE_TIMEOUT, daemon_status, start_daemon, stop_daemon
+
+    idle_timeout = idle_timeout or DEFAULT_IDLE_TIMEOUT
+    if command_name:
+        if not handler.command_exists(command_name):
+            print(format_msg(MessageType.ERROR), f"Command '{command_name}' does not exist")
+            return
+        command_names = [command_name]
+    elif action == "status":
+        command_names = handler.get_command_names()
+    else:
+        print(format_msg(MessageType.ERROR), f"'--daemon {action}' needs a command name")
+        return
+
+    for name in command_names:
+        wrapper = handler.parse_command(name)
+        if not wrapper or wrapper["mode"] != WrapperMode.DAEMON.value:
+            if command_name:
+                print(format_msg(MessageType.ERROR), f"Command '{name}' is not baked in daemon mode")
+            continue
+
+        socket_path = wrapper["socket"]
+        if action == "start":
+            try:
+                pid = start_daemon(wrapper["interpreter"], wrapper["source"], socket_path, idle_timeout)
+                print(format_msg(MessageType.NOTICE), f"Daemon for '{name}' is running (pid {pid})")
+            except OSError as error:
+                print(format_msg(MessageType.ERROR), f"Failed to start daemon for '{name}': {error}")
+        elif action == "stop":
+            if stop_daemon(socket_path):
+                print(format_msg(MessageType.NOTICE), f"Stopped daemon for '{name}'")
+            else:
+                print(format_msg(MessageType.NOTICE), f"Daemon for '{name}' is not running")
+        else:
+            pid = daemon_status(socket_path)
+            status = f"running (pid {pid})" if pid else "stopped"
+            print(f"{format_msg(MessageType.CMD)} {name:<15} {status}")
+
+
+def repair_shell_rc(config_data: dict[str, Any], dry_run: bool = False) -> None:
+    """Compact the shell config's PATH lines into bake's managed block, timing shell startup around it."""
+    rc_path = get_current_shell_rc()
+    bake_paths = [BAKE_SCRIPT_HOME_FOLDER] + [config_data[key] for key in ("main_path", "rc_path")
+                                              if config_data.get(key)]
+    current, repaired, moved, removed = repair_rc(rc_path, bake_paths)
+    if current == repaired:
+        print(format_msg(MessageType.NOTICE), f"{rc_path} doesn't need repairing")
+        return
+
+    if dry_run:
+        import difflib
+
+        print("".join(difflib.unified_diff(current.splitlines(True), repaired.splitlines(True), rc_path,
+                                           f"{rc_path} (repaired)")), end="")
+        print(format_msg(MessageType.NOTICE), f"Would move {moved} PATH export(s) into bake's block and remove "
+                                              f"{removed} duplicate(s) from {rc_path}")
+        return
+
+    shell_path = get_current_shell_path()
+    before = measure_shell_startup(shell_path)
+    write_rc(rc_path, repaired)
+    after = measure_shell_startup(shell_path)
+
+    print(format_msg(MessageType.NOTICE), f"Moved {moved} PATH export(s) into bake's block and removed {removed} "
+                                          f"duplicate(s) from {rc_path}")
+    if before is not None and after is not None:
+        print(format_msg(MessageType.NOTICE),
+              f"Shell startup: {before * 1000:.1f} ms before, {after * 1000:.1f} ms after")
+
+
+def bake_manifest(handler: CommandHandler, manifest_path: Optional[str], directory: Optional[str], prune: bool,
+                  jobs: Optional[int]) -> None:
+    """Validate and bake a manifest or a directory of scripts, then print a summary table."""
+    from commands.manifest import load_manifest, scan_directory, validate_manifest
+
+    start = time.perf_counter()
+    try:
+        entries = load_manifest(manifest_path) if manifest_path else scan_directory(directory)
+    except (OSError, ValueError, ImportError) as error:
+        print(format_msg(MessageType.ERROR), f"Failed to read manifest: {error}")
+        return
+
+    problems = validate_manifest(entries)
+    if problems:
+        for problem in problems:
+            print(format_msg(MessageType.ERROR), problem)
+        print(format_msg(MessageType.ERROR), "Nothing was baked")
+        return
+
+    results = handler.apply_manifest(entries, prune, jobs)
+    name_width = max([len(name) for name, _ in results] + [15])
+    for name, status in results:
+        print(f"{format_msg(MessageType.CMD)} {name:<{name_width}} {status}")
+
+    counts = {}
+    for _, status in results:
+        outcome = status.split(":")[0]
+        counts[outcome] = counts.get(outcome, 0) + 1
+    summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(counts.items())) or "nothing to do"
+    print(format_msg(MessageType.NOTICE), f"{summary} in {time.perf_counter() - start:.2f}s")
+
+
+def show_stats(command_name: Optional[str], ndjson: bool = False) -> None:
+    """Print the telemetry report, or every recorded run as NDJSON."""
+    from commands.telemetry import aggregate, read_records, to_ndjson
+
+    records = read_records(TELEMETRY_LOCATION, command_name)
+    if ndjson:
+        for line in to_ndjson(records):
+            print(line)
+        return
+
+    stats = aggregate(records)
+    if not stats:
+        print(format_msg(MessageType.NOTICE), "No runs recorded yet. Bake commands with --telemetry to record them.")
+        return
+
+    name_width = max([len(name) for name in stats] + [len("command")])
+    print(f"{'command':<{name_width}} {'calls':>7} {'failed':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  last run")
+    for name, row in sorted(stats.items(), key=lambda item: -item[1]["calls"]):
+        print(f"{name:<{name_width}} {row['calls']:>7} {row['failures']:>7} {row['p50'] * 1000:>9.1f} "
+              f"{row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}  {time.ctime(row['last_run'])}")
+
+
+def show_cache_stats(command_name: Optional[str], as_json: bool = False) -> None:
+    """Print the output cache's hit rates and savings per command."""
+    from commands.cache import read_cache_stats
+
+    stats = read_cache_stats(CACHE_FOLDER, command_name)
+    if as_json:
+        import json
+
+        print(json.dumps(stats, indent=4))
+        return
+    if not stats:
+        print(format_msg(MessageType.NOTICE), "Nothing cached yet. Bake commands with --cache to cache their output.")
+        return
+
+    name_width = max([len(name) for name in stats] + [len("command")])
+    print(f"{'command':<{name_width}} {'hits':>7} {'misses':>7} {'hit rate':>9} {'saved s':>9} {'saved MB':>9} "
+          f"{'entries':>8} {'size MB':>8}")
+    for name, row in sorted(stats.items(), key=lambda item: -item[1]["hits"]):
+        print(f"{name:<{name_width}} {row['hits']:>7} {row['misses']:>7} {row['hit_rate']:>9.1%} "
+              f"{row['time_saved']:>9.2f} {row['bytes_saved'] / 1e6:>9.2f} {row['entries']:>8} "
+              f"{row['size'] / 1e6:>8.2f}")
+
+
+def show_running(command_name: Optional[str]) -> None:
+    """Print the running and queued instances of limited commands, and how long they waited."""
+    from commands.limits import read_running
+
+    runs = [run for run in read_running(RUN_FOLDER) if not command_name or run["command"] == command_name]
+    if not runs:
+        print(format_msg(MessageType.NOTICE), "Nothing running. Bake commands with --max-instances to track them.")
+        return
+
+    now = time.time()
+    name_width = max([len(run["command"]) for run in runs] + [len("command")])
+    print(f"{'command':<{name_width}} {'pid':>7} {'state':<8} {'waited s':>9} {'running s':>10}  args")
+    for run in runs:
+        running = f"{now - run['started']:.1f}" if run["started"] else "-"
+        print(f"{run['command']:<{name_width}} {run['pid']:>7} {run['state']:<8} {run['waited']:>9.1f} "
+              f"{running:>10}  {' '.join(run['argv'])}")
+
 
+def profile_command(handler: CommandHandler, command_name: str, command_args: list[str],
+                    compare: Optional[str]) -> None:
+    """Profile a baked command and print its report, or compare two stored reports."""
+    from commands.profiles import compare_reports, get_report_paths, load_report, profile_command as run_profile
 
-def update_cmd_baker(config, latest_version) -> None:
-    """Update CMD Baker from git."""
-    print(f"{format_msg(MessageType.NOTICE)} Updating...")
-    current_dir = os.getcwd()
-    command_origin = os.path.dirname(__file__)
+    if not handler.command_exists(command_name):
+        print(format_msg(MessageType.ERROR), f"Command '{command_name}' does not exist")
+        return
+
+    if compare is not None:
+        report_paths = get_report_paths(PROFILES_FOLDER, command_name)
+        baselines = [path for path in report_paths[:-1] if os.path.basename(path) == compare] if compare \
+            else report_paths[-2:-1]
+        if not baselines:
+            print(format_msg(MessageType.ERROR), f"No earlier report of '{command_name}' to compare with")
+            return
+
+        print(format_msg(MessageType.NOTICE), f"Comparing {os.path.basename(report_paths[-1])} with "
+                                              f"{os.path.basename(baselines[0])}")
+        rows = compare_reports(load_report(baselines[0]), load_report(report_paths[-1]))
+        for row in rows:
+            before = "-" if row["before"] is None else f"{row['before'] * 1000:.1f}"
+            after = "-" if row["after"] is None else f"{row['after'] * 1000:.1f}"
+            flag = f" {format_msg(MessageType.WARNING)} regressed" if row["regressed"] else ""
+            print(f"{before:>10} {after:>10} ms  {row['metric']}{flag}")
+        regressions = sum(row["regressed"] for row in rows)
+        print(format_msg(MessageType.NOTICE), f"{regressions} regression(s)")
+        return
+
+    wrapper = handler.parse_command(command_name)
+    if not wrapper:
+        print(format_msg(MessageType.ERROR), f"Command '{command_name}' wasn't baked by bake and can't be profiled")
+        return
+
+    interpreter = resolve_interpreter(wrapper["interpreter"]) or wrapper["interpreter"]
+    report_path, report = run_profile(command_name, interpreter, wrapper["source"], command_args, PROFILES_FOLDER)
+    print(format_msg(MessageType.NOTICE), f"Exited with {report['exit_code']} after {report['wall_time'] * 1000:.1f} "
+                                          f"ms, {report['import_time'] * 1000:.1f} ms of it importing")
+    print(format_msg(MessageType.NOTICE), "Slowest imports (cumulative ms):")
+    for entry in report["top_imports"][:10]:
+        print(f"{entry['cumulative'] * 1000:>10.1f}  {entry['module']}")
+    print(format_msg(MessageType.NOTICE), "Hottest functions (cumulative ms, calls):")
+    for entry in report["top_functions"][:10]:
+        print(f"{entry['cumulative'] * 1000:>10.1f} {entry['calls']:>8}  {entry['function']}")
+    print(format_msg(MessageType.NOTICE), f"Report saved to {report_path}")
+
+
+def search_commands(handler: CommandHandler, query: str, limit: Optional[int], as_json: bool = False) -> None:
+    """Print the commands that best match a query."""
+    registry = handler.get_registry()
+    search_index = registry.search_index
+    if not search_index.load():
+        search_index.update(registry.commands or {})
+
+    results = search_index.search(query, limit or 20)
+    if as_json:
+        import json
+
+        print(json.dumps(results, indent=4))
+        return
 
-    # Ensure we're in the correct directory for git operations
-    os.chdir(command_origin)
-    os.system("git pull")  # Perform the update via git
-    os.chdir(current_dir)  # Restore the original working directory
+    if not results:
+        print(format_msg(MessageType.NOTICE), f"No commands match '{query}'")
+        return
+    name_width = max([len(result["name"]) for result in results] + [15])
+    for result in results:
+        print(f"{format_msg(MessageType.CMD)} {result['name']:<{name_width}} {result['match']:<11} "
+              f"{result['description'] or result['source']}")
+
+
+def list_interpreters(as_json: bool = False) -> None:
+    """Print the discovered interpreters and how long discovery took."""
+    from commands.interpreters import InterpreterIndex
+
+    index = InterpreterIndex(INTERPRETER_CACHE_LOCATION)
+    interpreters = index.discover()
+    if as_json:
+        import json
+
+        print(json.dumps({"interpreters": interpreters, "stats": index.stats}, indent=4))
+        return
+
+    for interpreter in interpreters:
+        version = ".".join(map(str, interpreter["version"]))
+        real_path = f" -> {interpreter['real_path']}" if interpreter["real_path"] != interpreter["path"] else ""
+        print(f"{format_msg(MessageType.INTERPRETER)} {interpreter['implementation']:<8} {version:<8} "
+              f"{interpreter['path']}{real_path}")
+    print(format_msg(MessageType.NOTICE), f"Found {len(interpreters)} interpreter(s) in {index.stats['folders']} "
+                                          f"folder(s) in {index.stats['time'] * 1000:.1f} ms "
+                                          f"({index.stats['probed']} probed, {index.stats['cached']} from cache)")
+
+
+def run_each(handler: CommandHandler, command_name: str, inputs_path: Optional[str], command_args: list[str],
+             jobs: Optional[int], keep_going: bool) -> None:
+    """Run a command once per input in parallel with ordered output, then print a summary and exit with failure
+    if any run failed."""
+    from commands.runner import read_inputs, run_each as run_inputs
+
+    wrapper = handler.parse_command(command_name)
+    if not wrapper:
+        print(format_msg(MessageType.ERROR), f"Command '{command_name}' does not exist or wasn't baked by bake")
+        sys.exit(1)
+    if not inputs_path:
+        print(format_msg(MessageType.ERROR), "--run needs the inputs to run over, pass --each FILE or --each -")
+        sys.exit(1)
+
+    interpreter = resolve_interpreter(wrapper["interpreter"]) or wrapper["interpreter"]
+    try:
+        summary = run_inputs(interpreter, wrapper.get("target") or wrapper["source"], command_args,
+                             read_inputs(inputs_path, sys.stdin.buffer), jobs, keep_going, sys.stdout.buffer,
+                             sys.stderr.buffer)
+    except OSError as error:
+        print(format_msg(MessageType.ERROR), f"Failed to read inputs: {error}")
+        sys.exit(1)
+
+    for failure in summary["failed"]:
+        print(format_msg(MessageType.ERROR), f"'{failure['input']}' exited with {failure['returncode']}",
+              file=sys.stderr)
+    skipped = f", {summary['skipped']} skipped" if summary["skipped"] else ""
+    if summary["unread"]:
+        skipped += ", remaining inputs not read"
+    print(format_msg(MessageType.NOTICE), f"Ran {summary['runs']} input(s) in {summary['time']:.2f} s "
+                                          f"({summary['throughput']:.1f}/s, p50 {summary['p50'] * 1000:.0f} ms, "
+                                          f"p95 {summary['p95'] * 1000:.0f} ms, max {summary['max'] * 1000:.0f} ms): "
+                                          f"{len(summary['failed'])} failed{skipped}", file=sys.stderr)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+def run_doctor(handler: CommandHandler, command_name: Optional[str], fix: bool, jobs: Optional[int]) -> None:
+    """Health check the baked commands, optionally repairing them, and print a timed report."""
+    from commands.doctor import Doctor
+
+    if command_name and not handler.command_exists(command_name):
+        print(format_msg(MessageType.ERROR), f"Command '{command_name}' does not exist")
+        return
+
+    start = time.perf_counter()
+    command_names = [command_name] if command_name else handler.get_command_names()
+    commands = {name: (handler.get_command_path(name), handler.parse_command(name)) for name in command_names}
+    results = Doctor(DOCTOR_CACHE_LOCATION).run(commands, jobs, prune=not command_name)
+    elapsed = time.perf_counter() - start
+
+    broken = [result for result in results if result["problems"]]
+    for result in results:
+        if not result["problems"]:
+            if handler.verbose:
+                print(f"{format_msg(MessageType.CMD)} {result['name']:<15} ok ({result['time'] * 1000:.1f} ms)")
+            continue
+        for problem in result["problems"]:
+            print(f"{format_msg(MessageType.ERROR)} {result['name']:<15} {problem['check']}: {problem['message']}")
+        if fix:
+            for action in handler.repair_command(result["name"], result["problems"]):
+                print(f"{format_msg(MessageType.NOTICE)} {result['name']:<15} {action}")
+
+    compiled = sum(result["compiled"] for result in results)
+    cached = sum(result["cached"] for result in results)
+    print(format_msg(MessageType.NOTICE), f"Checked {len(results)} command(s) in {elapsed * 1000:.0f} ms "
+                                          f"({compiled} compiled, {cached} from cache): {len(broken)} with problems")
+
+
+def serve(socket_path: str) -> None:
+    """Answer JSON-RPC requests until stdin closes or the socket server is interrupted."""
+    from commands.api import BakeAPI, BakeError
+    from commands.server import Server
+
+    try:
+        server = Server(BakeAPI())
+    except BakeError as error:
+        print(format_msg(MessageType.ERROR), error, file=sys.stderr)
+        sys.exit(1)
+
+    if not socket_path:
+        server.serve_stream(sys.stdin, sys.stdout)
+        return
+    print(format_msg(MessageType.NOTICE), f"Serving on {socket_path}", file=sys.stderr)
+    import signal
+
+    # Exit through the server's cleanup, which removes the socket
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_socket(socket_path)
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        print(format_msg(MessageType.ERROR), f"Failed to serve on {socket_path}: {error}", file=sys.stderr)
+        sys.exit(1)
 
-    # Update config with the new version
-    config.append_config("version", latest_version)
+
+def is_read_only(args: argparse.Namespace) -> bool:
+    """Check whether the requested operation only reads state and can skip migrations and checks."""
+    return bool(args.list or args.view or args.print or args.version or args.stats or args.completion
+                or args.search or args.interpreters or args.run or args.cache_stats or args.running)
+
+
+def run_read_only(args: argparse.Namespace, handler: CommandHandler, config: Config) -> None:
+    """Handle the operations that only read state."""
+    config_data = config.get_config()
+    if args.list:
+        handler.list_commands(args.sort, args.interpreter, args.broken, args.command_name, args.offset, args.limit,
+                              args.format)
+    elif args.view:
+        handler.view_command(args.view)
+    elif args.print:
+        print(f"{format_msg(MessageType.NOTICE)} {config_data['main_path']}")
+    elif args.stats:
+        show_stats(args.command_name, args.ndjson)
+    elif args.cache_stats:
+        show_cache_stats(args.command_name, args.json)
+    elif args.running:
+        show_running(args.command_name)
+    elif args.search:
+        search_commands(handler, args.search, args.limit, args.json)
+    elif args.interpreters:
+        list_interpreters(args.json)
+    elif args.run:
+        # Only reads bake's state, and skipping the update notice keeps the runs' output clean for pipes
+        run_each(handler, args.run, args.each, args.passthrough, args.jobs, args.keep_going)
+    elif args.completion:
+        from commands.completion import render_completion
+
+        registry = handler.get_registry()
+        if registry and not os.path.exists(registry.names_path):
+            registry.save_names()
+        print(render_completion(args.completion, get_parser(), registry.names_path if registry else os.devnull),
+              end="")
+    elif args.version:
+        print(f"{format_msg(MessageType.NOTICE)} Version: {config_data.get('version')}")
+        if args.verbose:
+            # Metrics of the cached update check
+            for metric, value in sorted(get_version_cache(config_data).get_metrics().items()):
+                print(f"{format_msg(MessageType.NOTICE)} {metric}: {value}")
+
+
+def run_migrations(config: Config, commands_path: str) -> None:
+    """Run the one-time migrations that haven't been recorded in the config yet, in one config write."""
+    config_data = config.get_config()
+    if config_data.get("rc_path") == commands_path and "remove_old_folder" in config_data.get("migrations", []):
+        return
+
+    with config.transaction() as config_data:
+        migrations = config_data.setdefault("migrations", [])
+
+        # Add the command path to terminal
+        if config_data.get("rc_path") != commands_path:
+            add_path_to_terminal(commands_path)
+            config_data["rc_path"] = commands_path
+
+        # Handle name change
+        if "remove_old_folder" not in migrations:
+            old_path = os.path.join(HOME_PATH, 'CMDBaker')
+            if os.path.exists(old_path):
+                print(format_msg(MessageType.NOTICE), "Deleting detected old source bake folder")
+                shutil.rmtree(old_path)
+            migrations.append("remove_old_folder")
 
 
 def main() -> None:
     """Main function to handle command-line operations."""
-    args = get_args()
+    profiler = StartupProfiler()
+    profiler.record("imports", IMPORT_END - IMPORT_START)
+
+    with profiler.phase("arguments"):
+        args = get_args()
+    profiler.enabled = args.profile_startup
 
     if args.install:
         ensure_install_dir()
         install_bake()
         return
 
-    setup.main()  # Initialize settings
+    # The server needs none of the CLI's setup, and answers every request from the same process
+    if args.serve is not None:
+        serve(args.serve)
+        return
 
-    # Load configuration
-    config = Config(CONFIG_LOCATION)
-    config_data = config.load_config()
-    version = config_data.get("version")
-    commands_path = config_data["main_path"]
+    with profiler.phase("setup"):
+        setup.main()  # Initialize settings
 
-    # Add the command path to terminal
-    add_path_to_terminal(commands_path)
+    # Load configuration
+    with profiler.phase("config"):
+        config = Config(CONFIG_LOCATION)
+        config_data = config.load_config()
+        version = config_data.get("version")
+        commands_path = config_data["main_path"]
 
     # Initialize command handler
-    handler = CommandHandler(commands_path, args.verbose)
+    handler = CommandHandler(commands_path, args.verbose, REGISTRY_LOCATION)
+
+    # Read-only operations don't need migrations or installation checks
+    if is_read_only(args):
+        with profiler.phase("command"):
+            run_read_only(args, handler, config)
+        profiler.report()
+        return
 
-    # Handle name change
-    old_path = os.path.join(HOME_PATH, 'CMDBaker')
-    if os.path.exists(old_path):
-        print(format_msg(MessageType.NOTICE), "Deleting detected old source bake folder")
-        shutil.rmtree(old_path)
+    with profiler.phase("migrations"):
+        run_migrations(config, commands_path)
 
     # Self-baking check (if 'bake' command doesn't exist, bake it)
     if not os.path.exists(BAKE_SCRIPT_FILE_PATH):
@@ -129,22 +768,34 @@ def main() -> None:
         try:
             os.remove(BAKE_SCRIPT_FILE_PATH)
             print(format_msg(MessageType.NOTICE), "Successfully deleted old bake command.")
-            config_data["version"] = fetch_latest_version()
-            config.write_config(config_data)
+            config.append_config("version", read_installed_version())
             return main()
         except OSError as error:
             print(format_msg(MessageType.ERROR), f"An error occurred deleting the old bake file: {error}")
             print(format_msg(MessageType.NOTICE), f"You can delete it manually located at: {BAKE_SCRIPT_FILE_PATH}")
 
-    # Handle specific flags like list, delete, update, etc.
-    if args.list:
-        handler.list_commands()
-    elif args.delete:
+    # Notify about updates from the cached check, refreshing it in the background when it's stale
+    with profiler.phase("update check"):
+        version_cache = get_version_cache(config_data)
+        version_cache.refresh_in_background()
+        latest_version = version_cache.get_cached_version()
+        if latest_version and latest_version > version and not (args.update or args.force_update):
+            print(format_msg(MessageType.NOTICE), f"Version {latest_version} is available, run 'bake -u' to update")
+            if config_data.get("prefetch_updates", True):
+                prefetch_update(config_data, latest_version)
+
+    with profiler.phase("command"):
+        run_command(args, handler, config, version)
+    profiler.report()
+
+
+def run_command(args: argparse.Namespace, handler: CommandHandler, config: Config, version: Optional[float]) -> None:
+    """Handle the operations that change state, and baking."""
+    # Handle specific flags like delete, update, etc.
+    if args.delete:
         handler.delete_command(args.delete)
     elif args.edit:
         handler.edit_command(args.edit)
-    elif args.view:
-        handler.view_command(args.view)
     elif args.into:
         if handler.command_exists(args.into):
             source = handler.get_command_source(args.into)
@@ -157,20 +808,55 @@ def main() -> None:
                 print(format_msg(MessageType.ERROR), f"An error occurred changing directories: {error}")
         else:
             print(format_msg(MessageType.ERROR), f"Command '{args.into}' does not exist")
-    elif args.print:
-        print(f"{format_msg(MessageType.NOTICE)} {commands_path}")
+    elif args.doctor:
+        run_doctor(handler, args.command_name, args.fix, args.jobs)
+    elif args.profile:
+        profile_command(handler, args.profile, args.passthrough, args.compare)
+    elif args.daemon:
+        manage_daemon(handler, args.daemon, args.command_name, args.idle_timeout)
+    elif args.rebuild:
+        checked = handler.rebuild_commands(args.command_name)
+        print(f"{format_msg(MessageType.NOTICE)} Checked {checked} compiled command(s)")
+    elif args.refresh:
+        checked = handler.refresh_snapshots(args.command_name)
+        print(f"{format_msg(MessageType.NOTICE)} Checked {checked} snapshotted command(s)")
+    elif args.cache_clear:
+        from commands.cache import clear_cache
+
+        removed = clear_cache(CACHE_FOLDER, args.command_name)
+        print(f"{format_msg(MessageType.NOTICE)} Removed {removed} cached run(s)")
+    elif args.from_manifest or args.dir:
+        bake_manifest(handler, args.from_manifest, args.dir, args.prune, args.jobs)
+    elif args.export:
+        from commands.manifest import write_manifest
+
+        entries = handler.export_manifest()
+        try:
+            write_manifest(args.export, entries)
+        except OSError as error:
+            print(format_msg(MessageType.ERROR), f"Failed to export to {args.export}: {error}")
+            return
+        print(format_msg(MessageType.NOTICE), f"Exported {len(entries)} command(s) to {args.export}")
+    elif args.repair_rc:
+        repair_shell_rc(config.get_config(), args.dry_run)
+    elif args.reindex:
+        indexed = handler.reindex()
+        print(f"{format_msg(MessageType.NOTICE)} Indexed {indexed} command(s)")
+    elif args.migrate_wrappers:
+        migrated = handler.migrate_wrappers(WrapperMode(args.migrate_wrappers))
+        print(f"{format_msg(MessageType.NOTICE)} Migrated {migrated} command(s) to '{args.migrate_wrappers}' wrappers")
     elif args.update:
         # Handle update process
-        latest_version = fetch_latest_version()
+        latest_version = fetch_latest_version(config.get_config())
         if version < latest_version:
             if confirm(f"{format_msg(MessageType.NOTICE)} An update is available. Do you want to update?", True):
-                update_cmd_baker(config, latest_version)
+                update_bake(config.get_config(), latest_version)
         else:
             print(f"{format_msg(MessageType.NOTICE)} No update available.")
     elif args.force_update:
-        update_cmd_baker(config, fetch_latest_version())
-    elif args.version:
-        print(f"{format_msg(MessageType.NOTICE)} Version: {version}")
+        update_bake(config.get_config())
+    elif args.rollback:
+        rollback_bake(config.get_config())
     elif args.edit_script:
         if handler.command_exists(args.edit_script):
             open_fs(handler.get_command_source(args.edit_script))
@@ -189,7 +875,36 @@ def main() -> None:
                 print(f"{format_msg(MessageType.ERROR)} Command '{command_name}' already exists")
                 return
 
-            baked_command = handler.bake_command(args.source.name, args.shebang, args.interpreter)
+            source = os.path.abspath(args.source.name)
+            try:
+                interpreter = handler.find_interpreter(args.interpreter)
+                if args.venv:
+                    interpreter = handler.create_environment(command_name, source, interpreter, args.requirements,
+                                                             args.wheel_dir or config.get_config().get("wheel_dir"))
+                target = None
+                if args.snapshot:
+                    if args.compile or args.bundle:
+                        raise ValueError("--snapshot can't be combined with --compile or --bundle")
+                    target = handler.snapshot_command(command_name, source)
+                elif args.compile or args.bundle:
+                    target = handler.build_command(command_name, source, interpreter, args.bundle)
+                cache = None
+                if args.cache:
+                    cache = get_cache_settings({"ttl": args.cache_ttl or DEFAULT_TTL, "env": args.cache_env,
+                                                "inputs": args.cache_input, "stdin": args.cache_stdin})
+                limits = get_limit_settings({"instances": args.max_instances, "on_limit": args.on_limit,
+                                             "memory": args.max_memory, "cpu": args.max_cpu, "files": args.max_files,
+                                             "nice": args.nice, "ionice": args.ionice}) or None
+                mode = WrapperMode(args.wrapper) if args.wrapper else \
+                    WrapperMode.DIRECT if args.telemetry or cache or limits else DEFAULT_WRAPPER_MODE
+                baked_command = handler.bake_command(source, args.shebang, interpreter, mode, target, args.telemetry,
+                                                     args.description, cache, limits)
+            except ValueError as error:
+                print(f"{format_msg(MessageType.ERROR)} {error}")
+                return
+            except (OSError, subprocess.CalledProcessError) as error:
+                print(f"{format_msg(MessageType.ERROR)} Failed to prepare '{command_name}': {error}")
+                return
             handler.create_command(command_name, baked_command)
             print(f"{format_msg(MessageType.CMD)} Baked '{command_name}'")
 
@@ -1,9 +1,10 @@
 import os
 
 from config import Config
-from constants import CONFIG_LOCATION, fetch_latest_version
+from constants import CONFIG_LOCATION
 from utils.console import MessageType, format_msg
 from utils.filesystem import get_path
+from utils.version_check import read_installed_version
 
 ASCII_LOGO = r"""             _    _       _           
  ___ _____ _| |  | |_ ___| |_ ___ ___ 
@@ -37,7 +38,7 @@ def setup_config() -> bool:
     config_data = {
         "main_path": main_path,
         "is_baked": False,
-        "version": fetch_latest_version()
+        "version": read_installed_version()
     }
 
     # Attempt to write the config file
@@ -16,16 +16,18 @@ class MessageType(Enum):
     INTERPRETER = (Fore.YELLOW, "interpreter")
     PATH = (Fore.GREEN, "path")
     SYMBOL = (Fore.BLUE, "symbol")
+    MODE = (Fore.MAGENTA, "mode")
 
 
-def format_msg(msg_type: MessageType) -> str:
+def format_msg(msg_type: MessageType, color: bool = True) -> str:
     """
     Format a message using the message type specified in the MessageType class.
     :param msg_type: Message type.
+    :param color: Whether to color code the message, e.g. only when writing to a terminal.
     :return: Converted MessageType to color coded string.
     """
-    color, text = msg_type.value
-    return f"[{color}{text}{Fore.RESET}]"
+    code, text = msg_type.value
+    return f"[{code}{text}{Fore.RESET}]" if color else f"[{text}]"
 
 
 def confirm(prompt: str, default: bool = None) -> bool:
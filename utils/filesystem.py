@@ -1,4 +1,8 @@
+import fcntl
 import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 from utils.console import format_msg, MessageType
 
@@ -26,3 +30,49 @@ def get_path(prompt: str, check_if_exists: bool = False, create: bool = False) -
                 continue
 
         return path
+
+
+def atomic_write(path: str, contents: str, mode: Optional[int] = None) -> None:
+    """
+    Replace a file through a temporary file that is fsynced and renamed into place, so readers see either the old
+    or the new contents and a crash never leaves it half-written.
+    :param path: The file to write.
+    :param contents: The new contents.
+    :param mode: Optional permissions for the file.
+    """
+    folder, name = os.path.split(path)
+    temp_path = os.path.join(folder, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, "w") as file:
+            file.write(contents)
+            file.flush()
+            os.fsync(file.fileno())
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # Persist the rename itself
+    folder_fd = os.open(folder or ".", os.O_RDONLY)
+    try:
+        os.fsync(folder_fd)
+    finally:
+        os.close(folder_fd)
+
+
+@contextmanager
+def locked(path: str, blocking: bool = True) -> Iterator[None]:
+    """
+    Hold an exclusive advisory lock on a lock file for the duration of the block. Other processes using the same
+    lock file wait until it is released.
+    :param path: The lock file. It is created if it doesn't exist.
+    :param blocking: Wait for the lock. Otherwise BlockingIOError is raised if another process holds it.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        yield
+    finally:
+        os.close(fd)  # Closing releases the lock
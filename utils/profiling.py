@@ -0,0 +1,50 @@
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class StartupProfiler:
+    def __init__(self, enabled: bool = False) -> None:
+        """
+        Initializes the StartupProfiler instance, which times the phases of a bake invocation.
+
+        :param enabled: Whether a report is printed at all.
+        """
+        self.enabled = enabled
+        self.phases: list[tuple[str, float]] = []
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record a phase that was timed elsewhere.
+
+        :param name: Name of the phase.
+        :param seconds: How long the phase took.
+        """
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the enclosed block as a phase.
+
+        :param name: Name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def report(self) -> None:
+        """
+        Print every recorded phase and the total to stderr, if enabled.
+        """
+        if not self.enabled:
+            return
+
+        name_width = max([len(name) for name, _ in self.phases] + [len("total")])
+        for name, seconds in self.phases:
+            print(f"{name:<{name_width}} {seconds * 1000:8.2f} ms", file=sys.stderr)
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"{'total':<{name_width}} {total * 1000:8.2f} ms", file=sys.stderr)
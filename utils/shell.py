@@ -1,24 +1,159 @@
 import os
+import re
+import statistics
+import subprocess
+import time
+from typing import Optional
 
 from utils.console import MessageType, format_msg
+from utils.filesystem import atomic_write
+
+RC_BLOCK_BEGIN = "# >>> bake >>>"
+RC_BLOCK_END = "# <<< bake <<<"
+# Earlier versions appended one of these on every run
+LEGACY_PATH_EXPORT = re.compile(r'^export PATH=\$PATH:"(.+)"$')
 
 
 def add_path_to_terminal(main_path: str) -> None:
     """
-    Add the given path to the shell's RC (runtime configuration) file.
+    Add the given path to the managed block in the shell's RC (runtime configuration) file.
+    The file is only rewritten when the block changes.
 
     :param main_path: The path to be added to the shell's RC file.
     :return: None
     """
     try:
         rc_path = get_current_shell_rc()
-
-        with open(rc_path, "a") as file:
-            file.write(f'\nexport PATH=$PATH:"{main_path}"\n')
+        contents = read_rc(rc_path)
+        lines, paths = split_managed_block(contents)
+        if main_path in paths:
+            return
+
+        new_contents = render_rc(lines, paths + [main_path])
+        if new_contents != contents:
+            write_rc(rc_path, new_contents)
     except IOError as e:
         print(f"{format_msg(MessageType.ERROR)} Failed to update shell config: {e}")
 
 
+def read_rc(rc_path: str) -> str:
+    """
+    Read a shell RC file.
+
+    :param rc_path: The RC file.
+    :return: Its contents, empty if it doesn't exist yet.
+    """
+    try:
+        with open(rc_path, "r") as file:
+            return file.read()
+    except FileNotFoundError:
+        return ""
+
+
+def write_rc(rc_path: str, contents: str) -> None:
+    """
+    Atomically replace a shell RC file, following symlinks and keeping its permissions.
+
+    :param rc_path: The RC file.
+    :param contents: The new contents.
+    """
+    real_path = os.path.realpath(rc_path)
+    mode = os.stat(real_path).st_mode & 0o7777 if os.path.exists(real_path) else None
+    atomic_write(real_path, contents, mode)
+
+
+def split_managed_block(contents: str) -> tuple[list[str], list[str]]:
+    """
+    Split an RC file into the lines outside bake's managed block and the paths inside it.
+
+    :param contents: The RC file contents.
+    :return: The other lines and the managed paths.
+    """
+    lines, paths = [], []
+    in_block = False
+    for line in contents.splitlines():
+        if line == RC_BLOCK_BEGIN:
+            in_block = True
+        elif line == RC_BLOCK_END:
+            in_block = False
+        elif in_block:
+            match = LEGACY_PATH_EXPORT.match(line)
+            if match and match.group(1) not in paths:
+                paths.append(match.group(1))
+        else:
+            lines.append(line)
+    return lines, paths
+
+
+def render_rc(lines: list[str], paths: list[str]) -> str:
+    """
+    Render an RC file with the managed block at its end.
+
+    :param lines: The lines outside the managed block.
+    :param paths: The paths to export in the managed block.
+    :return: The RC file contents.
+    """
+    while lines and not lines[-1].strip():
+        lines = lines[:-1]
+
+    block = [RC_BLOCK_BEGIN] + [f'export PATH=$PATH:"{path}"' for path in paths] + [RC_BLOCK_END]
+    return "\n".join(lines + ([""] if lines else []) + block) + "\n"
+
+
+def repair_rc(rc_path: str, bake_paths: list[str]) -> tuple[str, str, int, int]:
+    """
+    Compact the duplicate PATH exports earlier versions of bake appended into the managed block. Only exports of
+    paths bake itself manages are moved, along with the blank line bake wrote before each; every other line stays
+    where it is.
+
+    :param rc_path: The RC file.
+    :param bake_paths: The paths bake adds to PATH.
+    :return: The current and the repaired contents, the number of exports moved into the block and the number of
+             duplicate exports removed.
+    """
+    contents = read_rc(rc_path)
+    lines, paths = split_managed_block(contents)
+
+    kept, moved, removed = [], 0, 0
+    for line in lines:
+        match = LEGACY_PATH_EXPORT.match(line)
+        if match and match.group(1) in bake_paths:
+            if match.group(1) in paths:
+                removed += 1
+            else:
+                paths.append(match.group(1))
+                moved += 1
+            # Earlier versions wrote a blank line before every export
+            if kept and not kept[-1].strip():
+                kept.pop()
+        else:
+            kept.append(line)
+
+    if not moved and not removed:
+        return contents, contents, 0, 0
+    return contents, render_rc(kept, paths), moved, removed
+
+
+def measure_shell_startup(shell_path: str, runs: int = 5) -> Optional[float]:
+    """
+    Measure how long an interactive shell takes to start, which includes sourcing its RC file.
+
+    :param shell_path: The shell to start.
+    :param runs: Number of runs; the median is reported.
+    :return: Median startup time in seconds, or None if the shell can't be started.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            subprocess.run([shell_path, "-i", "-c", "exit"], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
 def get_current_shell_path() -> str:
     """
     Get the full path of the current shell.
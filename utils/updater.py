@@ -0,0 +1,331 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from typing import Any, ContextManager, Optional
+
+from config import Config
+from constants import BAKE_SCRIPT_FILE_PATH, CONFIG_LOCATION, CURRENT_RELEASE_LINK, GITHUB_REPO_URL, \
+    PREVIOUS_RELEASE_LINK, RELEASES_FOLDER, UPDATE_BRANCH
+from utils.filesystem import atomic_write, locked
+
+MIRROR_NAME = ".mirror.git"
+RELEASE_MANIFEST = ".bake-release.json"
+STATE_NAME = ".state.json"
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds between background prefetch attempts, so an unreachable remote isn't retried on every run
+PREFETCH_INTERVAL = 60 * 60
+
+
+def run_git(*args: str) -> str:
+    """
+    Run a git command.
+
+    :param args: Arguments to git.
+    :return: Its output, stripped.
+    """
+    return subprocess.run(["git", *args], check=True, capture_output=True, text=True,
+                          stdin=subprocess.DEVNULL).stdout.strip()
+
+
+def read_version(release_path: str) -> float:
+    """
+    Read the version of a release or checkout from its version.txt.
+
+    :param release_path: The release directory.
+    :return: The version.
+    :raises OSError: If version.txt can't be read.
+    :raises ValueError: If it doesn't hold a version.
+    """
+    with open(os.path.join(release_path, "version.txt"), "r") as version_file:
+        return float(version_file.read().strip())
+
+
+def point_link(link_path: str, target: str) -> None:
+    """
+    Atomically point a symlink at a target, replacing whatever was there.
+
+    :param link_path: The symlink.
+    :param target: What it should point at.
+    """
+    temp_path = f"{link_path}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    os.symlink(target, temp_path)
+    os.replace(temp_path, link_path)
+
+
+def read_link(link_path: str) -> Optional[str]:
+    """
+    Read where a release symlink points.
+
+    :param link_path: The symlink.
+    :return: The release directory, or None if the link is missing or dangling.
+    """
+    try:
+        target = os.readlink(link_path)
+    except OSError:
+        return None
+    return target if os.path.isdir(target) else None
+
+
+class Updater:
+    def __init__(self, url: str = GITHUB_REPO_URL, branch: str = UPDATE_BRANCH, releases_path: str = RELEASES_FOLDER,
+                 current_link: str = CURRENT_RELEASE_LINK, previous_link: str = PREVIOUS_RELEASE_LINK) -> None:
+        """
+        Initializes the Updater instance. Releases are exported from a local mirror of the repository into their
+        own directories, verified, and switched to by flipping the 'current' symlink, so the running installation
+        is never modified in place and 'previous' can be restored instantly.
+
+        :param url: The git repository to update from.
+        :param branch: The branch to follow.
+        :param releases_path: Where releases and the mirror live.
+        :param current_link: Symlink to the active release.
+        :param previous_link: Symlink to the release before it.
+        """
+        self.url = url
+        self.branch = branch
+        self.releases_path = releases_path
+        self.current_link = current_link
+        self.previous_link = previous_link
+        self.state = Config(os.path.join(releases_path, STATE_NAME))
+
+    def fetch(self) -> str:
+        """
+        Fetch the branch into the local mirror, cloning it the first time.
+
+        :return: The commit at the tip of the branch.
+        """
+        mirror_path = os.path.join(self.releases_path, MIRROR_NAME)
+        if not os.path.isdir(mirror_path):
+            staging_path = tempfile.mkdtemp(prefix=".mirror-", dir=self.releases_path)
+            os.chmod(staging_path, 0o755)
+            run_git("init", "--quiet", "--bare", staging_path)
+            os.replace(staging_path, mirror_path)
+        run_git("--git-dir", mirror_path, "fetch", "--quiet", "--force", self.url,
+                f"+refs/heads/{self.branch}:refs/heads/{self.branch}")
+        return run_git("--git-dir", mirror_path, "rev-parse", f"refs/heads/{self.branch}")
+
+    @staticmethod
+    def verify(release_path: str) -> float:
+        """
+        Check that a release can run: its version is readable, it compiles, and its entry point imports.
+
+        :param release_path: The release directory.
+        :return: The release's version.
+        :raises OSError: If the version can't be read.
+        :raises ValueError: If the version can't be parsed.
+        :raises subprocess.CalledProcessError: If the release doesn't compile or import.
+        """
+        version = read_version(release_path)
+        subprocess.run([sys.executable, "-m", "compileall", "-q", release_path], check=True,
+                       stdout=subprocess.DEVNULL)
+        subprocess.run([sys.executable, "-c", "import main"], cwd=release_path, check=True,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return version
+
+    def stage(self) -> str:
+        """
+        Fetch the latest commit and export it into a verified release directory, unless it already has one.
+
+        :return: The release directory.
+        """
+        commit = self.fetch()
+        release_path = os.path.join(self.releases_path, commit[:12])
+        if self.read_release(release_path):
+            return release_path
+
+        staging_path = tempfile.mkdtemp(prefix=".staging-", dir=self.releases_path)
+        os.chmod(staging_path, 0o755)
+        try:
+            archive = subprocess.Popen(["git", "--git-dir", os.path.join(self.releases_path, MIRROR_NAME), "archive",
+                                        "--format=tar", commit], stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+            with tarfile.open(fileobj=archive.stdout, mode="r|") as tar:
+                tar.extraction_filter = getattr(tarfile, "data_filter", None)
+                tar.extractall(staging_path)
+            if archive.wait():
+                raise subprocess.CalledProcessError(archive.returncode, "git archive")
+
+            version = self.verify(staging_path)
+            with open(os.path.join(staging_path, RELEASE_MANIFEST), "w") as manifest:
+                manifest.write(json.dumps({"commit": commit, "version": version, "staged": time.time()}))
+            shutil.rmtree(release_path, ignore_errors=True)
+            os.replace(staging_path, release_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        return release_path
+
+    @staticmethod
+    def read_release(release_path: str) -> Optional[dict[str, Any]]:
+        """
+        Read a verified release's manifest.
+
+        :param release_path: The release directory.
+        :return: The release's commit, version and staging time, or None if it isn't a verified release.
+        """
+        try:
+            with open(os.path.join(release_path, RELEASE_MANIFEST), "r") as manifest:
+                return dict(json.loads(manifest.read()), path=release_path)
+        except (OSError, ValueError):
+            return None
+
+    def describe(self, release_path: str) -> dict[str, Any]:
+        """
+        Describe a release, or the git checkout bake was installed from.
+
+        :param release_path: The release directory.
+        :return: Its path, version and commit. The commit is None for a checkout.
+        """
+        release = self.read_release(release_path)
+        if release:
+            return release
+        try:
+            version = read_version(release_path)
+        except (OSError, ValueError):
+            version = None
+        return {"path": release_path, "version": version, "commit": None}
+
+    def get_staged(self) -> Optional[dict[str, Any]]:
+        """
+        Get the newest verified release that isn't active yet.
+
+        :return: The release, or None if there is none.
+        """
+        current_path = read_link(self.current_link)
+        releases = []
+        try:
+            names = os.listdir(self.releases_path)
+        except FileNotFoundError:
+            return None
+        for name in names:
+            release = self.read_release(os.path.join(self.releases_path, name))
+            if release and release["path"] != current_path:
+                releases.append(release)
+        return max(releases, key=lambda release: release["staged"], default=None)
+
+    def lock(self) -> ContextManager[None]:
+        """
+        Take the update lock without waiting, so foreground commands never wait on a background update.
+
+        :return: A context manager holding the lock.
+        :raises BlockingIOError: If another update holds the lock.
+        """
+        os.makedirs(self.releases_path, exist_ok=True)
+        return locked(os.path.join(self.releases_path, ".lock"), blocking=False)
+
+    def activate(self, release_path: str) -> None:
+        """
+        Switch to a release by flipping the 'current' symlink, remembering the old one as 'previous'. Bake's own
+        command is pointed at 'current' so every later run picks up the switch. The first time, 'previous' is the
+        git checkout bake was installed from.
+
+        :param release_path: The release directory.
+        :raises BlockingIOError: If another update holds the lock.
+        """
+        with self.lock():
+            old_path = read_link(self.current_link) or REPO_PATH
+            if old_path != release_path:
+                point_link(self.previous_link, old_path)
+            point_link(self.current_link, release_path)
+            self.finish(release_path)
+            self.prune()
+
+    def rollback(self) -> Optional[dict[str, Any]]:
+        """
+        Switch back to the previous release, keeping the current one as the new 'previous'.
+
+        :return: The restored release's path, version and commit, or None if there is nothing to roll back to.
+        :raises BlockingIOError: If another update holds the lock.
+        """
+        with self.lock():
+            previous_path = read_link(self.previous_link)
+            current_path = read_link(self.current_link)
+            if not previous_path:
+                return None
+            point_link(self.current_link, previous_path)
+            if current_path:
+                point_link(self.previous_link, current_path)
+            self.finish(previous_path)
+            return self.describe(previous_path)
+
+    def finish(self, release_path: str) -> None:
+        """
+        Record the active release's version and make sure bake's command runs whatever 'current' points at.
+
+        :param release_path: The release that became active.
+        """
+        from commands.wrapper import render_wrapper
+
+        version = self.describe(release_path)["version"]
+        if version is not None:
+            Config(CONFIG_LOCATION).append_config("version", version)
+        atomic_write(BAKE_SCRIPT_FILE_PATH, render_wrapper(os.path.join(self.current_link, "main.py")), 0o755)
+
+    def prune(self) -> None:
+        """
+        Delete releases other than the current, previous and newest staged ones, and abandoned staging directories.
+        Only called while holding the update lock.
+        """
+        staged = self.get_staged()
+        keep = {read_link(self.current_link), read_link(self.previous_link), staged and staged["path"]}
+        for name in os.listdir(self.releases_path):
+            path = os.path.join(self.releases_path, name)
+            if name.startswith((".staging-", ".mirror-")) or (not name.startswith(".") and path not in keep):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def update(self, activate: bool = True) -> Optional[str]:
+        """
+        Stage the latest release and optionally switch to it. Does nothing if another update is running.
+
+        :param activate: Switch to the release once it is verified.
+        :return: The staged release directory, or None if another update holds the lock.
+        """
+        try:
+            with self.lock():
+                release_path = self.stage()
+            if activate and release_path != read_link(self.current_link):
+                self.activate(release_path)
+        except BlockingIOError:
+            return None
+        return release_path
+
+    def update_in_background(self, activate: bool = True) -> None:
+        """
+        Run update() in a detached process so the caller never waits on git. Prefetches (activate=False) are
+        attempted at most once per PREFETCH_INTERVAL.
+
+        :param activate: Switch to the release once it is verified.
+        """
+        os.makedirs(self.releases_path, exist_ok=True)
+        if not activate:
+            try:
+                state = self.state.load_config()
+            except (OSError, ValueError):
+                state = {}
+            if time.time() - state.get("prefetch_started", 0) < PREFETCH_INTERVAL:
+                return
+            self.state.append_config("prefetch_started", time.time())
+
+        code = (f"from utils.updater import Updater; "
+                f"Updater({self.url!r}, {self.branch!r}, {self.releases_path!r}, {self.current_link!r}, "
+                f"{self.previous_link!r}).update({activate!r})")
+        try:
+            subprocess.Popen([sys.executable, "-c", code], cwd=REPO_PATH, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError:
+            pass
+
+
+def get_updater(config_data: Optional[dict[Any, Any]] = None) -> Updater:
+    """
+    Create the updater, honoring the config's 'update_url' and 'update_branch' overrides.
+
+    :param config_data: Optional config data.
+    :return: The updater.
+    """
+    config_data = config_data or {}
+    return Updater(config_data.get("update_url", GITHUB_REPO_URL), config_data.get("update_branch", UPDATE_BRANCH))
@@ -0,0 +1,257 @@
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from config import Config
+from constants import GITHUB_VERSION_URL, VERSION_CACHE_LOCATION
+from utils.console import format_msg, MessageType
+
+DEFAULT_TTL = 24 * 60 * 60
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 5
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_installed_version() -> float:
+    """
+    Read the version of the installed copy of Bake from version.txt.
+
+    :return: Installed version of Bake as a float. Returns -1 if it can't be read.
+    """
+    try:
+        with open(os.path.join(REPO_PATH, "version.txt"), "r") as version_file:
+            return float(version_file.read().strip())
+    except (OSError, ValueError):
+        return -1
+
+
+class VersionCache:
+    def __init__(self, path: str = VERSION_CACHE_LOCATION, url: str = GITHUB_VERSION_URL,
+                 ttl: float = DEFAULT_TTL) -> None:
+        """
+        Initializes the VersionCache instance, which remembers the latest published version between runs. Metric
+        counts are appended to a separate counter file, so counting never rewrites the cache, and are folded into
+        the cache when it is next refreshed.
+
+        :param path: Path of the cache file.
+        :param url: URL of the published version.txt.
+        :param ttl: Seconds a cached version is considered fresh.
+        """
+        self.config = Config(path)
+        self.counters_path = os.path.splitext(path)[0] + ".counters"
+        self.url = url
+        self.ttl = ttl
+
+    def load(self) -> dict[Any, Any]:
+        """
+        Load the cache from disk.
+
+        :return: Cache data, empty if there is no readable cache.
+        """
+        try:
+            return self.config.load_config()
+        except (OSError, ValueError):
+            self.config.data = {}
+            return self.config.data
+
+    def count(self, metric: str, amount: float = 1) -> None:
+        """
+        Add to a metric by appending a line to the counter file, a single write without locking or rewriting.
+
+        :param metric: Name of the metric.
+        :param amount: Amount to add.
+        """
+        try:
+            fd = os.open(self.counters_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, f"{metric} {amount}\n".encode())
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    @staticmethod
+    def read_counters(path: str) -> dict[str, float]:
+        """
+        Sum the counts in a counter file.
+
+        :param path: The counter file.
+        :return: The total of each metric. Empty if there is no readable file.
+        """
+        totals = {}
+        try:
+            with open(path, "r") as file:
+                for line in file:
+                    try:
+                        metric, amount = line.split()
+                        value = float(amount) if "." in amount or "e" in amount else int(amount)
+                        totals[metric] = totals.get(metric, 0) + value
+                    except ValueError:
+                        continue  # A line cut short by a crash
+        except OSError:
+            pass
+        return totals
+
+    def fold_counters(self, data: dict[Any, Any]) -> None:
+        """
+        Move the counter file's counts into the cache data. Call inside a transaction.
+
+        :param data: The cache data being written.
+        """
+        # Counts appended from now on go to a new counter file
+        folding_path = f"{self.counters_path}.{os.getpid()}"
+        try:
+            os.replace(self.counters_path, folding_path)
+        except OSError:
+            return
+        metrics = data.setdefault("metrics", {})
+        for metric, amount in self.read_counters(folding_path).items():
+            metrics[metric] = metrics.get(metric, 0) + amount
+        try:
+            os.remove(folding_path)
+        except OSError:
+            pass
+
+    @contextmanager
+    def transaction(self) -> Iterator[dict[Any, Any]]:
+        """
+        Change the cache under its lock, merged with what other bake processes wrote in the meantime. Failing to
+        write the cache is ignored.
+
+        :return: Cache data to change in place.
+        """
+        started = False
+        try:
+            os.makedirs(os.path.dirname(self.config.path), exist_ok=True)
+            with self.config.transaction() as data:
+                started = True
+                yield data
+        except OSError:
+            if not started:
+                yield {}  # Nothing can be written, so the changes are dropped
+
+    def is_fresh(self) -> bool:
+        """
+        Check whether the cached version was checked within the TTL.
+
+        :return: True if the cache is fresh, otherwise False.
+        """
+        return time.time() - self.config.data.get("checked", 0) < self.ttl
+
+    def get_cached_version(self) -> Optional[float]:
+        """
+        Get the cached latest version without touching the network, recording a hit or miss.
+
+        :return: The cached version, or None if nothing is cached yet.
+        """
+        data = self.load()
+        version = data.get("version")
+        self.count("hits" if version is not None and self.is_fresh() else "misses")
+        return version
+
+    def refresh(self) -> float:
+        """
+        Fetch the latest version with a conditional request and strict timeouts, updating the cache.
+
+        :return: Latest version of Bake as a float. Returns -1 if an error occurs.
+        """
+        import requests  # Only network operations pay for importing requests
+
+        data = self.load()
+        headers = {}
+        if data.get("etag"):
+            headers["If-None-Match"] = data["etag"]
+        if data.get("last_modified"):
+            headers["If-Modified-Since"] = data["last_modified"]
+
+        start = time.perf_counter()
+        # Only what this refresh learned is written, merged into the cache as it is on disk by then
+        update = {}
+        try:
+            response = requests.get(self.url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
+            if response.status_code == 304 and data.get("version") is not None:
+                self.count("not_modified")
+                update["version"] = data["version"]
+            else:
+                update["version"] = float(response.text.strip())
+                update["etag"] = response.headers.get("ETag")
+                update["last_modified"] = response.headers.get("Last-Modified")
+            update["checked"] = time.time()
+            return update["version"]
+        except requests.exceptions.RequestException as e:
+            print(format_msg(MessageType.ERROR), f"Error fetching version from {self.url}: {e}")
+            self.count("errors")
+        except ValueError as e:
+            print(format_msg(MessageType.ERROR), f"Error parsing version: {e}")
+            self.count("errors")
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count("refreshes")
+            self.count("refresh_seconds", elapsed)
+            with self.transaction() as data:
+                data.update(update)
+                self.fold_counters(data)
+                data.setdefault("metrics", {})["last_refresh_seconds"] = elapsed
+        return -1
+
+    def refresh_in_background(self) -> None:
+        """
+        Refresh the cache from a detached process if it is stale, so the caller never waits on the network.
+        """
+        self.load()
+        if self.is_fresh() or time.time() - self.config.data.get("refresh_started", 0) < self.ttl / 24:
+            return
+
+        # Record the attempt so concurrent runs don't all spawn a refresh. Checked again under the lock, since
+        # another run may have started one since the cache was loaded
+        started = False
+        with self.transaction() as data:
+            if time.time() - data.get("refresh_started", 0) >= self.ttl / 24:
+                data["refresh_started"] = time.time()
+                started = True
+        if not started:
+            return
+        code = (f"from utils.version_check import VersionCache; "
+                f"VersionCache({self.config.path!r}, {self.url!r}, {self.ttl!r}).refresh()")
+        try:
+            subprocess.Popen([sys.executable, "-c", code], cwd=REPO_PATH, stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError:
+            pass
+
+    def get_metrics(self) -> dict[str, Any]:
+        """
+        Get the cache metrics.
+
+        :return: Hit, miss, error and refresh counts plus refresh latency.
+        """
+        metrics = dict(self.load().get("metrics", {}))
+        for metric, amount in self.read_counters(self.counters_path).items():
+            metrics[metric] = metrics.get(metric, 0) + amount
+        return metrics
+
+
+def fetch_latest_version(config_data: Optional[dict[Any, Any]] = None) -> float:
+    """
+    Fetches the latest version of Bake, bypassing the cache's TTL but still sending a conditional request.
+
+    :param config_data: Optional config data with 'version_url' and 'version_check_ttl' overrides.
+    :return: Latest version of Bake as a float. Returns -1 if an error occurs.
+    """
+    return get_version_cache(config_data).refresh()
+
+
+def get_version_cache(config_data: Optional[dict[Any, Any]] = None) -> VersionCache:
+    """
+    Create the version cache, honoring the config's 'version_url' and 'version_check_ttl' overrides.
+
+    :param config_data: Optional config data.
+    :return: The version cache.
+    """
+    config_data = config_data or {}
+    return VersionCache(VERSION_CACHE_LOCATION, config_data.get("version_url", GITHUB_VERSION_URL),
+                        config_data.get("version_check_ttl", DEFAULT_TTL))